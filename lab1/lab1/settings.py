@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
 import os
+from importlib.util import find_spec
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -43,6 +44,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rest_api.profiling.ProfilingMiddleware',
+    'rest_api.routers.ReplicaMiddleware',
+    'rest_api.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,11 +82,91 @@ WSGI_APPLICATION = 'lab1.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'rest_api.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Keep connections open between requests instead of reconnecting.
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            # Run on every new connection. WAL lets readers work alongside
+            # the writer; NORMAL only syncs at checkpoints, which is safe in
+            # WAL mode; busy_timeout is in ms; negative cache_size is in KiB.
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'busy_timeout': 5000,
+                'mmap_size': 256 * 1024 * 1024,
+                'cache_size': -64 * 1024,
+            },
+        },
+        'TEST': {
+            # A file rather than the shared in-memory database, so tests see
+            # WAL and real locking between threads.
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
+# Read replicas by alias, with their weight for 'weighted' selection. Set
+# DATABASE_REPLICAS=n in the environment to try this locally against n file
+# copies of db.sqlite3, refreshed by `manage.py sync_replicas`.
+DATABASE_REPLICAS = {}
+
+for n in range(1, int(os.environ.get('DATABASE_REPLICAS', 0)) + 1):
+    alias = 'replica%d' % n
+    DATABASES[alias] = dict(
+        DATABASES['default'],
+        NAME=os.path.join(BASE_DIR, 'db.%s.sqlite3' % alias),
+        # Reconnect per request to see the file sync_replicas swapped in.
+        CONN_MAX_AGE=0,
+        OPTIONS={'pragmas': dict(DATABASES['default']['OPTIONS']['pragmas'], query_only=1)},
+        TEST={'MIRROR': 'default'},
+    )
+    DATABASE_REPLICAS[alias] = 1
+
+# 'round-robin' or 'weighted'.
+DATABASE_REPLICA_SELECTION = 'round-robin'
+
+DATABASE_ROUTERS = ['rest_api.routers.ReplicaRouter']
+
+# Server-sent event streams: events kept for Last-Event-ID resumption,
+# events a subscriber may fall behind before it is disconnected, and the
+# keepalive interval in seconds.
+SSE_HISTORY_SIZE = 1000
+SSE_QUEUE_SIZE = 100
+SSE_HEARTBEAT = 15
+
+# Retries of writes that hit SQLITE_BUSY, and the first backoff in seconds.
+SQLITE_BUSY_RETRIES = 5
+
+SQLITE_BUSY_BACKOFF = 0.01
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rate limit counts; point this at a cache shared by all workers.
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'throttle',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # Response cache of the bench command, which empties it between requests.
+    'bench': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bench',
+    },
+}
+
+RESPONSE_CACHE_ALIAS = 'default'
+
+RESPONSE_CACHE_TIMEOUT = 300
+
+THROTTLE_CACHE_ALIAS = 'throttle'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -103,13 +187,112 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.BasicAuthentication',
-        'rest_framework.authentication.SessionAuthentication'
+    # Runs PROFILED_AUTHENTICATION_CLASSES, timed.
+    'DEFAULT_AUTHENTICATION_CLASSES': ('rest_api.profiling.TimedAuthentication',),
+    'DEFAULT_RENDERER_CLASSES': (
+        'rest_api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
+    'DEFAULT_PARSER_CLASSES': (
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'rest_api.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
+    'DEFAULT_THROTTLE_CLASSES': ('rest_api.throttling.WindowThrottle',),
+    # See WindowThrottle for how these names are looked up.
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '600/min',
+        'user': '3000/min',
+        'user.POST': '600/min',
+        'search.anon': '60/min',
+        'search.user': '300/min',
+        'export.anon': '10/hour',
+        'export.user': '60/hour',
+    },
 }
 
+# MessagePack is negotiated only where msgpack is installed.
+if find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] += ('rest_api.renderers.MessagePackRenderer',)
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'] += ('rest_api.renderers.MessagePackParser',)
+
+# Smaller responses are not worth compressing.
+COMPRESSION_MIN_SIZE = 512
+
+BATCH_CREATE_MAX_SIZE = 1000
+
+# Sub-requests per /api/batch call, and ids per ?ids= filter.
+BATCH_MAX_REQUESTS = 50
+
+IDS_FILTER_MAX_SIZE = 500
+
+# How many levels of related objects ?include= may embed.
+INCLUDE_MAX_DEPTH = 2
+
+EXPORT_CHUNK_SIZE = 1000
+
+# Rows removed per transaction when a post or user is deleted with all its
+# comments; at most 999.
+DELETE_BATCH_SIZE = 500
+
+# Threads whose post and comments are all older than this many days are
+# moved to the archive tables by the archive command, this many posts per
+# transaction.
+ARCHIVE_AFTER_DAYS = 90
+
+ARCHIVE_BATCH_SIZE = 100
+
+# Background tasks: worker threads per process (0 leaves them all to the
+# run_tasks command), seconds a run may take before the task is run again,
+# and attempts before a task is marked failed, with the first retry delay
+# in seconds, doubled for each further attempt.
+TASK_WORKERS = 4
+
+TASK_LEASE = 300
+
+TASK_MAX_ATTEMPTS = 5
+
+TASK_RETRY_BACKOFF = 1.0
+
+# Home feeds show the newest FEED_MAX_ENTRIES posts and keep as many
+# comments; a feed is trimmed back to that once it grows FEED_TRIM_SLACK
+# past it. New comments reach the feeds of FEED_FANOUT_BATCH users per
+# transaction, at most 999.
+FEED_MAX_ENTRIES = 500
+
+FEED_TRIM_SLACK = 50
+
+FEED_FANOUT_BATCH = 500
+
+# Hide deleted posts and users at once and leave removing them to the
+# purge_deleted command, run periodically, once they are this many seconds old.
+SOFT_DELETE = False
+
+SOFT_DELETE_PURGE_AFTER = 86400
+
+# Render GET lists from .values() rows instead of the DRF field machinery.
+COMPILED_SERIALIZERS = True
+
+TOKEN_CACHE_SIZE = 10000
+
+TOKEN_CACHE_TTL = 300
+
+# Log queries slower than this many milliseconds, for a sampled fraction of
+# them. None turns the slow query log off.
+PROFILING_SLOW_QUERY_MS = None
+
+PROFILING_SLOW_QUERY_SAMPLE = 0.1
+
+# Tried in order by rest_api.profiling.TimedAuthentication.
+PROFILED_AUTHENTICATION_CLASSES = (
+    'rest_api.authentication.TokenAuthentication',
+    'rest_framework.authentication.BasicAuthentication',
+    'rest_framework.authentication.SessionAuthentication',
+)
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.11/topics/i18n/
@@ -34,14 +34,22 @@ urlpatterns = [
     #url(r'^admin/', admin.site.urls),
     url(r'^$', get_swagger_view(title="Documentation")),
     url(r'^api/posts/$', views.PostList.as_view(), name='post-list'),
+    url(r'^api/posts/stream$', views.PostStream.as_view(), name='post-stream'),
     url(r'^api/posts/(?P<pk>[0-9]+)$', views.PostDetail.as_view(), name='post-detail'),
     url(r'^api/posts/(?P<post>[0-9]+)/comments/$', views.CommentByPostList.as_view(), name='comment-by-post-list'),
+    url(r'^api/posts/(?P<post>[0-9]+)/comments/stream$', views.CommentByPostStream.as_view(), name='comment-by-post-stream'),
     url(r'^api/comments/$', views.CommentList.as_view(), name='comment-list'),
     url(r'^api/comments/(?P<pk>[0-9]+)$', views.CommentDetail.as_view(), name='comment-detail'),
     url(r'^api/users/$', user_list, name='user-list'),
     url(r'^api/users/(?P<pk>[0-9]+)/$', user_detail, name='user-detail'),
+    url(r'^api/export/(?P<kind>posts|comments)/$', views.ExportView.as_view(), name='export'),
+    url(r'^api/batch$', views.BatchView.as_view(), name='batch'),
+    url(r'^api/metrics$', views.MetricsView.as_view(), name='metrics'),
+    url(r'^api/search/$', views.SearchView.as_view(), name='search'),
+    url(r'^api/users/token/$', views.TokenView.as_view(), name='token'),
     url(r'^api/users/(?P<author>[0-9]+)/posts/$', views.PostByUserList.as_view(), name='post-by-user-list'),
     url(r'^api/users/(?P<author>[0-9]+)/comments/$', views.CommentByUserList.as_view(), name='comment-by-user-list'),
+    url(r'^api/users/(?P<pk>[0-9]+)/feed/$', views.FeedView.as_view(), name='user-feed'),
 ]
 
 urlpatterns += [
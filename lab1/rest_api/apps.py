@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class RestApiConfig(AppConfig):
     name = 'rest_api'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import feed, signals
+        from .profiling import install_cursor_timing
+        connection_created.connect(install_cursor_timing)
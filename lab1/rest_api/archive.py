@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.http import Http404
+from django.utils import timezone
+from rest_framework import permissions
+
+from .cache import response_cache
+from .db import retry_on_busy
+from .models import Post, Comment, ArchivedPost, ArchivedComment, FeedEntry
+
+
+def columns(model):
+    return [field.attname for field in model._meta.concrete_fields if field.name != 'archived']
+
+
+def archive_batch(before, size):
+    """
+    Move up to `size` threads to the archive tables: posts created before
+    `before` that have had no comment since, with all their comments.
+    Returns how many posts moved.
+    """
+    recent = Comment.all_objects.filter(post=OuterRef('pk'), created__gte=before)
+    pks = list(Post.objects.filter(created__lt=before).annotate(active=Exists(recent)).filter(
+        active=False).order_by('pk').values_list('pk', flat=True)[:size])
+    if not pks:
+        return 0
+
+    posts = list(Post.objects.filter(pk__in=pks).values(*columns(ArchivedPost)))
+    comments = list(Comment.objects.filter(post__in=pks).values(*columns(ArchivedComment)))
+    ArchivedPost.objects.bulk_create([ArchivedPost(**row) for row in posts])
+    ArchivedComment.objects.bulk_create([ArchivedComment(**row) for row in comments])
+
+    # Hidden comments are not worth archiving; they go with their post. Feeds
+    # only show live threads.
+    FeedEntry.objects.filter(post__in=pks).delete()
+    for queryset in (Comment.all_objects.filter(post__in=pks), Post.all_objects.filter(pk__in=pks)):
+        queryset._raw_delete(queryset.db)
+
+    # Details render the same from the archive; only lists change.
+    scopes = set(['posts', 'comments'])
+    scopes.update('post:%s:comments' % row['id'] for row in posts)
+    scopes.update('user:%s' % row['author_id'] for row in posts + comments)
+    response_cache.bump(*scopes)
+    return len(pks)
+
+
+def archive(older_than=None):
+    """
+    Archive the threads quiet for longer than `older_than`,
+    `ARCHIVE_AFTER_DAYS` by default, `ARCHIVE_BATCH_SIZE` posts per
+    transaction. Returns how many posts moved.
+    """
+    if older_than is None:
+        older_than = timedelta(days=getattr(settings, 'ARCHIVE_AFTER_DAYS', 90))
+    before = timezone.now() - older_than
+    size, total = getattr(settings, 'ARCHIVE_BATCH_SIZE', 100), 0
+    while True:
+        count = retry_on_busy(archive_batch, before, size)
+        total += count
+        if count < size:
+            return total
+
+
+def wants_archive(request):
+    return request.query_params.get('archive', '').lower() in ('1', 'true')
+
+
+class ArchiveMixin(object):
+    """
+    Read archived posts and comments through `archive_queryset`, shaped by
+    `archive_prefetches`: detail views fall back to it when the live row is
+    missing, list views read it instead when asked with `?archive=true`.
+    Archived rows are read-only.
+    """
+    archive_queryset = None
+    archive_prefetches = {}
+
+    def use_archive(self):
+        self.queryset = self.archive_queryset
+        self.related_prefetches = self.archive_prefetches
+
+    def initial(self, request, *args, **kwargs):
+        super(ArchiveMixin, self).initial(request, *args, **kwargs)
+        if request.method in permissions.SAFE_METHODS and wants_archive(request):
+            self.use_archive()
+
+    def get_object(self):
+        try:
+            return super(ArchiveMixin, self).get_object()
+        except Http404:
+            if self.request.method not in permissions.SAFE_METHODS or self.queryset is self.archive_queryset:
+                raise
+        self.use_archive()
+        return super(ArchiveMixin, self).get_object()
@@ -0,0 +1,105 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from .models import Token
+
+
+class TokenCache(object):
+    """
+    Bounded LRU of verified token hashes to users, with a TTL.
+
+    Revocations in this process take effect immediately; other processes
+    pick them up once their entry expires.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return getattr(settings, 'TOKEN_CACHE_SIZE', 10000)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'TOKEN_CACHE_TTL', 300)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        # Views may mutate request.user, so never hand out the shared copy.
+        return copy.copy(user)
+
+    def set(self, key, user):
+        with self._lock:
+            self._entries[key] = (copy.copy(user), time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def revoke(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def revoke_user(self, user_id):
+        with self._lock:
+            for key in [key for key, (user, _) in self._entries.items() if user.pk == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class TokenAuthentication(BaseAuthentication):
+    """
+    Clients authenticate with an "Authorization: Token <key>" header.
+
+    `request.auth` is set to the hashed key.
+    """
+    keyword = 'Token'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+        try:
+            key = Token.hash_key(auth[1].decode())
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+        user = token_cache.get(key)
+        if user is None:
+            try:
+                user = Token.objects.select_related('user').get(key=key).user
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            token_cache.set(key, user)
+
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        return (user, key)
+
+    def authenticate_header(self, request):
+        return self.keyword
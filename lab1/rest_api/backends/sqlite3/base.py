@@ -0,0 +1,32 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite backend that runs the `pragmas` given in OPTIONS on every new
+    connection and can open transactions with BEGIN IMMEDIATE.
+
+    A deferred transaction that reads first and then writes fails with
+    SQLITE_BUSY at once if another writer committed in between, without ever
+    waiting on busy_timeout. Taking the write lock up front lets writers queue
+    on busy_timeout instead.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        self.pragmas = {}
+        self.begin_immediate = False
+
+    def get_connection_params(self):
+        params = super(DatabaseWrapper, self).get_connection_params()
+        self.pragmas = params.pop('pragmas', {})
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super(DatabaseWrapper, self).get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute('PRAGMA %s = %s' % (name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE' if self.begin_immediate else 'BEGIN')
@@ -0,0 +1,75 @@
+import base64
+import io
+import json
+
+from django.core.urlresolvers import Resolver404, resolve
+from django.core.handlers.wsgi import WSGIRequest
+from django.utils.six.moves.urllib.parse import urlsplit
+from rest_framework import status
+
+
+# Headers of the batch request that belong to it alone.
+CONDITIONAL_HEADERS = ('HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE', 'HTTP_IF_UNMODIFIED_SINCE')
+
+
+def sub_request(request, method, url, body, headers):
+    """
+    A WSGI request for `method url` with `body` as JSON, carrying the headers
+    of `request` except conditional ones, overridden by `headers`. Responses
+    are JSON unless `headers` ask otherwise.
+    """
+    parts = urlsplit(url)
+    content = b'' if body is None else json.dumps(body).encode('utf-8')
+    environ = dict(request.META, HTTP_ACCEPT='application/json')
+    for name in CONDITIONAL_HEADERS:
+        environ.pop(name, None)
+    environ.update(('HTTP_' + name.upper().replace('-', '_'), value) for name, value in headers.items())
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': parts.path,
+        'QUERY_STRING': parts.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(content)),
+        'wsgi.input': io.BytesIO(content),
+    })
+    return WSGIRequest(environ)
+
+
+def error(status_code, detail):
+    return {'status': status_code, 'headers': {}, 'body': {'detail': detail}}
+
+
+def dispatch(request, method, url, body=None, headers=None):
+    """
+    Handle one sub-request of a batch through the URL resolver and its view,
+    as the user `request` was authenticated as. Returns its status, headers
+    and body, the latter decoded when it is JSON and base64 encoded, with
+    `"encoding": "base64"`, when a binary renderer made it.
+    """
+    sub = sub_request(request, method, url, body, headers or {})
+    try:
+        match = resolve(sub.path_info)
+    except Resolver404:
+        return error(status.HTTP_404_NOT_FOUND, 'Not found.')
+    if match.url_name == request.resolver_match.url_name:
+        return error(status.HTTP_400_BAD_REQUEST, 'Batches cannot be nested.')
+
+    # What rest_framework.test.force_authenticate() does: the views skip
+    # authentication and see the batch's user and token.
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+    sub.resolver_match = match
+
+    response = match.func(sub, *match.args, **match.kwargs)
+    if response.streaming:
+        return error(status.HTTP_400_BAD_REQUEST, 'Streaming responses cannot be batched.')
+    if hasattr(response, 'render'):
+        response.render()
+
+    result = {'status': response.status_code, 'headers': dict(response.items())}
+    if getattr(getattr(response, 'accepted_renderer', None), 'render_style', 'text') == 'binary':
+        return dict(result, body=base64.b64encode(response.content).decode('ascii'), encoding='base64')
+    content = response.content.decode(response.charset)
+    if response.get('Content-Type', '').startswith('application/json') and content:
+        content = json.loads(content)
+    return dict(result, body=content)
@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import prefetch_related_objects
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .signals import post_bulk_create
+
+
+def bulk_create(model, instances, batch_size=None):
+    """
+    `bulk_create` that also sets primary keys on backends which cannot
+    return them, such as SQLite.
+
+    Must run inside a transaction: SQLite then holds the write lock from the
+    first INSERT, so the new rows are the highest ids in the table.
+    """
+    using = router.db_for_write(model)
+    connection = connections[using]
+    assert connection.in_atomic_block, 'bulk_create() must run inside a transaction.'
+
+    # Django inserts rows that already have a key first, so the rest still
+    # end up with the highest ids.
+    missing = [instance for instance in instances if instance.pk is None]
+    model.objects.using(using).bulk_create(instances, batch_size)
+    if not missing or connection.features.can_return_ids_from_bulk_insert:
+        return instances
+
+    last = model.objects.using(using).order_by('-pk').values_list('pk', flat=True)[0]
+    for pk, instance in enumerate(missing, start=last - len(missing) + 1):
+        instance.pk = pk
+    return instances
+
+
+class BulkCreateMixin(object):
+    """
+    Accept a JSON array on `create` and insert every item in one transaction.
+
+    The whole batch is validated first; if any item fails, nothing is written
+    and the response lists errors per item. Views supply the fields set on
+    every item through `get_create_kwargs()`.
+    """
+
+    def get_create_kwargs(self):
+        return {}
+
+    def perform_create(self, serializer):
+        serializer.save(**self.get_create_kwargs())
+
+    def create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return super(BulkCreateMixin, self).create(request, *args, **kwargs)
+
+        max_size = getattr(settings, 'BATCH_CREATE_MAX_SIZE', 1000)
+        if len(request.data) > max_size:
+            raise ValidationError('Batches are limited to %d items.' % max_size)
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        self.perform_bulk_create(serializer)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def perform_bulk_create(self, serializer):
+        model = serializer.child.Meta.model
+        extra = self.get_create_kwargs()
+        instances = [model(**dict(item, **extra)) for item in serializer.validated_data]
+
+        with transaction.atomic():
+            bulk_create(model, instances)
+            post_bulk_create.send(sender=model, instances=instances)
+
+        prefetch_related_objects(instances, *self.get_queryset()._prefetch_related_lookups)
+        serializer.instance = instances
@@ -0,0 +1,138 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+
+from .routers import replicas
+
+
+class ResponseCache(object):
+    """
+    Rendered response cache keyed on per-scope generation counters.
+
+    Every cached entry records the generations of the scopes it was built
+    from. Writes bump the counters of the scopes they touch, which makes the
+    old keys unreachable without having to find or delete them. Entries keep
+    the ETag of the response.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+    def generations(self, scopes):
+        keys = ['generation:' + scope for scope in scopes]
+        found = self.cache.get_many(keys)
+        for key in keys:
+            if key not in found:
+                # Seed from the clock so an evicted counter never comes back
+                # at a value some stale entry was keyed on.
+                self.cache.add(key, int(time.time() * 1000), None)
+                found[key] = self.cache.get(key)
+        return [found[key] for key in keys]
+
+    def bump(self, *scopes):
+        for scope in scopes:
+            key = 'generation:' + scope
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                self.cache.add(key, int(time.time() * 1000), None)
+
+    def get_key(self, request, scopes):
+        if replicas():
+            # A body read from a lagging replica can be stored under
+            # generations bumped since; sync_replicas retires them all.
+            scopes = list(scopes) + ['replicas']
+        user = request.user
+        parts = [
+            request.build_absolute_uri(),
+            request.accepted_renderer.format,
+            request.accepted_media_type,
+            str(user.pk) if user.is_authenticated else 'anon',
+        ]
+        parts.extend(str(generation) for generation in self.generations(scopes))
+        return 'response:' + hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        entry = self.cache.get(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            return None
+
+        content, content_type, etag = entry
+        response = HttpResponse(content, content_type=content_type)
+        if etag is not None:
+            response['ETag'] = etag
+        response['X-Cache'] = 'HIT'
+        return response
+
+    def set(self, key, response):
+        self.cache.set(key, (response.content, response['Content-Type'], response.get('ETag')), self.timeout)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+response_cache = ResponseCache()
+
+
+class CachedResponseMixin(object):
+    """
+    Serve `list` and `retrieve` from `response_cache`.
+
+    `cache_scopes` lists the generation counters a response depends on and is
+    formatted with the URL kwargs, e.g. `('post:{pk}',)`.
+    """
+    cache_scopes = ()
+
+    def get_cache_scopes(self):
+        scopes = [scope.format(**self.kwargs) for scope in self.cache_scopes]
+        if self.request.query_params.get('include'):
+            # Embedded objects and their counters can come from any post or
+            # comment, and every write of those bumps one of these.
+            scopes.extend(['posts', 'comments'])
+        return scopes
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super(CachedResponseMixin, self).list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super(CachedResponseMixin, self).retrieve, request, *args, **kwargs)
+
+    def cached(self, handler, request, *args, **kwargs):
+        # The browsable API embeds per-session markup such as CSRF tokens.
+        if request.accepted_renderer.format == 'api':
+            return handler(request, *args, **kwargs)
+
+        key = response_cache.get_key(request, self.get_cache_scopes())
+        cached = response_cache.get(key)
+        if cached is not None:
+            # The ETag was computed with the body, so no validator query.
+            if cached.has_header('ETag'):
+                return get_conditional_response(request, etag=cached['ETag'], response=cached) or cached
+            return cached
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['X-Cache'] = 'MISS'
+            response.add_post_render_callback(lambda rendered: response_cache.set(key, rendered))
+        return response
@@ -0,0 +1,208 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.urls import get_script_prefix
+from rest_framework import permissions
+from rest_framework import fields as drf_fields
+from rest_framework.relations import HyperlinkedRelatedField, ManyRelatedField, PKOnlyObject, RelatedField
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+
+# Fields whose to_representation() returns database values unchanged.
+PASSTHROUGH_FIELDS = (
+    drf_fields.ReadOnlyField, drf_fields.IntegerField, drf_fields.CharField, drf_fields.BooleanField,
+)
+
+# Fields that render something other than a single column.
+UNSUPPORTED_FIELDS = (
+    BaseSerializer, RelatedField, drf_fields.SerializerMethodField, drf_fields.HiddenField,
+)
+
+# Reversed in place of a primary key to find where it goes in a URL.
+PK_SENTINEL = 918273645546372819
+
+
+def url_template(field):
+    """
+    Split the URL `field` renders into the parts before and after the pk.
+    """
+    url = field.to_representation(PKOnlyObject(pk=PK_SENTINEL))
+    prefix, suffix = url.split(str(PK_SENTINEL))
+    return prefix, suffix
+
+
+class CompiledSerializer(object):
+    """
+    Render `.values()` rows exactly as a serializer would render instances.
+
+    Every rendered field is reduced to a column and an optional conversion up
+    front, so rendering a row is one dict lookup and at most one call per
+    field. Hyperlinks are built by string concatenation from a template, and
+    to-many hyperlinks are filled in with one query per relation.
+    """
+
+    def __init__(self, model, columns, accessors, many):
+        self.model = model
+        self.columns = columns
+        self.accessors = accessors
+        self.many = many
+
+    def render(self, rows):
+        pk = self.model._meta.pk.attname
+        related = {}
+        for name, (model, fk, prefix, suffix) in self.many.items():
+            urls = {row[pk]: [] for row in rows}
+            if urls:
+                # Same default ordering as the prefetch the serializer would use.
+                values = model._default_manager.filter(**{fk + '__in': list(urls)}).values_list(fk, 'pk')
+                for owner, value in values:
+                    urls[owner].append(prefix + str(value) + suffix)
+            related[name] = urls
+
+        data = []
+        for row in rows:
+            item = {}
+            for name, column, convert in self.accessors:
+                if column is None:
+                    item[name] = related[name][row[pk]]
+                    continue
+                value = row[column]
+                item[name] = value if convert is None or value is None else convert(value)
+            data.append(item)
+        return data
+
+
+def source_column(model, source_attrs):
+    """
+    The `.values()` column for a dotted field source, or None if some part of
+    it is not a model field.
+    """
+    parts = []
+    for attr in source_attrs:
+        if model is None:
+            return None
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return None
+        parts.append(attr)
+        model = field.related_model if field.is_relation else None
+    return '__'.join(parts)
+
+
+def compile_serializer(serializer, model=None):
+    """
+    Compile the fields of `serializer` into a `CompiledSerializer` for rows of
+    `model`, by default its own, or return None if any rendered field needs
+    the full serializer machinery.
+    """
+    model = model or serializer.Meta.model
+    columns = set([model._meta.pk.attname])
+    accessors = []
+    many = {}
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+
+        if isinstance(field, ManyRelatedField):
+            child = field.child_relation
+            relation = model._meta.get_field(field.source)
+            if not (isinstance(child, HyperlinkedRelatedField) and child.lookup_field == 'pk'
+                    and relation.one_to_many):
+                return None
+            many[name] = (relation.related_model, relation.field.attname) + url_template(child)
+            accessors.append((name, None, None))
+        elif isinstance(field, HyperlinkedRelatedField):
+            column = source_column(model, field.source_attrs)
+            if field.lookup_field != 'pk' or column is None or '__' in column:
+                return None
+            prefix, suffix = url_template(field)
+            columns.add(column)
+            accessors.append((name, column, lambda value, prefix=prefix, suffix=suffix: prefix + str(value) + suffix))
+        elif isinstance(field, UNSUPPORTED_FIELDS):
+            return None
+        else:
+            column = source_column(model, field.source_attrs)
+            if column is None:
+                return None
+            columns.add(column)
+            convert = None if isinstance(field, PASSTHROUGH_FIELDS) else field.to_representation
+            accessors.append((name, column, convert))
+    return CompiledSerializer(model, sorted(columns), accessors, many)
+
+
+class CompiledCache(object):
+    """
+    Bounded LRU of compiled serializers, including the ones that could not be
+    compiled, so each field selection is compiled once per process.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return getattr(settings, 'COMPILED_SERIALIZER_CACHE_SIZE', 256)
+
+    def get(self, key, compile):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        compiled = compile()
+        with self._lock:
+            self._entries[key] = compiled
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+compiled_cache = CompiledCache()
+
+
+def selection_key(request):
+    """
+    Everything about `request` that changes which fields a serializer renders
+    or the URLs its hyperlinks point to.
+    """
+    params = request.query_params
+    return (
+        request.method in permissions.SAFE_METHODS,
+        tuple(params.get(param, '') for param in ('fields', 'expand', 'omit', 'include')),
+        request.build_absolute_uri(get_script_prefix()),
+    )
+
+
+class CompiledListMixin(object):
+    """
+    Serve `list` from `.values()` rows through a `CompiledSerializer`.
+
+    Output is identical to the regular path, which is still used when the
+    serializer has fields that cannot be compiled or `COMPILED_SERIALIZERS`
+    is off.
+    """
+
+    def list(self, request, *args, **kwargs):
+        compiled = None
+        if getattr(settings, 'COMPILED_SERIALIZERS', True):
+            model = self.queryset.model
+            key = (self.get_serializer_class(), model, self.format_kwarg) + selection_key(request)
+            compiled = compiled_cache.get(key, lambda: compile_serializer(self.get_serializer(), model))
+        if compiled is None:
+            return super(CompiledListMixin, self).list(request, *args, **kwargs)
+
+        columns = set(compiled.columns)
+        columns.update(getattr(self.paginator, 'ordering', ()))
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None).values(*columns)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compiled.render(page))
+        return Response(compiled.render(list(queryset)))
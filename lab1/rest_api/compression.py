@@ -0,0 +1,159 @@
+import gzip
+import io
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Only API payloads are compressed. HTML pages of the browsable API embed
+# CSRF tokens, which compression would expose to BREACH.
+COMPRESSIBLE_TYPES = (
+    'application/json', 'application/x-ndjson', 'application/msgpack', 'text/event-stream', 'text/plain',
+)
+
+GZIP_LEVEL = 6
+
+# Brotli's default of 11 is meant for static files; 4 compresses better than
+# gzip at about the same speed.
+BROTLI_QUALITY = 4
+
+
+def accepted_encodings(header):
+    """
+    The codings of an `Accept-Encoding` header with a non-zero q-value.
+    """
+    accepted = set()
+    for item in header.split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+def choose_encoding(header):
+    accepted = accepted_encodings(header)
+    if brotli is not None and ('br' in accepted or '*' in accepted):
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def encoded_etag(etag, encoding):
+    """
+    `"abc"` as `"abc-gzip"`: a strong ETag names the exact bytes, so each
+    encoding of a resource gets its own.
+    """
+    return etag[:-1] + '-%s"' % encoding if etag.endswith('"') else etag
+
+
+def decode_etags(header, encoded):
+    """
+    The ETags of an `If-Match` or `If-None-Match` header as the view made
+    them, with encodings taken off. `encoded` maps them back.
+    """
+    etags = []
+    for etag in parse_etags(header):
+        for encoding in ('br', 'gzip'):
+            suffix = '-%s"' % encoding
+            if etag.endswith(suffix):
+                encoded[etag[:-len(suffix)] + '"'] = etag
+                etag = etag[:-len(suffix)] + '"'
+                break
+        etags.append(etag)
+    return ', '.join(etags)
+
+
+def compress(encoding, content):
+    if encoding == 'br':
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    buffer = io.BytesIO()
+    with gzip.GzipFile(mode='wb', compresslevel=GZIP_LEVEL, fileobj=buffer, mtime=0) as f:
+        f.write(content)
+    return buffer.getvalue()
+
+
+def compress_stream(encoding, chunks):
+    """
+    Compress `chunks` as they come, flushing after each one so that events
+    and rows reach the client without waiting for more output.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+class CompressionMiddleware(object):
+    """
+    Compress API responses with brotli, when installed, or gzip, as the
+    client's `Accept-Encoding` allows.
+
+    Responses under `COMPRESSION_MIN_SIZE` bytes are sent as they are;
+    streaming responses are always compressed, chunk by chunk. Compressed
+    responses get the encoding appended to their ETag, which is taken off
+    conditional request headers again before views compare them, and
+    `Vary: Accept-Encoding` keeps caches from mixing the encodings.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        encoded = {}
+        for header in ('HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH'):
+            if header in request.META:
+                request.META[header] = decode_etags(request.META[header], encoded)
+        response = self.get_response(request)
+        if response.status_code == 304 and response.get('ETag') in encoded:
+            # Confirm the representation the client has, not the plain one.
+            response['ETag'] = encoded[response['ETag']]
+        return self.process_response(request, response)
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in COMPRESSIBLE_TYPES or response.status_code == 206 \
+                or response.has_header('Content-Encoding') \
+                or 'no-transform' in response.get('Cache-Control', ''):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(encoding, response.streaming_content)
+            del response['Content-Length']
+        else:
+            if len(response.content) < getattr(settings, 'COMPRESSION_MIN_SIZE', 512):
+                return response
+            compressed = compress(encoding, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        if response.has_header('ETag'):
+            response['ETag'] = encoded_etag(response['ETag'], encoding)
+        return response
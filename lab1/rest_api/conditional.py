@@ -0,0 +1,87 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The resource has been modified.'
+    default_code = 'precondition_failed'
+
+
+class ConditionalMixin(object):
+    """
+    ETag support checked before any serialization.
+
+    Views implement `get_validators()`, returning from a cheap query the
+    parts hashed into the ETag, which must change whenever the
+    representation does, or `None` to skip the checks, e.g. when the
+    resource does not exist and the view should produce its usual 404.
+    Responses with embedded objects are not conditional.
+
+    There is no Last-Modified: deleted comments, counters and renamed
+    authors change a representation without moving any `updated` date, so
+    If-Modified-Since would get stale 304s. Clients revalidate with
+    If-None-Match instead.
+
+    Goes after CachedResponseMixin, which answers from the ETag of a cached
+    response without calling `get_validators()`.
+    """
+
+    def get_validators(self):
+        raise NotImplementedError('`get_validators()` must be implemented.')
+
+    def get_etag(self):
+        # Validators only describe the resource itself, not what ?include=
+        # embeds in it.
+        if self.request.query_params.get('include'):
+            return None
+
+        parts = self.get_validators()
+        if parts is None:
+            return None
+
+        # Query parameters such as ?fields= select a different representation.
+        parts = [self.request.accepted_renderer.format, self.request.GET.urlencode()] + [str(part) for part in parts]
+        return '"%s"' % hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super(ConditionalMixin, self).list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super(ConditionalMixin, self).retrieve, request, *args, **kwargs)
+
+    def conditional(self, handler, request, *args, **kwargs):
+        etag = self.get_etag()
+        if etag is None:
+            return handler(request, *args, **kwargs)
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+        return response
+
+    def update(self, request, *args, **kwargs):
+        response = super(ConditionalMixin, self).update(request, *args, **kwargs)
+        # Hand back the new validator so the next If-Match needs no GET.
+        etag = self.get_etag()
+        if etag is not None:
+            response['ETag'] = etag
+        return response
+
+    def check_preconditions(self):
+        if get_conditional_response(self.request, etag=self.get_etag()) is not None:
+            raise PreconditionFailed()
+
+    def perform_update(self, serializer):
+        self.check_preconditions()
+        super(ConditionalMixin, self).perform_update(serializer)
+
+    def perform_destroy(self, instance):
+        self.check_preconditions()
+        super(ConditionalMixin, self).perform_destroy(instance)
@@ -0,0 +1,59 @@
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+
+
+def is_busy(error):
+    message = str(error)
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def retry_on_busy(func, *args, **kwargs):
+    """
+    Run `func` in a write transaction, retrying with jittered exponential
+    backoff while SQLite reports the database as locked.
+
+    On the SQLite backend in rest_api.backends the transaction takes the
+    write lock up front, so writers queue on busy_timeout; the retries cover
+    waits longer than that. Inside an outer transaction nothing can be
+    retried, so `func` just runs in a savepoint.
+    """
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        with transaction.atomic():
+            return func(*args, **kwargs)
+
+    retries = getattr(settings, 'SQLITE_BUSY_RETRIES', 5)
+    backoff = getattr(settings, 'SQLITE_BUSY_BACKOFF', 0.01)
+    for attempt in range(retries + 1):
+        connection.begin_immediate = True
+        try:
+            with transaction.atomic():
+                connection.begin_immediate = False
+                return func(*args, **kwargs)
+        except OperationalError as e:
+            if attempt == retries or not is_busy(e):
+                raise
+        finally:
+            connection.begin_immediate = False
+        time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+class BusyRetryMixin(object):
+    """
+    Run the writes of generic views through `retry_on_busy`.
+    """
+
+    def perform_create(self, serializer):
+        retry_on_busy(super(BusyRetryMixin, self).perform_create, serializer)
+
+    def perform_update(self, serializer):
+        retry_on_busy(super(BusyRetryMixin, self).perform_update, serializer)
+
+    def perform_destroy(self, instance):
+        retry_on_busy(super(BusyRetryMixin, self).perform_destroy, instance)
+
+    def perform_bulk_create(self, serializer):
+        retry_on_busy(super(BusyRetryMixin, self).perform_bulk_create, serializer)
@@ -0,0 +1,155 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .cache import response_cache
+from .db import retry_on_busy
+from .models import Post, Comment, ArchivedPost, ArchivedComment, Profile
+from .signals import post_bulk_delete
+
+
+def batch_size():
+    # Keys go in one IN (...), which SQLite caps at 999 parameters.
+    return getattr(settings, 'DELETE_BATCH_SIZE', 500)
+
+
+def dependents(instance):
+    """
+    The rows deleting `instance` cascades to, leaves first, so that stopping
+    half way never leaves a comment without its post.
+    """
+    if isinstance(instance, Post):
+        return [Comment.all_objects.filter(post=instance)]
+    if isinstance(instance, User):
+        return [
+            ArchivedComment.objects.filter(post__author=instance),
+            ArchivedComment.objects.filter(author=instance),
+            ArchivedPost.objects.filter(author=instance),
+            Comment.all_objects.filter(post__author=instance),
+            Comment.all_objects.filter(author=instance),
+            Post.all_objects.filter(author=instance),
+        ]
+    return []
+
+
+def delete_batch(queryset, size, soft=False):
+    """
+    Delete up to `size` rows of `queryset` with one DELETE, or hide them
+    with one UPDATE when `soft`, and send `post_bulk_delete` for them instead
+    of loading each row and its signals. Returns how many rows there were.
+    """
+    model = queryset.model
+    names = ['pk'] + [field.attname for field in model._meta.concrete_fields if field.is_relation]
+    rows = list(queryset.order_by('pk').values_list(*names)[:size])
+    if not rows:
+        return 0
+
+    batch = model._base_manager.filter(pk__in=[row[0] for row in rows])
+    if soft:
+        batch.update(deleted=timezone.now())
+    else:
+        # What QuerySet.delete() runs when no signals are connected.
+        batch._raw_delete(batch.db)
+    post_bulk_delete.send(sender=model, instances=[model(**dict(zip(names, row))) for row in rows])
+    return len(rows)
+
+
+def purge_batch(queryset, size):
+    """
+    Delete up to `size` rows of `queryset` that are already hidden, and so
+    already accounted for, without any signal.
+    """
+    pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:size])
+    if pks:
+        batch = queryset.model._base_manager.filter(pk__in=pks)
+        batch._raw_delete(batch.db)
+    return len(pks)
+
+
+def in_batches(func, queryset, *args):
+    """
+    Run `func` over `queryset` until it is empty, each batch in a transaction
+    of its own so that other writers get the database in between.
+    """
+    size, total = batch_size(), 0
+    while True:
+        count = retry_on_busy(func, queryset, size, *args)
+        total += count
+        if count < size:
+            return total
+
+
+def hide_user(user):
+    Profile.objects.filter(user=user).update(deleted=timezone.now())
+    # Saving is_active also drops the user's cached tokens.
+    user.is_active = False
+    user.save(update_fields=['is_active'])
+    response_cache.bump('usernames', 'user:%s' % user.pk)
+
+
+def cascade_delete(instance, soft=None):
+    """
+    Delete a post or user and everything that cascades from it in batches
+    of `DELETE_BATCH_SIZE` rows.
+
+    With `soft`, which defaults to the `SOFT_DELETE` setting, rows are only
+    hidden, for `purge_deleted()` to remove later.
+    """
+    if soft is None:
+        soft = getattr(settings, 'SOFT_DELETE', False)
+
+    for queryset in dependents(instance):
+        if queryset.model in (ArchivedPost, ArchivedComment):
+            # Archived rows are hidden along with their author.
+            if not soft:
+                in_batches(delete_batch, queryset)
+            continue
+        in_batches(delete_batch, queryset.filter(deleted__isnull=True), soft)
+        if not soft:
+            in_batches(purge_batch, queryset.filter(deleted__isnull=False))
+
+    if not soft:
+        # Only the row itself is left, with whatever was added since, its
+        # profile and tokens: a small job for the regular collector.
+        retry_on_busy(instance.delete)
+    elif isinstance(instance, User):
+        retry_on_busy(hide_user, instance)
+    else:
+        retry_on_busy(delete_batch, type(instance).objects.filter(pk=instance.pk), 1, True)
+
+
+def purge_deleted(older_than=None):
+    """
+    Remove the rows hidden more than `older_than` ago, `SOFT_DELETE_PURGE_AFTER`
+    by default. Returns how many comments, posts and users were removed.
+    """
+    if older_than is None:
+        older_than = timedelta(seconds=getattr(settings, 'SOFT_DELETE_PURGE_AFTER', 86400))
+    before = timezone.now() - older_than
+
+    # Comments added to a post while it was being hidden go with it.
+    in_batches(delete_batch, Comment.objects.filter(post__deleted__lt=before))
+    comments = in_batches(purge_batch, Comment.all_objects.filter(deleted__lt=before))
+    posts = in_batches(purge_batch, Post.all_objects.filter(deleted__lt=before))
+
+    users = 0
+    for user in User.objects.filter(profile__deleted__lt=before):
+        cascade_delete(user, soft=False)
+        users += 1
+    return comments, posts, users
+
+
+class CascadeDeleteMixin(object):
+    """
+    Destroy through `cascade_delete()`. Goes before BusyRetryMixin: the
+    batches are transactions of their own, so other writers interleave
+    with a long delete instead of waiting for all of it.
+    """
+
+    def perform_destroy(self, instance):
+        # Checked once, up front: deleting the dependents changes the ETag.
+        if hasattr(self, 'check_preconditions'):
+            self.check_preconditions()
+        cascade_delete(instance)
@@ -0,0 +1,195 @@
+import collections
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class Event(object):
+    """
+    One server-sent event. The payload is encoded once, when the event is
+    first sent.
+    """
+
+    def __init__(self, id, channel, name, data):
+        self.id = id
+        self.channel = channel
+        self.name = name
+        self._data = data
+        self._encoded = None
+
+    def encode(self):
+        if self._encoded is None:
+            self._encoded = format_event(self.name, self._data, self.id)
+        return self._encoded
+
+
+def format_event(name, data, id=None):
+    message = 'event: %s\ndata: %s\n\n' % (name, JSONRenderer().render(data).decode('utf-8'))
+    if id is not None:
+        message = 'id: %d\n' % id + message
+    return message.encode('utf-8')
+
+
+class Subscription(object):
+    """
+    A subscriber's queue of events. When a subscriber falls more than `size`
+    events behind it is marked `overflowed` rather than buffering without
+    bound; it is expected to reconnect and resume from the broker's history.
+    """
+
+    def __init__(self, channel, size):
+        self.channel = channel
+        self.size = size
+        self.overflowed = False
+        self._events = collections.deque()
+        self._condition = threading.Condition(threading.Lock())
+
+    def put(self, event):
+        with self._condition:
+            if len(self._events) >= self.size:
+                self.overflowed = True
+            else:
+                self._events.append(event)
+            self._condition.notify()
+
+    def get(self, timeout):
+        """
+        Wait up to `timeout` seconds for events and return all queued ones.
+        """
+        with self._condition:
+            if not self._events and not self.overflowed:
+                self._condition.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+
+class Broker(object):
+    """
+    In-process fan-out of events to the subscribers of a channel.
+
+    The last `SSE_HISTORY_SIZE` events are kept so that reconnecting clients
+    can resume after their `Last-Event-ID`. Ids are seeded from the clock, so
+    ids from before a restart are never mistaken for newer ones.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(int(time.time() * 1000))
+        self._channels = {}
+        self.history = collections.deque(maxlen=getattr(settings, 'SSE_HISTORY_SIZE', 1000))
+
+    def publish(self, channel, name, data):
+        with self._lock:
+            event = Event(next(self._ids), channel, name, data)
+            self.history.append(event)
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+        return event
+
+    def subscribe(self, channel, last_event_id=None):
+        """
+        Return a new subscription to `channel`, and whether events after
+        `last_event_id` may have been missed because they are no longer in
+        the history. Events still in the history are queued right away.
+        """
+        subscription = Subscription(channel, getattr(settings, 'SSE_QUEUE_SIZE', 100))
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscription)
+            if last_event_id is None:
+                return subscription, False
+            oldest = self.history[0].id if self.history else None
+            missed = oldest is None or oldest > last_event_id + 1
+            for event in self.history:
+                if event.id > last_event_id and event.channel == channel:
+                    subscription._events.append(event)
+        return subscription, missed
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._channels.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._channels[subscription.channel]
+
+    def subscribers(self, channel):
+        with self._lock:
+            return len(self._channels.get(channel, ()))
+
+
+broker = Broker()
+
+
+def event_stream(channel, last_event_id=None):
+    """
+    Yield the encoded events of `channel` as they are published, with a
+    comment line every `SSE_HEARTBEAT` seconds to keep idle connections open
+    and to notice clients that went away.
+
+    A `reset` event tells the client that events since `last_event_id` are
+    gone and it should refetch the list instead.
+    """
+    heartbeat = getattr(settings, 'SSE_HEARTBEAT', 15)
+    subscription, missed = broker.subscribe(channel, last_event_id)
+    try:
+        yield ('retry: %d\n\n' % getattr(settings, 'SSE_RETRY_MS', 3000)).encode('utf-8')
+        if missed:
+            yield format_event('reset', {})
+        while True:
+            events = subscription.get(heartbeat)
+            for event in events:
+                yield event.encode()
+            if subscription.overflowed:
+                return
+            if not events:
+                yield b': keepalive\n\n'
+    finally:
+        broker.unsubscribe(subscription)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets stream views negotiate `text/event-stream`; the events themselves
+    bypass rendering. Errors are sent as a single `error` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_event('error', data)
+
+
+class EventStreamMixin(object):
+    """
+    Serve `get_channel()` as a `text/event-stream`, resuming after the
+    `Last-Event-ID` header or `?last_event_id=` when given.
+    """
+    renderer_classes = (EventStreamRenderer,)
+
+    def get_channel(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        last_event_id = request.META.get('HTTP_LAST_EVENT_ID') or request.query_params.get('last_event_id')
+        if last_event_id:
+            try:
+                last_event_id = int(last_event_id)
+            except ValueError:
+                raise ValidationError('Last-Event-ID must be the id of a received event.')
+        else:
+            last_event_id = None
+
+        response = StreamingHttpResponse(event_stream(self.get_channel(), last_event_id),
+                                         content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Keep proxies such as nginx from buffering the stream.
+        response['X-Accel-Buffering'] = 'no'
+        return response
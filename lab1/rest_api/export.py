@@ -0,0 +1,57 @@
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Post, Comment
+from .pagination import keyset_filter
+
+EXPORT_ORDERING = ('created', 'id')
+
+EXPORTS = {
+    'posts': (Post, ('id', 'author_id', 'author__username', 'title', 'text', 'created', 'updated')),
+    'comments': (Comment, ('id', 'author_id', 'author__username', 'post_id', 'text', 'created', 'updated')),
+}
+
+
+def export_rows(kind, after=None, chunk_size=1000):
+    """
+    Yield every row of `kind` as a dict, in `(created, id)` order.
+
+    Rows are read in keyset batches of `chunk_size`, so memory stays flat
+    regardless of table size and no query ever scans past its own batch.
+    `after` is a `(created, id)` watermark taken from a previously exported
+    row; export resumes right after it.
+    """
+    model, columns = EXPORTS[kind]
+    queryset = model.objects.order_by(*EXPORT_ORDERING).values(*columns)
+    while True:
+        batch = queryset if after is None else keyset_filter(queryset, EXPORT_ORDERING, after)
+        rows = list(batch[:chunk_size])
+        for row in rows:
+            row['author'] = row.pop('author__username')
+            yield row
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1]['created'], rows[-1]['id'])
+
+
+def parse_watermark(created, id):
+    """
+    Turn the `created` and `id` of an exported row back into a watermark.
+    Raises `ValidationError` for malformed values.
+    """
+    return (Post._meta.get_field('created').to_python(created), Post._meta.pk.to_python(id))
+
+
+class ExportEncoder(DjangoJSONEncoder):
+    # Keep microseconds: exported timestamps double as resume watermarks.
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super(ExportEncoder, self).default(o)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=ExportEncoder) + '\n'
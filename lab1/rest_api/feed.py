@@ -0,0 +1,95 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Exists, F, OuterRef, Q
+
+from .db import retry_on_busy
+from .models import Comment, FeedEntry, Profile
+from .tasks import on_created
+
+
+def max_entries():
+    return getattr(settings, 'FEED_MAX_ENTRIES', 500)
+
+
+def readers():
+    # Users whose feeds are written at all.
+    return User.objects.filter(is_active=True, profile__deleted__isnull=True)
+
+
+def trim(user_ids):
+    """
+    Cut the feeds of `user_ids` that grew `FEED_TRIM_SLACK` entries past
+    `FEED_MAX_ENTRIES` back to their newest `FEED_MAX_ENTRIES`, so a feed is
+    trimmed once per slack entries written rather than on every write.
+    """
+    limit = max_entries()
+    over = Profile.objects.filter(
+        user__in=user_ids, feed_size__gt=limit + getattr(settings, 'FEED_TRIM_SLACK', 50))
+    for user_id in list(over.values_list('user_id', flat=True)):
+        entries = FeedEntry.objects.filter(user=user_id)
+        entries.filter(pk__in=entries.order_by('-created', '-id').values('pk')[limit:]).delete()
+        Profile.objects.filter(user=user_id).update(feed_size=entries.count())
+
+
+def write(user_ids, post_id, comment_id, created):
+    # Tasks may run twice: replace what an earlier run wrote.
+    FeedEntry.objects.filter(user__in=user_ids, post=post_id, comment=comment_id).delete()
+    FeedEntry.objects.bulk_create([
+        FeedEntry(user_id=user_id, post_id=post_id, comment_id=comment_id, created=created)
+        for user_id in user_ids])
+    Profile.objects.filter(user__in=user_ids).update(feed_size=F('feed_size') + 1)
+    trim(user_ids)
+
+
+def deliver(user_ids, post_id, comment_id, created):
+    """
+    Add a comment on a post to the feeds of `user_ids`, `FEED_FANOUT_BATCH`
+    users per transaction.
+    """
+    user_ids = list(user_ids)
+    size = getattr(settings, 'FEED_FANOUT_BATCH', 500)
+    for start in range(0, len(user_ids), size):
+        retry_on_busy(write, user_ids[start:start + size], post_id, comment_id, created)
+
+
+def fed_comments(user):
+    """
+    The live comments `user` is fed: comments by others on posts `user`
+    wrote, or had commented on before.
+    """
+    earlier = Comment.objects.filter(post=OuterRef('post'), author=user, pk__lt=OuterRef('pk'))
+    return Comment.objects.annotate(joined=Exists(earlier)).filter(
+        Q(post__author=user) | Q(joined=True), post__deleted__isnull=True).exclude(author=user)
+
+
+@on_created(Comment)
+def fan_out_comments(pks):
+    """
+    A new comment goes to the feeds of the post's author and of whoever had
+    commented on the post before, except the comment's own author. Posts
+    are not fanned out; feeds read the newest `FEED_MAX_ENTRIES` of them
+    from the posts table.
+    """
+    comments = Comment.objects.filter(pk__in=pks).values_list(
+        'pk', 'post_id', 'post__author_id', 'author_id', 'created')
+    for pk, post_id, post_author_id, author_id, created in comments:
+        commenters = Comment.objects.filter(post=post_id, pk__lt=pk).values('author')
+        recipients = readers().filter(Q(pk=post_author_id) | Q(pk__in=commenters)).exclude(pk=author_id)
+        deliver(recipients.order_by('pk').values_list('pk', flat=True), post_id, pk, created)
+
+
+def rebuild(user):
+    """
+    Rewrite the feed of `user` from the live comments, as
+    `fan_out_comments()` would have written it. Returns how many entries it
+    has.
+    """
+    FeedEntry.objects.filter(user=user).delete()
+    rows = list(fed_comments(user).order_by('-created', '-id').values_list(
+        'pk', 'post_id', 'created')[:max_entries()])
+    # Oldest first, so that ids follow creation as they do for fanned out entries.
+    FeedEntry.objects.bulk_create([
+        FeedEntry(user=user, post_id=post_id, comment_id=pk, created=created)
+        for pk, post_id, created in reversed(rows)])
+    Profile.objects.filter(user=user).update(feed_size=len(rows))
+    return len(rows)
@@ -0,0 +1,24 @@
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+class IdsFilter(BaseFilterBackend):
+    """
+    `?ids=1,2,3` keeps only the objects with those primary keys, in one
+    `pk__in` query. Pages still hold at most `page_size` of them.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        value = request.query_params.get('ids')
+        if value is None:
+            return queryset
+
+        try:
+            ids = set(int(id) for id in value.split(',') if id)
+        except ValueError:
+            raise ValidationError({'ids': ['Must be a comma separated list of ids.']})
+        max_size = getattr(settings, 'IDS_FILTER_MAX_SIZE', 500)
+        if len(ids) > max_size:
+            raise ValidationError({'ids': ['At most %d ids are allowed.' % max_size]})
+        return queryset.filter(pk__in=sorted(ids))
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from rest_api.archive import archive
+
+
+class Command(BaseCommand):
+    help = 'Move threads that have gone quiet to the archive tables, a batch at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=None,
+                            help='Days since the last post or comment; defaults to ARCHIVE_AFTER_DAYS.')
+
+    def handle(self, *args, **options):
+        older_than = options['older_than']
+        posts = archive(None if older_than is None else timedelta(days=older_than))
+        self.stdout.write('Archived %d posts.' % posts)
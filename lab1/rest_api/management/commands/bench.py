@@ -0,0 +1,213 @@
+import json
+from contextlib import ExitStack
+import random
+import threading
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connections, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from rest_api.bulk import bulk_create
+from rest_api.cache import response_cache
+from rest_api.feed import rebuild
+from rest_api.models import Post, Comment, Profile, Token
+from rest_api.signals import post_bulk_create
+
+# (label, method, url for a seeded dataset, body). Every named API route in
+# lab1/urls.py should appear at least once; the docs page is not timed.
+ENDPOINTS = (
+    ('post-list', 'get', lambda d: reverse('post-list'), None),
+    ('post-list expanded', 'get', lambda d: reverse('post-list') + '?expand=comments', None),
+    ('post-list ids', 'get', lambda d: reverse('post-list') + '?ids=%d,%d' % (d['post'], d['post'] + 1), None),
+    ('post-create', 'post', lambda d: reverse('post-list'), {'title': 'title', 'text': 'text'}),
+    ('post-detail included', 'get',
+     lambda d: reverse('post-detail', args=[d['post']]) + '?include=author,comments.author', None),
+    ('post-stream', 'get', lambda d: reverse('post-stream'), None),
+    ('post-detail', 'get', lambda d: reverse('post-detail', args=[d['post']]), None),
+    ('comment-by-post-list', 'get', lambda d: reverse('comment-by-post-list', args=[d['post']]), None),
+    ('comment-by-post-stream', 'get', lambda d: reverse('comment-by-post-stream', args=[d['post']]), None),
+    ('comment-create', 'post', lambda d: reverse('comment-by-post-list', args=[d['post']]), {'text': 'text'}),
+    ('comment-list', 'get', lambda d: reverse('comment-list'), None),
+    ('comment-detail', 'get', lambda d: reverse('comment-detail', args=[d['comment']]), None),
+    ('user-list', 'get', lambda d: reverse('user-list'), None),
+    ('user-detail', 'get', lambda d: reverse('user-detail', args=[d['user']]), None),
+    ('post-by-user-list', 'get', lambda d: reverse('post-by-user-list', args=[d['user']]), None),
+    ('comment-by-user-list', 'get', lambda d: reverse('comment-by-user-list', args=[d['user']]), None),
+    ('user-feed', 'get', lambda d: reverse('user-feed', args=[d['reader']]), None),
+    ('search', 'get', lambda d: reverse('search') + '?q=' + d['word'], None),
+    ('batch', 'post', lambda d: reverse('batch'),
+     [{'method': 'GET', 'url': url} for url in ('/api/posts/', '/api/comments/', '/api/users/')]),
+    ('metrics', 'get', lambda d: reverse('metrics'), None),
+    ('export', 'get', lambda d: reverse('export', args=['posts']), None),
+    ('token', 'post', lambda d: reverse('token'), {'username': 'bench', 'password': 'bench'}),
+)
+
+# Metrics compared against the baseline. Query counts are exact, so any
+# increase is a regression; the others get --threshold.
+COMPARED = ('p50_ms', 'p95_ms', 'queries', 'peak_kb')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+class Command(BaseCommand):
+    help = ('Seed a reproducible dataset, time every API route through the test client and '
+            'optionally compare the results against a baseline report.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=10, help='Posts per user.')
+        parser.add_argument('--comments', type=int, default=10, help='Comments per post.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=50, help='Requests per endpoint.')
+        parser.add_argument('--host', default='localhost', help='Host the requests are sent to.')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Keep the response cache between requests instead of clearing it.')
+        parser.add_argument('--output', help='Write the JSON report here.')
+        parser.add_argument('--baseline', help='Compare against this JSON report.')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Relative increase over the baseline that counts as a regression.')
+        parser.add_argument('--slack-ms', type=float, default=1.0,
+                            help='Timing increases below this are never regressions.')
+
+    def handle(self, *args, **options):
+        dataset = {name: options[name] for name in ('users', 'posts', 'comments', 'seed')}
+        # Clearing the response cache between requests must not empty the
+        # cache the server shares.
+        with override_settings(RESPONSE_CACHE_ALIAS='bench'), transaction.atomic():
+            ids, key = self.seed(**dataset)
+            client = APIClient(SERVER_NAME=options['host'], HTTP_AUTHORIZATION='Token ' + key)
+            results = {}
+            for label, method, url, body in ENDPOINTS:
+                result = results[label] = self.measure(client, method, url(ids), body, options)
+                self.stdout.write(
+                    '%-22s p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms  %3d queries  %7.2f ms sql  %7d KB' % (
+                        label, result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                        result['queries'], result['sql_ms'], result['peak_kb']))
+            transaction.set_rollback(True)
+
+        report = {'dataset': dataset, 'requests': options['requests'], 'endpoints': results}
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            if baseline.get('dataset') != dataset:
+                self.stderr.write('Warning: the baseline was recorded on a different dataset.')
+            regressions = self.compare(baseline['endpoints'], results, options['threshold'], options['slack_ms'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError('%d regressions against %s.' % (len(regressions), options['baseline']))
+
+    def seed(self, users, posts, comments, seed):
+        """
+        Create `users` users with `posts` posts each and `comments` comments
+        per post. Returns ids to build URLs from and a token key.
+        """
+        rng = random.Random(seed)
+        vocabulary = ['word%d' % i for i in range(1000)]
+
+        def words(n):
+            return ' '.join(rng.choice(vocabulary) for _ in range(n))
+
+        authors = bulk_create(User, [User(username='bench-%d' % i, password='!') for i in range(users)])
+        Profile.objects.bulk_create([Profile(user=user) for user in authors])
+        seeded_posts = bulk_create(Post, [
+            Post(author=author, title=words(4), text=words(40)) for author in authors for _ in range(posts)
+        ])
+        post_bulk_create.send(sender=Post, instances=seeded_posts)
+        seeded_comments = bulk_create(Comment, [
+            Comment(author=rng.choice(authors), post=post, text=words(15))
+            for post in seeded_posts for _ in range(comments)
+        ])
+        post_bulk_create.send(sender=Comment, instances=seeded_comments)
+
+        user = User.objects.create_user(username='bench', password='bench')
+        token, key = Token.issue(user)
+        # The seeding transaction never commits, so no fan-out fills the feed.
+        rebuild(user)
+        ids = {
+            'reader': user.pk,
+            'user': authors[0].pk if authors else user.pk,
+            'post': seeded_posts[0].pk if seeded_posts else None,
+            'comment': seeded_comments[0].pk if seeded_comments else None,
+            'word': vocabulary[0],
+        }
+        return ids, key
+
+    def measure(self, client, method, url, body, options):
+        def request():
+            if not options['warm_cache']:
+                response_cache.cache.clear()
+            response = getattr(client, method)(url, body)
+            if response.streaming and response['Content-Type'].startswith('text/event-stream'):
+                # Event streams never end; time the subscription instead.
+                # Closing fires request_finished, which would close this
+                # thread's connection and the seeding transaction with it;
+                # close from a thread that has none.
+                next(response.streaming_content)
+                closer = threading.Thread(target=response.close)
+                closer.start()
+                closer.join()
+            elif response.streaming:
+                b''.join(response.streaming_content)
+            return response
+
+        # Warm up, then time. Memory is traced separately since tracing
+        # slows every allocation down.
+        response = request()
+        if response.status_code >= 400:
+            raise CommandError('%s %s returned %d.' % (method.upper(), url, response.status_code))
+
+        timings, queries, sql = [], [], []
+        for _ in range(options['requests']):
+            # Every alias, so reads routed to a replica count too.
+            with ExitStack() as stack:
+                captured = [stack.enter_context(CaptureQueriesContext(connection)) for connection in connections.all()]
+                start = time.perf_counter()
+                request()
+                timings.append(1000 * (time.perf_counter() - start))
+            captured = [query for context in captured for query in context.captured_queries]
+            queries.append(len(captured))
+            sql.append(1000 * sum(float(query['time']) for query in captured))
+
+        tracemalloc.start()
+        try:
+            request()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'status': response.status_code,
+            'p50_ms': percentile(timings, 50),
+            'p95_ms': percentile(timings, 95),
+            'p99_ms': percentile(timings, 99),
+            'queries': max(queries),
+            'sql_ms': sum(sql) / len(sql),
+            'peak_kb': peak // 1024,
+        }
+
+    def compare(self, baseline, results, threshold, slack_ms):
+        regressions = []
+        for label, result in sorted(results.items()):
+            if label not in baseline:
+                continue
+            for metric in COMPARED:
+                before, after = baseline[label][metric], result[metric]
+                if metric.endswith('_ms') and after - before < slack_ms:
+                    continue
+                limit = before if metric == 'queries' else before * (1 + threshold)
+                if after > limit:
+                    regressions.append('%s: %s went from %s to %s.' % (label, metric, before, after))
+        return regressions
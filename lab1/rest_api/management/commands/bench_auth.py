@@ -0,0 +1,39 @@
+import base64
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from rest_framework.test import APIClient
+
+from rest_api.authentication import token_cache
+from rest_api.models import Token
+
+
+class Command(BaseCommand):
+    help = 'Compare authenticated requests per second under Basic and Token authentication.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = User.objects.create_user(username='bench-auth', password='bench-auth')
+            token, key = Token.issue(user)
+            basic = base64.b64encode(b'bench-auth:bench-auth').decode()
+
+            url = reverse('user-detail', args=[user.pk])
+            for name, header in (('basic', 'Basic ' + basic), ('token', 'Token ' + key)):
+                token_cache.clear()
+                client = APIClient(SERVER_NAME='localhost', HTTP_AUTHORIZATION=header)
+                client.get(url)
+                start = time.perf_counter()
+                for _ in range(options['requests']):
+                    response = client.get(url)
+                elapsed = time.perf_counter() - start
+                assert response.status_code == 200, response.status_code
+                self.stdout.write('%-6s %8.1f req/s  %6.2f ms/req' % (
+                    name, options['requests'] / elapsed, 1000 * elapsed / options['requests']))
+
+            transaction.set_rollback(True)
@@ -0,0 +1,91 @@
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connections
+from rest_framework.test import APIClient
+
+from rest_api.models import Post, Token
+
+
+def run_workload(threads, operations, write_ratio, host='testserver', seed=0):
+    """
+    Have `threads` clients each send `operations` requests, a `write_ratio`
+    share of them comment creations and the rest reads of the post and its
+    comments. Returns counts and timings for the whole run.
+    """
+    user = User.objects.create_user(username='bench-concurrency', password='!')
+    token, key = Token.issue(user)
+    post = Post.objects.create(author=user, title='title', text='text')
+    urls = [reverse('post-list'), reverse('post-detail', args=[post.pk]),
+            reverse('comment-by-post-list', args=[post.pk])]
+    write_url = reverse('comment-by-post-list', args=[post.pk])
+
+    results = {'reads': 0, 'writes': 0, 'errors': []}
+    lock = threading.Lock()
+
+    def worker(number):
+        rng = random.Random(seed + number)
+        client = APIClient(SERVER_NAME=host, HTTP_AUTHORIZATION='Token ' + key)
+        reads = writes = 0
+        errors = []
+        try:
+            for _ in range(operations):
+                if rng.random() < write_ratio:
+                    response = client.post(write_url, {'text': 'text'})
+                    writes += 1
+                else:
+                    response = client.get(rng.choice(urls))
+                    reads += 1
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+        except Exception as e:
+            errors.append(repr(e))
+        finally:
+            connections.close_all()
+        with lock:
+            results['reads'] += reads
+            results['writes'] += writes
+            results['errors'].extend(errors)
+
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    results['elapsed'] = time.perf_counter() - start
+    results['post'] = post.pk
+    results['user'] = user.pk
+    return results
+
+
+class Command(BaseCommand):
+    help = 'Measure mixed read/write throughput of the API across worker threads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=200, help='Requests per thread.')
+        parser.add_argument('--write-ratio', type=float, default=0.2)
+        parser.add_argument('--host', default='localhost', help='Host the requests are sent to.')
+
+    def handle(self, *args, **options):
+        with connections['default'].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.stdout.write('journal_mode=%s' % cursor.fetchone()[0])
+
+        results = run_workload(options['threads'], options['operations'], options['write_ratio'],
+                               host=options['host'])
+        try:
+            total = results['reads'] + results['writes']
+            self.stdout.write('%d threads: %d reads, %d writes in %.2fs, %.0f requests/s, %d errors' % (
+                options['threads'], results['reads'], results['writes'], results['elapsed'],
+                total / results['elapsed'], len(results['errors'])))
+        finally:
+            User.objects.filter(pk=results['user']).delete()
+
+        if results['errors']:
+            raise CommandError('Failed requests: %s' % ', '.join(map(str, results['errors'][:10])))
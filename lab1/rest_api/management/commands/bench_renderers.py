@@ -0,0 +1,65 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from rest_api import compression, renderers
+from rest_api.bulk import bulk_create
+from rest_api.models import Post, Comment, Profile
+from rest_api.serializers import PostSerializer
+from rest_api.views import post_queryset, post_prefetches
+
+
+class Command(BaseCommand):
+    help = 'Compare encode time and response size of the renderers and compressions on a list of posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--host', default='localhost', help='Host the hyperlinks point to.')
+
+    def handle(self, *args, **options):
+        posts = options['posts']
+        with transaction.atomic():
+            users = bulk_create(User, [User(username='bench-%d' % i, password='!') for i in range(100)])
+            Profile.objects.bulk_create([Profile(user=user) for user in users])
+            created = bulk_create(Post, [Post(author=users[i % 100], title='title %d' % i, text='text ' * 20)
+                                         for i in range(posts)])
+            bulk_create(Comment, [Comment(author=users[i % 100], post=created[i // 3], text='text ' * 10)
+                                  for i in range(posts * 3)])
+
+            # Render the comment hyperlinks too, as ?expand=comments does.
+            request = Request(APIRequestFactory().get('/', {'expand': 'comments'}, SERVER_NAME=options['host']))
+            queryset = post_queryset.prefetch_related(*post_prefetches.values()).order_by('id')
+            data = PostSerializer(queryset, many=True, context={'request': request, 'format': None}).data
+            transaction.set_rollback(True)
+
+        cases = [('json', JSONRenderer())]
+        if renderers.orjson is not None:
+            cases.append(('orjson', renderers.FastJSONRenderer()))
+        if renderers.msgpack is not None:
+            cases.append(('msgpack', renderers.MessagePackRenderer()))
+        encodings = ['gzip'] + (['br'] if compression.brotli is not None else [])
+
+        self.stdout.write('%d posts, best of %d' % (posts, options['repeat']))
+        for name, renderer in cases:
+            encode_time, content = self.best(options['repeat'], lambda: renderer.render(data))
+            self.stdout.write('%-8s %-8s %8.1f ms  %9d bytes' % (name, 'identity', 1000 * encode_time, len(content)))
+            for encoding in encodings:
+                compress_time, compressed = self.best(
+                    options['repeat'], lambda: compression.compress(encoding, content))
+                self.stdout.write('%-8s %-8s %8.1f ms  %9d bytes  %5.1f%%' % (
+                    name, encoding, 1000 * (encode_time + compress_time), len(compressed),
+                    100.0 * len(compressed) / len(content)))
+
+    def best(self, repeat, run):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = run()
+            timings.append(time.perf_counter() - start)
+        return min(timings), result
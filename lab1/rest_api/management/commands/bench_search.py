@@ -0,0 +1,52 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from rest_api.bulk import bulk_create
+from rest_api.models import Post
+from rest_api.search import SearchQuery
+
+
+class Command(BaseCommand):
+    help = 'Compare full-text search against icontains filtering on a seeded post table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = ['word%d' % i for i in range(50000)]
+
+        with transaction.atomic():
+            author = User.objects.create(username='bench-search')
+            start = time.perf_counter()
+            for offset in range(0, options['rows'], 10000):
+                batch = min(10000, options['rows'] - offset)
+                bulk_create(Post, [
+                    Post(author=author, title=' '.join(rng.sample(vocabulary, 4)),
+                         text=' '.join(rng.sample(vocabulary, 40)))
+                    for _ in range(batch)
+                ])
+            self.stdout.write('seeded %d posts in %.1fs' % (options['rows'], time.perf_counter() - start))
+
+            terms = rng.sample(vocabulary, options['queries'])
+            for name, run in (('icontains', self.icontains), ('fts5', self.fts)):
+                start = time.perf_counter()
+                for term in terms:
+                    run(term)
+                elapsed = time.perf_counter() - start
+                self.stdout.write('%-10s %8.2f ms/query' % (name, 1000 * elapsed / len(terms)))
+
+            transaction.set_rollback(True)
+
+    def icontains(self, term):
+        return list(Post.objects.filter(Q(title__icontains=term) | Q(text__icontains=term))[:20])
+
+    def fts(self, term):
+        return SearchQuery(term)[:20]
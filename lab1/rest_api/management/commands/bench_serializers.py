@@ -0,0 +1,62 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from rest_api.bulk import bulk_create
+from rest_api.compiled import compile_serializer
+from rest_api.models import Post, Comment, Profile
+from rest_api.serializers import PostSerializer, CommentSerializer, UserSerializer
+from rest_api.views import post_queryset, comment_queryset, user_queryset, post_prefetches, user_prefetches
+
+
+class Command(BaseCommand):
+    help = 'Compare the regular and compiled serializers rendering every row of a seeded table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with transaction.atomic():
+            users = bulk_create(User, [User(username='bench-%d' % i, password='!') for i in range(rows)])
+            Profile.objects.bulk_create([Profile(user=user) for user in users])
+            posts = bulk_create(Post, [Post(author=users[i], title='title %d' % i, text='text ' * 20)
+                                       for i in range(rows)])
+            bulk_create(Comment, [Comment(author=users[i], post=posts[i // 2], text='text ' * 10)
+                                  for i in range(rows)])
+
+            # Reverse relations are optional; render them as well.
+            request = Request(APIRequestFactory().get('/', {'expand': 'comments,posts'}, SERVER_NAME='localhost'))
+            context = {'request': request, 'format': None}
+            cases = (
+                ('posts', PostSerializer, post_queryset.prefetch_related(*post_prefetches.values())),
+                ('comments', CommentSerializer, comment_queryset),
+                ('users', UserSerializer, user_queryset.prefetch_related(*user_prefetches.values())),
+            )
+            self.stdout.write('%d rows, best of %d' % (rows, options['repeat']))
+            for name, serializer_class, queryset in cases:
+                compiled = compile_serializer(serializer_class(context=context))
+                regular_time, regular = self.best(options['repeat'], lambda: serializer_class(
+                    queryset.order_by('id'), many=True, context=context).data)
+                compiled_time, fast = self.best(options['repeat'], lambda: compiled.render(list(
+                    queryset.prefetch_related(None).order_by('id').values(*compiled.columns))))
+
+                assert JSONRenderer().render(regular) == JSONRenderer().render(fast), name
+                self.stdout.write('%-9s regular %8.1f ms  compiled %8.1f ms  %5.1fx' % (
+                    name, 1000 * regular_time, 1000 * compiled_time, regular_time / compiled_time))
+
+            transaction.set_rollback(True)
+
+    def best(self, repeat, run):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = run()
+            timings.append(time.perf_counter() - start)
+        return min(timings), result
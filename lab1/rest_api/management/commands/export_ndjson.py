@@ -0,0 +1,38 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from rest_api.export import EXPORTS, export_rows, ndjson_lines, parse_watermark
+
+
+class Command(BaseCommand):
+    help = 'Stream all posts or comments as newline delimited JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--output', help='File to write to; defaults to stdout.')
+        parser.add_argument('--after-created', help='Resume after the row with this created timestamp...')
+        parser.add_argument('--after-id', help='...and this id.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        after = None
+        if options['after_created'] or options['after_id']:
+            try:
+                after = parse_watermark(options['after_created'], options['after_id'])
+            except ValidationError as e:
+                raise CommandError('Invalid watermark: %s' % '; '.join(e.messages))
+            if None in after:
+                raise CommandError('--after-created and --after-id must be given together.')
+
+        lines = ndjson_lines(export_rows(options['kind'], after=after, chunk_size=options['chunk_size']))
+        count = 0
+        if options['output']:
+            with open(options['output'], 'a' if after else 'w') as output:
+                for line in lines:
+                    output.write(line)
+                    count += 1
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
+                count += 1
+        self.stderr.write('Exported %d %s.' % (count, options['kind']))
@@ -0,0 +1,163 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from rest_api.bulk import bulk_create
+from rest_api.models import Post, Comment, ImportCheckpoint, Profile
+from rest_api.signals import post_bulk_create
+
+# Columns read from each row; anything else in the row is ignored. Authors
+# are given by username and resolved in memory.
+COLUMNS = {
+    'users': (User, ('id', 'username', 'email', 'first_name', 'last_name', 'date_joined')),
+    'posts': (Post, ('id', 'title', 'text', 'created', 'updated')),
+    'comments': (Comment, ('id', 'post_id', 'text', 'created', 'updated')),
+}
+
+
+@contextmanager
+def keep_timestamps(model):
+    """
+    Let imported rows keep their own `created` and `updated` values.
+    """
+    fields = [f for f in model._meta.concrete_fields
+              if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)]
+    saved = [(f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, (auto_now, auto_now_add) in zip(fields, saved):
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = ('Bulk import users, posts or comments from a newline delimited JSON file, '
+            'such as one written by export_ndjson.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(COLUMNS))
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--passwords', choices=('hash', 'prehashed', 'unusable'), default='hash',
+                            help='hash: run each raw password through the password hasher; '
+                                 'prehashed: rows already hold encoded hashes; '
+                                 'unusable: ignore passwords.')
+        parser.add_argument('--checkpoint',
+                            help='Name of the progress record an interrupted import resumes from. '
+                                 'Defaults to the absolute PATH.')
+
+    def handle(self, *args, **options):
+        self.kind = options['kind']
+        self.passwords = options['passwords']
+        self.verbosity = options['verbosity']
+        checkpoint = options['checkpoint'] or os.path.abspath(options['path'])
+        model = COLUMNS[self.kind][0]
+
+        self.authors = dict(User.objects.values_list('username', 'pk'))
+        self.posts = set(Post.objects.values_list('pk', flat=True)) if self.kind == 'comments' else set()
+
+        offset, line_number = self.read_checkpoint(checkpoint)
+        if line_number:
+            self.stderr.write('Resuming after line %d.' % line_number)
+
+        imported = 0
+        start = time.perf_counter()
+        with open(options['path'], 'rb') as source, keep_timestamps(model):
+            source.seek(offset)
+            batch = []
+            for line in source:
+                offset += len(line)
+                line_number += 1
+                if line.strip():
+                    batch.append(self.build(line, line_number))
+                if len(batch) >= options['batch_size']:
+                    imported += self.save_batch(model, batch, checkpoint, offset, line_number)
+                    self.progress(imported, start)
+                    batch = []
+            if batch:
+                imported += self.save_batch(model, batch, checkpoint, offset, line_number)
+
+        ImportCheckpoint.objects.filter(name=checkpoint).delete()
+        elapsed = time.perf_counter() - start
+        self.stdout.write('Imported %d %s in %.1fs (%d rows/s).' % (
+            imported, self.kind, elapsed, imported / elapsed if elapsed else 0))
+
+    def build(self, line, line_number):
+        try:
+            row = json.loads(line.decode('utf-8'))
+            model, columns = COLUMNS[self.kind]
+            values = {}
+            for name in columns:
+                if row.get(name) is not None:
+                    values[name] = model._meta.get_field(name.replace('_id', '')).to_python(row[name])
+        except (ValueError, ValidationError) as e:
+            raise CommandError('Line %d: %s' % (line_number, e))
+
+        if self.kind == 'users':
+            return self.build_user(row, values, line_number)
+
+        try:
+            values['author_id'] = self.authors[row.get('author')]
+        except KeyError:
+            raise CommandError('Line %d: unknown author %r.' % (line_number, row.get('author')))
+        if self.kind == 'comments':
+            values.setdefault('post_id', row.get('post'))
+            if values['post_id'] not in self.posts:
+                raise CommandError('Line %d: unknown post %r.' % (line_number, values['post_id']))
+        now = timezone.now()
+        values.setdefault('created', now)
+        values.setdefault('updated', values['created'])
+        return model(**values)
+
+    def build_user(self, row, values, line_number):
+        if not values.get('username'):
+            raise CommandError('Line %d: username is required.' % line_number)
+        if values['username'] in self.authors:
+            raise CommandError('Line %d: user %r already exists.' % (line_number, values['username']))
+        user = User(**values)
+        password = row.get('password')
+        if self.passwords == 'unusable' or not password:
+            user.set_unusable_password()
+        elif self.passwords == 'prehashed':
+            user.password = password
+        else:
+            user.password = make_password(password)
+        # Reserve the name so duplicates within the file are caught too.
+        self.authors[user.username] = None
+        return user
+
+    @transaction.atomic
+    def save_batch(self, model, batch, checkpoint, offset, line_number):
+        """
+        Insert `batch` and move the checkpoint past it in one transaction, so
+        a crash leaves neither the rows without the checkpoint nor the other
+        way round.
+        """
+        bulk_create(model, batch)
+        if model is User:
+            Profile.objects.bulk_create([Profile(user_id=user.pk) for user in batch])
+            self.authors.update((user.username, user.pk) for user in batch)
+        else:
+            post_bulk_create.send(sender=model, instances=batch)
+            if model is Post:
+                self.posts.update(post.pk for post in batch)
+        ImportCheckpoint.objects.update_or_create(name=checkpoint, defaults={'offset': offset, 'line': line_number})
+        return len(batch)
+
+    def read_checkpoint(self, name):
+        return ImportCheckpoint.objects.filter(name=name).values_list('offset', 'line').first() or (0, 0)
+
+    def progress(self, imported, start):
+        if self.verbosity > 1:
+            elapsed = time.perf_counter() - start
+            self.stderr.write('%d %s, %d rows/s' % (imported, self.kind, imported / elapsed if elapsed else 0))
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from rest_api.deletion import purge_deleted
+
+
+class Command(BaseCommand):
+    help = 'Remove soft-deleted posts, comments and users, a batch at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=None,
+                            help='Seconds since deletion; defaults to SOFT_DELETE_PURGE_AFTER.')
+
+    def handle(self, *args, **options):
+        older_than = options['older_than']
+        comments, posts, users = purge_deleted(None if older_than is None else timedelta(seconds=older_than))
+        self.stdout.write('Purged %d comments, %d posts and %d users.' % (comments, posts, users))
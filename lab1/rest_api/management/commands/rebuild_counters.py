@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from rest_api.models import Post, Comment, ArchivedPost, ArchivedComment, Profile
+
+
+def count_by(model, field):
+    related = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+    return Coalesce(Subquery(related.annotate(n=Count('id')).values('n'), output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized post and comment counters from scratch.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            missing = User.objects.filter(profile__isnull=True).values_list('pk', flat=True)
+            Profile.objects.bulk_create([Profile(user_id=pk) for pk in missing])
+            # Archived posts and comments still count.
+            profiles = Profile.objects.update(
+                post_count=count_by(Post, 'author') + count_by(ArchivedPost, 'author'),
+                comment_count=count_by(Comment, 'author') + count_by(ArchivedComment, 'author'))
+            posts = Post.objects.update(comment_count=count_by(Comment, 'post'))
+            ArchivedPost.objects.update(comment_count=count_by(ArchivedComment, 'post'))
+
+        self.stdout.write('Rebuilt counters for %d users and %d posts.' % (profiles, posts))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from rest_api.db import retry_on_busy
+from rest_api.feed import readers, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rewrite the home feeds from the existing posts and comments, one user per transaction.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('users', nargs='*', type=int, help='Ids of the users to rebuild; all by default.')
+
+    def handle(self, *args, **options):
+        users = readers().order_by('pk')
+        if options['users']:
+            users = users.filter(pk__in=options['users'])
+
+        count = entries = 0
+        for user in users.iterator():
+            entries += retry_on_busy(rebuild, user)
+            count += 1
+        self.stdout.write('Rebuilt %d feeds with %d entries.' % (count, entries))
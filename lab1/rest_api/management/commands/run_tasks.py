@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from rest_api.tasks import run_due
+
+
+class Command(BaseCommand):
+    help = 'Run due background tasks from the outbox: retries, and tasks left over by processes that died.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run what is due now and exit.')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between polls when idle.')
+        parser.add_argument('--batch', type=int, default=100)
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            ran = run_due(options['batch'])
+            total += ran
+            if ran < options['batch']:
+                if options['once']:
+                    self.stdout.write('Ran %d tasks.' % total)
+                    return
+                close_old_connections()
+                time.sleep(options['interval'])
@@ -0,0 +1,38 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from rest_api.cache import response_cache
+from rest_api.routers import replicas
+
+
+def copy_database(source, path):
+    """
+    Write a consistent snapshot of the SQLite database `source` to `path`,
+    then move it over the old copy in one step.
+    """
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    with connections[source].cursor() as cursor:
+        cursor.execute('VACUUM INTO %s', [tmp])
+    os.replace(tmp, path)
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+class Command(BaseCommand):
+    help = 'Refresh the file copies standing in for read replicas from the primary SQLite database.'
+
+    def handle(self, *args, **options):
+        if not replicas():
+            raise CommandError('No replicas configured in DATABASE_REPLICAS.')
+
+        for alias in sorted(replicas()):
+            connections[alias].close()
+            copy_database(DEFAULT_DB_ALIAS, connections[alias].settings_dict['NAME'])
+            self.stdout.write('Copied %s to %s.' % (DEFAULT_DB_ALIAS, alias))
+        # Cached responses may have been read from the old copies.
+        response_cache.bump('replicas')
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:19
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# External content FTS5 tables: the index reads text back from the model
+# tables, and triggers keep it in step with every write path, bulk included.
+SEARCH_SQL = [
+    """
+    CREATE VIRTUAL TABLE rest_api_post_fts USING fts5(
+        title, text, content='rest_api_post', content_rowid='id'
+    );
+    """,
+    """
+    CREATE TRIGGER rest_api_post_fts_insert AFTER INSERT ON rest_api_post BEGIN
+        INSERT INTO rest_api_post_fts(rowid, title, text) VALUES (new.id, new.title, new.text);
+    END;
+    """,
+    """
+    CREATE TRIGGER rest_api_post_fts_delete AFTER DELETE ON rest_api_post BEGIN
+        INSERT INTO rest_api_post_fts(rest_api_post_fts, rowid, title, text)
+        VALUES ('delete', old.id, old.title, old.text);
+    END;
+    """,
+    """
+    CREATE TRIGGER rest_api_post_fts_update AFTER UPDATE OF title, text ON rest_api_post BEGIN
+        INSERT INTO rest_api_post_fts(rest_api_post_fts, rowid, title, text)
+        VALUES ('delete', old.id, old.title, old.text);
+        INSERT INTO rest_api_post_fts(rowid, title, text) VALUES (new.id, new.title, new.text);
+    END;
+    """,
+    """
+    CREATE VIRTUAL TABLE rest_api_comment_fts USING fts5(
+        text, content='rest_api_comment', content_rowid='id'
+    );
+    """,
+    """
+    CREATE TRIGGER rest_api_comment_fts_insert AFTER INSERT ON rest_api_comment BEGIN
+        INSERT INTO rest_api_comment_fts(rowid, text) VALUES (new.id, new.text);
+    END;
+    """,
+    """
+    CREATE TRIGGER rest_api_comment_fts_delete AFTER DELETE ON rest_api_comment BEGIN
+        INSERT INTO rest_api_comment_fts(rest_api_comment_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END;
+    """,
+    """
+    CREATE TRIGGER rest_api_comment_fts_update AFTER UPDATE OF text ON rest_api_comment BEGIN
+        INSERT INTO rest_api_comment_fts(rest_api_comment_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO rest_api_comment_fts(rowid, text) VALUES (new.id, new.text);
+    END;
+    """,
+    "INSERT INTO rest_api_post_fts(rest_api_post_fts) VALUES ('rebuild');",
+    "INSERT INTO rest_api_comment_fts(rest_api_comment_fts) VALUES ('rebuild');",
+]
+
+DROP_SEARCH_SQL = [
+    "DROP TRIGGER rest_api_post_fts_insert;",
+    "DROP TRIGGER rest_api_post_fts_delete;",
+    "DROP TRIGGER rest_api_post_fts_update;",
+    "DROP TABLE rest_api_post_fts;",
+    "DROP TRIGGER rest_api_comment_fts_insert;",
+    "DROP TRIGGER rest_api_comment_fts_delete;",
+    "DROP TRIGGER rest_api_comment_fts_update;",
+    "DROP TABLE rest_api_comment_fts;",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_api', '0005_counters'),
+    ]
+
+    operations = [
+        migrations.RunSQL(SEARCH_SQL, DROP_SEARCH_SQL),
+    ]
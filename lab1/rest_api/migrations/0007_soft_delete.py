@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+TABLES = ('rest_api_post', 'rest_api_comment', 'rest_api_profile')
+
+# A plain ADD COLUMN instead of the table rebuild Django does on SQLite,
+# which would copy every row and drop the search triggers. The indexes are
+# partial so that they only serve purge_deleted; live rows are found through
+# the keyset indexes.
+SOFT_DELETE_SQL = [
+    sql for table in TABLES for sql in (
+        'ALTER TABLE %s ADD COLUMN deleted datetime NULL;' % table,
+        'CREATE INDEX %s_deleted_idx ON %s (deleted) WHERE deleted IS NOT NULL;' % (table, table),
+    )
+]
+
+DROP_SOFT_DELETE_SQL = [
+    sql for table in TABLES for sql in (
+        'DROP INDEX %s_deleted_idx;' % table,
+        'ALTER TABLE %s DROP COLUMN deleted;' % table,
+    )
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_api', '0006_search'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(SOFT_DELETE_SQL, DROP_SOFT_DELETE_SQL),
+            ],
+            state_operations=[
+                migrations.AddField(
+                    model_name='comment',
+                    name='deleted',
+                    field=models.DateTimeField(editable=False, null=True),
+                ),
+                migrations.AddField(
+                    model_name='post',
+                    name='deleted',
+                    field=models.DateTimeField(editable=False, null=True),
+                ),
+                migrations.AddField(
+                    model_name='profile',
+                    name='deleted',
+                    field=models.DateTimeField(null=True),
+                ),
+            ],
+        ),
+    ]
@@ -1,17 +1,45 @@
+import binascii
+import hashlib
+import os
+
 from django.db import models
 
 # Create your models here.
 
+class LiveManager(models.Manager):
+    """
+    Rows that have not been soft-deleted. Models keep a plain manager as
+    `all_objects` for the rest.
+    """
+
+    def get_queryset(self):
+        return super(LiveManager, self).get_queryset().filter(deleted__isnull=True)
+
 class Post(models.Model):
     author = models.ForeignKey('auth.User', related_name='posts', editable=False, on_delete=models.CASCADE)
     title = models.CharField(max_length=50)
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    deleted = models.DateTimeField(null=True, editable=False)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
     
     class Meta:
         ordering = ('created',)
+        indexes = [
+            models.Index(fields=['created', 'id'], name='post_created_id_idx'),
+        ]
 
     def save(self, *args, **kwargs):
+        # comment_count only moves through F() updates and deleted through
+        # rest_api.deletion; never write back a copy that may have gone stale
+        # since this instance was loaded.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name not in ('comment_count', 'deleted')]
         super(Post, self).save(*args, **kwargs)
 
 class Comment(models.Model):
@@ -19,9 +47,139 @@ class Comment(models.Model):
     post = models.ForeignKey(Post, related_name='comments', editable=False, on_delete=models.CASCADE)
     text = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    deleted = models.DateTimeField(null=True, editable=False)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
 
     class Meta:
         ordering = ('created',)
+        indexes = [
+            models.Index(fields=['created', 'id'], name='comment_created_id_idx'),
+        ]
 
     def save(self, *args, **kwargs):
+        # Like Post.save(), leave deleted to rest_api.deletion.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name != 'deleted']
         super(Comment, self).save(*args, **kwargs)
+
+class ArchivedPost(models.Model):
+    """
+    A post moved out of the live tables by rest_api.archive together with its
+    comments, once the whole thread has gone quiet. Ids are kept, and never
+    reused by the live tables.
+    """
+    id = models.IntegerField(primary_key=True)
+    author = models.ForeignKey('auth.User', related_name='archived_posts', editable=False, on_delete=models.CASCADE)
+    title = models.CharField(max_length=50)
+    text = models.TextField()
+    created = models.DateTimeField()
+    updated = models.DateTimeField()
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    archived = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('created',)
+        indexes = [
+            models.Index(fields=['created', 'id'], name='archivedpost_created_id_idx'),
+        ]
+
+class ArchivedComment(models.Model):
+    id = models.IntegerField(primary_key=True)
+    author = models.ForeignKey('auth.User', related_name='archived_comments', editable=False, on_delete=models.CASCADE)
+    post = models.ForeignKey(ArchivedPost, related_name='comments', editable=False, on_delete=models.CASCADE)
+    text = models.TextField()
+    created = models.DateTimeField()
+    updated = models.DateTimeField()
+    archived = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('created',)
+        indexes = [
+            models.Index(fields=['created', 'id'], name='archivedcomment_created_idx'),
+        ]
+
+class FeedEntry(models.Model):
+    """
+    A comment in the materialized home feed of `user`, written by
+    rest_api.feed when the comment is created. `created` is copied from it,
+    so the comments of a feed read from one index.
+    """
+    user = models.ForeignKey('auth.User', related_name='feed', editable=False, on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, related_name='+', editable=False, on_delete=models.CASCADE)
+    comment = models.ForeignKey(Comment, related_name='+', editable=False, on_delete=models.CASCADE)
+    created = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created', 'id'], name='feedentry_user_created_idx'),
+        ]
+
+class Profile(models.Model):
+    """
+    Per-user counters, kept in step with Post and Comment by signals.
+    """
+    user = models.OneToOneField('auth.User', related_name='profile', primary_key=True, on_delete=models.CASCADE)
+    post_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    deleted = models.DateTimeField(null=True)
+    # Entries written to the user's feed since it was last trimmed.
+    feed_size = models.PositiveIntegerField(default=0)
+
+class Token(models.Model):
+    """
+    API token, stored as the SHA-256 of the key handed to the client.
+
+    Keys carry 160 random bits, so a fast hash is enough to make a leaked
+    table useless and keeps verification off the PBKDF2 path.
+    """
+    key = models.CharField(max_length=64, unique=True, editable=False)
+    user = models.ForeignKey('auth.User', related_name='tokens', editable=False, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def hash_key(key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def issue(cls, user):
+        """
+        Create a token for `user` and return it with its plaintext key.
+        """
+        key = binascii.hexlify(os.urandom(20)).decode()
+        return cls.objects.create(user=user, key=cls.hash_key(key)), key
+
+class Task(models.Model):
+    """
+    Outbox row of a background task, written in the transaction of the change
+    that needs it and deleted once the task has run.
+
+    `run_after` doubles as the lease: claiming a task pushes it past the
+    time the run may take, so a task whose worker died runs again.
+    """
+    name = models.CharField(max_length=200)
+    kwargs = models.TextField(default='{}')
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField()
+    failed = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['failed', 'run_after'], name='task_due_idx'),
+        ]
+
+
+class ImportCheckpoint(models.Model):
+    """
+    How far import_ndjson got into a file, written in the transaction of
+    each batch so that a resumed import neither skips nor repeats rows.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    offset = models.BigIntegerField()
+    line = models.PositiveIntegerField()
+    updated = models.DateTimeField(auto_now=True)
@@ -0,0 +1,218 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import ValidationError
+from django.db.models import PositiveIntegerField, Q
+from django.utils.six.moves.urllib import parse as urlparse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+def flip(name):
+    return name[1:] if name.startswith('-') else '-' + name
+
+
+def after_lookup(name, reverse=False):
+    # The lookup for values after, or before when `reverse`, in the order of `name`.
+    descending = name.startswith('-')
+    return name.lstrip('-') + ('__lt' if descending != reverse else '__gt')
+
+
+def keyset_filter(queryset, ordering, values, reverse=False):
+    """
+    Restrict `queryset` to rows strictly after `values` in `ordering`, or
+    strictly before them when `reverse` is set. Names in `ordering` may be
+    prefixed with '-' for descending order.
+    """
+    # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+    after = Q()
+    for i, name in enumerate(ordering):
+        term = Q(**{after_lookup(name, reverse): values[i]})
+        for prev_name, prev_value in zip(ordering[:i], values[:i]):
+            term &= Q(**{prev_name.lstrip('-'): prev_value})
+        after |= term
+
+    # The redundant bound on the leading column lets SQLite start the index
+    # range scan at the cursor instead of filtering from the start.
+    return queryset.filter(Q(**{after_lookup(ordering[0], reverse) + 'e': values[0]}), after)
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination that seeks on the full `ordering` tuple.
+
+    Unlike `CursorPagination`, the cursor stores a value for every ordering
+    field instead of the first field plus an offset, so each page is a single
+    index range scan no matter how deep the client pages or how many rows
+    share a timestamp.
+    """
+    ordering = ('created', 'id')
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.fields = self.get_fields(queryset)
+        self.cursor = self.decode_cursor(request)
+
+        reverse = self.cursor is not None and self.cursor.reverse
+        results = self.get_rows(queryset, self.cursor)
+        has_following = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = True
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = self.cursor is not None
+
+        return self.page
+
+    def get_fields(self, queryset):
+        return [queryset.model._meta.get_field(name.lstrip('-')) for name in self.ordering]
+
+    def get_rows(self, queryset, cursor):
+        """
+        The first `page_size + 1` rows following `cursor`; the extra row only
+        tells whether there are more.
+        """
+        return list(self.get_page_queryset(queryset, cursor)[:self.page_size + 1])
+
+    def get_page_queryset(self, queryset, cursor):
+        """
+        Order `queryset` and restrict it to the rows following `cursor`.
+        """
+        reverse = cursor is not None and cursor.reverse
+        if reverse:
+            queryset = queryset.order_by(*[flip(name) for name in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if cursor is None:
+            return queryset
+
+        return keyset_filter(queryset, self.ordering, cursor.position, reverse)
+
+    def get_next_link(self):
+        # An empty page, past the end or with its rows deleted since, has no
+        # row to link on from.
+        if not self.has_next or not self.page:
+            return None
+        cursor = Cursor(offset=0, reverse=False, position=self._get_position(self.page[-1]))
+        return self.encode_cursor(cursor)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        cursor = Cursor(offset=0, reverse=True, position=self._get_position(self.page[0]))
+        return self.encode_cursor(cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            querystring = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = urlparse.parse_qs(querystring, keep_blank_values=True)
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+            position = tokens['p']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if len(position) != len(self.fields):
+            raise NotFound(self.invalid_cursor_message)
+
+        try:
+            position = [field.to_python(value) for field, value in zip(self.fields, position)]
+        except ValidationError:
+            raise NotFound(self.invalid_cursor_message)
+
+        return Cursor(offset=0, reverse=reverse, position=position)
+
+    def encode_cursor(self, cursor):
+        tokens = {'p': cursor.position}
+        if cursor.reverse:
+            tokens['r'] = '1'
+
+        querystring = urlparse.urlencode(tokens, doseq=True)
+        encoded = urlsafe_b64encode(querystring.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def _get_position(self, instance):
+        if isinstance(instance, dict):
+            # A `.values()` row; value_to_string() wants a model instance.
+            instance = self.fields[0].model(**{field.attname: instance[field.attname] for field in self.fields})
+        return [field.value_to_string(instance) for field in self.fields]
+
+
+class UserKeysetPagination(KeysetPagination):
+    ordering = ('id',)
+
+
+class MergedKeysetPagination(KeysetPagination):
+    """
+    Keyset pagination over a list of querysets that share the `ordering`
+    fields, merged into one list of rows.
+
+    Rows that tie on the first ordering field come in the order of their
+    querysets, and the cursor also stores the index of the queryset of its
+    row, so a page is still one index range scan per queryset.
+    """
+
+    def paginate_queryset(self, querysets, request, view=None):
+        page = super(MergedKeysetPagination, self).paginate_queryset(querysets, request, view)
+        return None if page is None else [row for _, row in page]
+
+    def get_fields(self, querysets):
+        # The last cursor value is the queryset index.
+        return super(MergedKeysetPagination, self).get_fields(querysets[0]) + [PositiveIntegerField()]
+
+    def get_rows(self, querysets, cursor):
+        reverse = cursor is not None and cursor.reverse
+        rows = []
+        for index, queryset in enumerate(querysets):
+            queryset = self.get_merged_queryset(queryset, index, cursor)
+            rows += [(index, row) for row in queryset[:self.page_size + 1]]
+
+        # Stable sorts, least significant key first: the ordering fields after
+        # the first, the queryset index, then the first field.
+        def sort(key, name):
+            rows.sort(key=key, reverse=name.startswith('-') != reverse)
+        for name, field in reversed(list(zip(self.ordering, self.fields))[1:]):
+            sort(lambda row, attname=field.attname: getattr(row[1], attname), name)
+        sort(lambda row: row[0], '')
+        sort(lambda row: getattr(row[1], self.fields[0].attname), self.ordering[0])
+        return rows[:self.page_size + 1]
+
+    def get_merged_queryset(self, queryset, index, cursor):
+        """
+        Order the `index`th queryset and restrict it to the rows following
+        `cursor`.
+        """
+        if cursor is None:
+            return self.get_page_queryset(queryset, None)
+        position, cursor_index = cursor.position[:-1], cursor.position[-1]
+        if index == cursor_index:
+            return self.get_page_queryset(queryset, cursor._replace(position=position))
+
+        # Its rows that tie with the cursor on the first field are all on one
+        # side of it.
+        ordering = [flip(name) for name in self.ordering] if cursor.reverse else self.ordering
+        lookup = after_lookup(self.ordering[0], cursor.reverse)
+        if (index > cursor_index) != cursor.reverse:
+            lookup += 'e'
+        return queryset.order_by(*ordering).filter(**{lookup: position[0]})
+
+    def _get_position(self, row):
+        index, instance = row
+        return [field.value_to_string(instance) for field in self.fields[:-1]] + [str(index)]
+
+
+class FeedPagination(MergedKeysetPagination):
+    ordering = ('-created', '-id')
@@ -13,3 +13,13 @@ class UserIsOwnerOrReadAndCreateOnly(permissions.BasePermission):
         if request.method in ['POST'] + list(permissions.SAFE_METHODS):
             return True
         return request.user.is_staff or obj.id == request.user.id
+
+class IsAuthenticatedOrCreateOnly(permissions.BasePermission):
+
+    def has_permission(self, request, view):
+        return request.method == 'POST' or request.user.is_authenticated
+
+class IsFeedOwner(permissions.BasePermission):
+
+    def has_permission(self, request, view):
+        return request.user.is_staff or str(request.user.pk) == view.kwargs.get('pk')
@@ -0,0 +1,273 @@
+import bisect
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db.backends.utils import CursorWrapper, CursorDebugWrapper
+from django.utils.module_loading import import_string
+from rest_framework.authentication import BaseAuthentication
+
+logger = logging.getLogger('rest_api.profiling')
+
+_local = threading.local()
+
+
+class RequestProfile(object):
+    """
+    Time spent in each phase of the request being handled on this thread.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.route = None
+        self.queries = 0
+        self.sql = 0.0
+        self.auth = 0.0
+        # (time, sql) when the view is entered and left.
+        self.view_start = self.view_end = None
+        self.render_start = self.render_end = None
+
+    def enter_view(self):
+        self.view_start = (time.perf_counter(), self.sql)
+
+    def leave_view(self):
+        if self.view_start is not None and self.view_end is None:
+            self.view_end = (time.perf_counter(), self.sql)
+
+    def timings(self):
+        """
+        `(name, seconds, description)` for every phase that happened.
+        """
+        timings = [('sql', self.sql, '%d queries' % self.queries), ('auth', self.auth, None)]
+        if self.view_start is not None:
+            (start, sql_before), (end, sql_after) = self.view_start, self.view_end
+            view = (end - start) - (sql_after - sql_before) - self.auth
+            timings.append(('view', max(0.0, view), None))
+        if self.render_end is not None:
+            timings.append(('render', self.render_end - self.render_start, None))
+        return timings
+
+
+def current_profile():
+    return getattr(_local, 'profile', None)
+
+
+class TimedCursorMixin(object):
+    """
+    Add query time to the current request's profile, and log a sample of
+    slow queries when `PROFILING_SLOW_QUERY_MS` is set.
+    """
+
+    def execute(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            return super(TimedCursorMixin, self).execute(sql, params)
+        finally:
+            self.record(start, sql, params)
+
+    def executemany(self, sql, param_list):
+        start = time.perf_counter()
+        try:
+            return super(TimedCursorMixin, self).executemany(sql, param_list)
+        finally:
+            self.record(start, sql, param_list)
+
+    def record(self, start, sql, params):
+        duration = time.perf_counter() - start
+        profile = current_profile()
+        if profile is None:
+            return
+        profile.queries += 1
+        profile.sql += duration
+
+        threshold = getattr(settings, 'PROFILING_SLOW_QUERY_MS', None)
+        if threshold is not None and duration * 1000 >= threshold \
+                and random.random() < getattr(settings, 'PROFILING_SLOW_QUERY_SAMPLE', 1.0):
+            logger.warning('Slow query on %s (%.1f ms): %s; args=%s',
+                           profile.route, duration * 1000, sql, params,
+                           extra={'duration': duration, 'sql': sql, 'params': params})
+
+
+class TimedCursorWrapper(TimedCursorMixin, CursorWrapper):
+    pass
+
+
+class TimedCursorDebugWrapper(TimedCursorMixin, CursorDebugWrapper):
+    pass
+
+
+def install_cursor_timing(sender, connection, **kwargs):
+    """
+    `connection_created` receiver that wraps every cursor of `connection`.
+    """
+    connection.make_cursor = lambda cursor: TimedCursorWrapper(cursor, connection)
+    connection.make_debug_cursor = lambda cursor: TimedCursorDebugWrapper(cursor, connection)
+
+
+class TimedAuthentication(BaseAuthentication):
+    """
+    Try the classes in `PROFILED_AUTHENTICATION_CLASSES` in turn, as DRF
+    does with its own list, and record how long they take in the request's
+    profile. Their queries count towards `sql` only.
+
+    The only class in DRF's `DEFAULT_AUTHENTICATION_CLASSES`, so that every
+    view is timed.
+    """
+
+    def __init__(self):
+        paths = getattr(settings, 'PROFILED_AUTHENTICATION_CLASSES', ())
+        self.authenticators = [import_string(path)() for path in paths]
+
+    def authenticate(self, request):
+        profile = current_profile()
+        start, sql = time.perf_counter(), profile.sql if profile is not None else 0.0
+        try:
+            for authenticator in self.authenticators:
+                user_auth = authenticator.authenticate(request)
+                if user_auth is not None:
+                    return user_auth
+            return None
+        finally:
+            if profile is not None:
+                profile.auth += time.perf_counter() - start - (profile.sql - sql)
+
+    def authenticate_header(self, request):
+        # Decides between 401 and 403, from the first class as DRF would.
+        if self.authenticators:
+            return self.authenticators[0].authenticate_header(request)
+
+
+class Histogram(object):
+    """
+    Cumulative Prometheus histogram with one series per label tuple.
+    """
+
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            label = ','.join('%s="%s"' % (name, escape_label(value)) for name, value in zip(self.labels, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, label, le, cumulative))
+            lines.append('%s_sum{%s} %r' % (self.name, label, total))
+            lines.append('%s_count{%s} %d' % (self.name, label, cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_latency = Histogram(
+    'http_request_duration_seconds', 'Request latency by route.', ('route', 'method'),
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+request_queries = Histogram(
+    'http_request_queries', 'SQL queries per request by route.', ('route', 'method'),
+    (0, 1, 2, 3, 5, 10, 20, 50, 100))
+
+METRICS = (request_latency, request_queries)
+
+
+def render_metrics():
+    return ''.join(metric.render() for metric in METRICS)
+
+
+class ProfilingMiddleware(object):
+    """
+    Profile every request into a `Server-Timing` header and the in-process
+    histograms served at /api/metrics.
+
+    Phases: `sql` is all query time, `auth` DRF authentication, `view` the
+    rest of the view (mostly serialization) and `render` response rendering.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = _local.profile = RequestProfile()
+        try:
+            response = self.get_response(request)
+        finally:
+            _local.profile = None
+        profile.leave_view()
+
+        timings = profile.timings() + [('total', time.perf_counter() - profile.start, None)]
+        response['Server-Timing'] = ', '.join(
+            '%s;dur=%.2f' % (name, 1000 * seconds) + (';desc="%s"' % desc if desc else '')
+            for name, seconds, desc in timings)
+
+        labels = (profile.route or 'unmatched', request.method)
+        if response.streaming:
+            # The header only has what happened before the body; the
+            # histograms wait for the body to be sent or abandoned.
+            response.streaming_content = self.stream(response.streaming_content, profile, labels)
+        else:
+            self.finish(profile, labels)
+        return response
+
+    def stream(self, chunks, profile, labels):
+        """
+        Count the queries run while producing `chunks` in `profile`, and
+        record it once the response is closed.
+        """
+        chunks = iter(chunks)
+        try:
+            while True:
+                _local.profile = profile
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    _local.profile = None
+                yield chunk
+        finally:
+            self.finish(profile, labels)
+
+    def finish(self, profile, labels):
+        request_latency.observe(labels, time.perf_counter() - profile.start)
+        request_queries.observe(labels, profile.queries)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = current_profile()
+        if profile is not None:
+            match = request.resolver_match
+            profile.route = match.url_name or match.view_name
+            profile.enter_view()
+
+    def process_template_response(self, request, response):
+        profile = current_profile()
+        if profile is not None:
+            profile.leave_view()
+            profile.render_start = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: setattr(profile, 'render_end', time.perf_counter()))
+        return response
@@ -0,0 +1,81 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import permissions, serializers
+
+
+def rendered_columns(model, fields):
+    """
+    Return `(columns, related)` for `.only()` and `.select_related()` so that
+    reading `fields` touches no other column.
+    """
+    columns = set([model._meta.pk.name])
+    related = set()
+    for field in fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        parts = field.source.split('.')
+        try:
+            model_field = model._meta.get_field(parts[0])
+        except FieldDoesNotExist:
+            continue
+
+        if len(parts) > 1 and (model_field.many_to_one or model_field.one_to_one):
+            related.add(parts[0])
+            columns.add('__'.join(parts))
+        elif model_field.concrete:
+            columns.add(parts[0])
+    return columns, related
+
+
+def embedded(field):
+    field = getattr(field, 'child', field)
+    return field if isinstance(field, serializers.BaseSerializer) else None
+
+
+def include_prefetches(fields, prefix=''):
+    """
+    Prefetch lookups for the objects embedded by `?include=` in `fields`, and
+    for whatever those render in turn: one query per relation, however many
+    objects are embedded.
+    """
+    lookups = []
+    for field in fields.values():
+        serializer = embedded(field)
+        if serializer is None:
+            continue
+        path = prefix + field.source
+        lookups.append(path)
+        columns, related = rendered_columns(serializer.Meta.model, serializer.fields)
+        lookups.extend(path + '__' + name for name in sorted(related))
+        lookups.extend(include_prefetches(serializer.fields, path + '__'))
+    return lookups
+
+
+class SerializerQuerysetMixin(object):
+    """
+    Shape `get_queryset()` after the fields the serializer will render.
+
+    `related_prefetches` maps serializer field names to the prefetch lookups
+    they need, so relations that are not rendered are never fetched. Reads
+    also load only the columns the rendered fields use, and prefetch the
+    objects embedded by `?include=`.
+    """
+    related_prefetches = {}
+
+    def get_queryset(self):
+        queryset = super(SerializerQuerysetMixin, self).get_queryset()
+        fields = self.get_serializer().fields
+        queryset = queryset.prefetch_related(
+            *[lookup for name, lookup in self.related_prefetches.items()
+              if name in fields and not embedded(fields[name])])
+
+        if self.request.method not in permissions.SAFE_METHODS:
+            return queryset
+
+        columns, related = rendered_columns(queryset.model, fields)
+        # The paginator reads its ordering fields off every row as well.
+        columns.update(getattr(self.paginator, 'ordering', ()))
+        queryset = queryset.select_related(None)
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.only(*columns).prefetch_related(*include_prefetches(fields))
@@ -0,0 +1,63 @@
+from rest_framework import renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def encode_default(obj):
+    # What orjson and msgpack cannot encode natively: lazy strings, Decimals,
+    # querysets and the like, converted as DRF's JSON encoder would.
+    return encoders.JSONEncoder().default(obj)
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    `JSONRenderer` encoding with orjson when it is installed.
+
+    Output is compact UTF-8 JSON either way; requests for indented output,
+    such as `Accept: application/json; indent=4`, use the regular renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=encode_default)
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """
+    MessagePack responses, for clients sending `Accept: application/msgpack`.
+    Only offered when msgpack is installed.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    """
+    MessagePack request bodies, sent as `Content-Type: application/msgpack`.
+    """
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except Exception as e:
+            raise ParseError('MessagePack parse error - %s' % e)
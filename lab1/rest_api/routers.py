@@ -0,0 +1,85 @@
+import itertools
+import random
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework import permissions
+
+_state = threading.local()
+_counter = itertools.count()
+
+# Credentials must work, and stop working, the moment they are written, so
+# they are never read from a replica that may lag behind. Everything else,
+# users and profiles included, can lag like any other row: a request that
+# writes reads its own writes from the primary anyway.
+PRIMARY_MODELS = ('sessions.session', 'rest_api.token')
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', {})
+
+
+def choose_replica():
+    """
+    Pick a replica alias by `DATABASE_REPLICA_SELECTION`: 'round-robin', or
+    'weighted' by the weights in `DATABASE_REPLICAS`.
+    """
+    weights = replicas()
+    if not weights:
+        return None
+    aliases = sorted(weights)
+    if getattr(settings, 'DATABASE_REPLICA_SELECTION', 'round-robin') == 'weighted':
+        return random.choices(aliases, weights=[weights[alias] for alias in aliases])[0]
+    return aliases[next(_counter) % len(aliases)]
+
+
+class ReplicaRouter(object):
+    """
+    Send reads of safe requests to a read replica and everything else to the
+    primary.
+
+    Replicas are only used while `ReplicaMiddleware` marks the current
+    request as safe, nothing has been written in it and the primary is not
+    in a transaction, so a request always reads its own writes. Reads
+    outside requests, such as management commands, go to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not getattr(_state, 'use_replicas', False) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if model._meta.label_lower in PRIMARY_MODELS:
+            return DEFAULT_DB_ALIAS
+        return choose_replica() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _state.use_replicas = False
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = set(replicas()) | {DEFAULT_DB_ALIAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary and never migrated themselves.
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaMiddleware(object):
+    """
+    Let `ReplicaRouter` read from replicas while handling safe requests.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.use_replicas = request.method in permissions.SAFE_METHODS
+        try:
+            return self.get_response(request)
+        finally:
+            _state.use_replicas = False
@@ -0,0 +1,91 @@
+from collections import namedtuple
+
+from django.db import connection, connections, router
+from rest_framework.pagination import LimitOffsetPagination
+
+from .models import Post
+
+Hit = namedtuple('Hit', ['kind', 'id', 'rank'])
+
+POST_SQL = """
+    SELECT 'post', f.rowid, bm25(rest_api_post_fts, %s, 1.0)
+    FROM rest_api_post_fts f JOIN rest_api_post p ON p.id = f.rowid
+    WHERE rest_api_post_fts MATCH %s AND p.deleted IS NULL {author}
+"""
+
+COMMENT_SQL = """
+    SELECT 'comment', f.rowid, bm25(rest_api_comment_fts)
+    FROM rest_api_comment_fts f JOIN rest_api_comment c ON c.id = f.rowid
+    JOIN rest_api_post p ON p.id = c.post_id
+    WHERE rest_api_comment_fts MATCH %s AND c.deleted IS NULL AND p.deleted IS NULL {author}
+"""
+
+
+def match_expression(text):
+    """
+    Quote every whitespace separated term so user input can never be parsed
+    as FTS5 query syntax. Terms are ANDed.
+    """
+    return ' '.join('"%s"' % term.replace('"', '""') for term in text.split())
+
+
+class SearchQuery(object):
+    """
+    Lazy, sliceable bm25-ranked matches over posts and comments.
+
+    Behaves enough like a queryset for the DRF paginators: `count()` and
+    slicing each run one SQL query, both on the database the router picks
+    for reading posts. Hidden posts and comments, and comments on hidden
+    posts, never match.
+    """
+    # bm25 weight of a title match relative to a text match.
+    title_weight = 5.0
+
+    def __init__(self, text, author=None):
+        self.match = match_expression(text)
+        self.author = author
+        self.db = router.db_for_read(Post)
+
+    def _sql(self):
+        sql = [POST_SQL.format(author='AND p.author_id = %s' if self.author else '')]
+        params = [self.title_weight, self.match]
+        if self.author:
+            params.append(self.author)
+
+        sql.append(COMMENT_SQL.format(author='AND c.author_id = %s' if self.author else ''))
+        params.append(self.match)
+        if self.author:
+            params.append(self.author)
+        return ' UNION ALL '.join(sql), params
+
+    def count(self):
+        if not self.match:
+            return 0
+        sql, params = self._sql()
+        with connections[self.db].cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM (%s)' % sql, params)
+            return cursor.fetchone()[0]
+
+    def __getitem__(self, k):
+        assert isinstance(k, slice) and k.step is None, 'SearchQuery only supports slicing.'
+        if not self.match:
+            return []
+        sql, params = self._sql()
+        start = k.start or 0
+        # bm25() is lower for better matches.
+        sql = 'SELECT * FROM (%s) ORDER BY 3, 1, 2 LIMIT %%s OFFSET %%s' % sql
+        params += [-1 if k.stop is None else k.stop - start, start]
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return [Hit(*row) for row in cursor.fetchall()]
+
+
+def rebuild_index():
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO rest_api_post_fts(rest_api_post_fts) VALUES ('rebuild')")
+        cursor.execute("INSERT INTO rest_api_comment_fts(rest_api_comment_fts) VALUES ('rebuild')")
+
+
+class SearchPagination(LimitOffsetPagination):
+    default_limit = 20
+    max_limit = 100
@@ -1,31 +1,124 @@
-from rest_framework import serializers
-from rest_api.models import Post, Comment
+from rest_framework import permissions, serializers
+from rest_api.models import Post, Comment, FeedEntry
+from django.conf import settings
+from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 
-class PostSerializer(serializers.HyperlinkedModelSerializer):
+def query_names(request, param):
+    """
+    Names given to a comma separated query parameter such as `?fields=a,b`.
+    """
+    if request is None:
+        return set()
+    return set(name for name in request.query_params.get(param, '').split(',') if name)
+
+
+def parse_include(value):
+    """
+    `?include=comments,comments.author` as the tree
+    `{'comments': {'author': {}}}`, at most `INCLUDE_MAX_DEPTH` levels deep.
+    """
+    depth = getattr(settings, 'INCLUDE_MAX_DEPTH', 2)
+    tree = {}
+    for path in value.split(','):
+        if not path:
+            continue
+        names = path.split('.')
+        if len(names) > depth:
+            raise serializers.ValidationError({'include': ['%s is nested deeper than %d levels.' % (path, depth)]})
+        node = tree
+        for name in names:
+            node = node.setdefault(name, {})
+    return tree
+
+
+class FieldSelectionMixin(object):
+    """
+    Let clients choose the rendered fields.
+
+    Fields listed in `Meta.optional_fields` are only rendered when named in
+    `?expand=` or `?fields=`. On reads, `?fields=` keeps only the named fields
+    and `?omit=` drops fields.
+
+    `?include=` renders the relations in `Meta.includes` as the related
+    objects themselves instead of links or names, with dots for relations of
+    those, e.g. `?include=comments.author`. Embedded serializers get their
+    part of the tree as `include` and ignore the other query parameters.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.include = kwargs.pop('include', None)
+        super(FieldSelectionMixin, self).__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super(FieldSelectionMixin, self).get_fields()
+        request = self.context.get('request')
+        safe = request is not None and request.method in permissions.SAFE_METHODS
+        if self.include is None:
+            include = parse_include(request.query_params.get('include', '')) if safe else {}
+            requested = query_names(request, 'fields')
+            expand = query_names(request, 'expand') | requested | set(include)
+            omit = query_names(request, 'omit')
+        else:
+            include, requested, expand, omit = self.include, set(), set(self.include), set()
+
+        for name in getattr(self.Meta, 'optional_fields', ()):
+            if name not in expand:
+                fields.pop(name, None)
+
+        # Writes always validate against the full field set.
+        if not safe:
+            return fields
+
+        for name in list(fields):
+            if (requested and name not in requested) or name in omit:
+                fields.pop(name)
+
+        includes = getattr(self.Meta, 'includes', {})
+        for name, nested in include.items():
+            if name not in includes:
+                raise serializers.ValidationError({'include': ['%s cannot be included.' % name]})
+            if name in fields:
+                fields[name] = self.get_included_field(name, nested)
+        return fields
+
+    def get_included_field(self, name, include):
+        relation = self.Meta.model._meta.get_field(name)
+        serializer_class = globals()[self.Meta.includes[name]]
+        return serializer_class(many=relation.one_to_many, read_only=True, include=include)
+
+
+class PostSerializer(FieldSelectionMixin, serializers.HyperlinkedModelSerializer):
     author = serializers.ReadOnlyField(source='author.username')
     comments = serializers.HyperlinkedRelatedField(many=True, read_only=True, view_name='comment-detail')
 
     class Meta:
         model = Post
-        fields = ('id', 'author', 'comments', 'title', 'text', 'created')
+        fields = ('id', 'author', 'comment_count', 'comments', 'title', 'text', 'created')
+        optional_fields = ('comments',)
+        includes = {'author': 'UserSerializer', 'comments': 'CommentSerializer'}
 
-class CommentSerializer(serializers.HyperlinkedModelSerializer):
+class CommentSerializer(FieldSelectionMixin, serializers.HyperlinkedModelSerializer):
     author = serializers.ReadOnlyField(source='author.username')
     post = serializers.HyperlinkedRelatedField(many=False, read_only=True, view_name='post-detail')
 
     class Meta:
         model = Comment
         fields = ('id', 'author', 'post', 'text', 'created')
+        includes = {'author': 'UserSerializer', 'post': 'PostSerializer'}
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+class UserSerializer(FieldSelectionMixin, serializers.HyperlinkedModelSerializer):
+    post_count = serializers.ReadOnlyField(source='profile.post_count')
+    comment_count = serializers.ReadOnlyField(source='profile.comment_count')
     posts = serializers.HyperlinkedRelatedField(many=True, view_name='post-detail', read_only=True)
     comments = serializers.HyperlinkedRelatedField(many=True, view_name='comment-detail', lookup_field='pk', read_only=True)
 
     password = serializers.CharField(style={'input_type':'password'}, write_only=True)
     class Meta:
         model = User
-        fields = ('id', 'username', 'email', 'password', 'posts', 'comments')
+        fields = ('id', 'username', 'email', 'password', 'post_count', 'comment_count', 'posts', 'comments')
+        optional_fields = ('posts', 'comments')
+        includes = {'posts': 'PostSerializer', 'comments': 'CommentSerializer'}
 
     def create(self, validated_data):
         user = User.objects.create(username=validated_data['username'])
@@ -34,3 +127,35 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
 
         return user
 
+class FeedEntrySerializer(serializers.Serializer):
+    """
+    A post, or the comment of a FeedEntry, in a home feed.
+    """
+    type = serializers.SerializerMethodField()
+    created = serializers.DateTimeField(read_only=True)
+    object = serializers.SerializerMethodField()
+
+    def get_type(self, entry):
+        return 'comment' if isinstance(entry, FeedEntry) else 'post'
+
+    def get_object(self, entry):
+        if isinstance(entry, FeedEntry):
+            return CommentSerializer(entry.comment, context=self.context).data
+        return PostSerializer(entry, context=self.context).data
+
+class AuthTokenSerializer(serializers.Serializer):
+    username = serializers.CharField()
+    password = serializers.CharField(style={'input_type':'password'}, write_only=True)
+
+    def validate(self, data):
+        user = authenticate(username=data['username'], password=data['password'])
+        if user is None:
+            raise serializers.ValidationError('Unable to log in with provided credentials.')
+        data['user'] = user
+        return data
+
+class BatchRequestSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=('GET', 'POST', 'PUT', 'PATCH', 'DELETE'))
+    url = serializers.CharField()
+    body = serializers.JSONField(required=False)
+    headers = serializers.DictField(child=serializers.CharField(), required=False)
@@ -0,0 +1,262 @@
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver, Signal
+
+from .authentication import token_cache
+from .cache import response_cache
+from .events import broker
+from .models import Post, Comment, ArchivedPost, ArchivedComment, FeedEntry, Profile, Token
+from .serializers import PostSerializer, CommentSerializer
+from .tasks import created_handlers, enqueue, fan_out
+
+
+# What a write does before it returns, and what it leaves to tasks:
+#
+# - Counters are one UPDATE each, under the write lock the request already
+#   holds. Tasks may run twice, which would count twice, and counts read
+#   right after a write would lag behind it.
+# - Cache generations are bumped in memory, so the next read, the client's
+#   own included, misses rather than serving the old response.
+# - Events are rendered here, from the state written, and sent on commit by
+#   this process's broker, which holds the streams' subscribers. The
+#   run_tasks command has none to send to.
+# - Search indexing is done by SQLite triggers, in the same statement.
+#
+# Each of these costs the same however many users and handlers there are.
+# Feed fan-out and other `on_created()` handlers, whose cost grows with
+# them, run as tasks.
+
+# Sent instead of post_save by the bulk write paths, once per batch.
+post_bulk_create = Signal(providing_args=['instances'])
+
+# Sent instead of post_delete by rest_api.deletion, once per batch of rows
+# deleted or hidden. The instances only carry their keys.
+post_bulk_delete = Signal(providing_args=['instances'])
+
+
+def post_model(comment_model):
+    # Post or ArchivedPost.
+    return comment_model._meta.get_field('post').related_model
+
+
+def post_scopes(post):
+    return ['posts', 'post:%s' % post.pk, 'user:%s' % post.author_id]
+
+
+def comment_scopes(comment, post_author_id=None):
+    # Posts render hyperlinks to their comments, so the post entries go too.
+    scopes = [
+        'comments', 'comment:%s' % comment.pk,
+        'posts', 'post:%s' % comment.post_id, 'post:%s:comments' % comment.post_id,
+        'user:%s' % comment.author_id,
+    ]
+    if post_author_id is None:
+        try:
+            post_author_id = comment.post.author_id
+        except Post.DoesNotExist:
+            return scopes
+    scopes.append('user:%s' % post_author_id)
+    return scopes
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    response_cache.bump(*post_scopes(instance))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    response_cache.bump(*comment_scopes(instance))
+
+
+@receiver(post_bulk_create, sender=Post)
+def posts_bulk_created(sender, instances, **kwargs):
+    # Only 200s are cached, so nothing is stored under the new rows' own scopes.
+    scopes = set(scope for post in instances for scope in post_scopes(post))
+    response_cache.bump(*scopes.difference('post:%s' % post.pk for post in instances))
+
+
+@receiver(post_bulk_create, sender=Comment)
+def comments_bulk_created(sender, instances, **kwargs):
+    # One query for the post authors, unless the posts are already loaded.
+    missing = set(comment.post_id for comment in instances if not Comment.post.is_cached(comment))
+    post_authors = dict(Post.objects.filter(pk__in=missing).values_list('pk', 'author_id')) if missing else {}
+    scopes = set(scope for comment in instances
+                 for scope in comment_scopes(comment, post_authors.get(comment.post_id)))
+    response_cache.bump(*scopes.difference('comment:%s' % comment.pk for comment in instances))
+
+
+@receiver(post_bulk_delete, sender=Post)
+@receiver(post_bulk_delete, sender=ArchivedPost)
+def posts_bulk_deleted(sender, instances, **kwargs):
+    response_cache.bump(*set(scope for post in instances for scope in post_scopes(post)))
+
+
+@receiver(post_bulk_delete, sender=Comment)
+@receiver(post_bulk_delete, sender=ArchivedComment)
+def comments_bulk_deleted(sender, instances, **kwargs):
+    # The posts may be hidden already.
+    post_ids = set(comment.post_id for comment in instances)
+    post_authors = dict(post_model(sender)._base_manager.filter(pk__in=post_ids).values_list('pk', 'author_id'))
+    response_cache.bump(*set(scope for comment in instances
+                             for scope in comment_scopes(comment, post_authors.get(comment.post_id))))
+
+
+def event_data(instance, name):
+    if name == 'deleted':
+        return {'id': instance.pk}
+    serializer = PostSerializer if isinstance(instance, Post) else CommentSerializer
+    return serializer(instance, context={'request': None}).data
+
+
+def publish(instances, name):
+    """
+    Announce changed posts or comments on their streams once the transaction
+    commits. Payloads are rendered right away, so they hold the state that
+    was written. Hyperlinks in the payload are relative.
+    """
+    events = [('posts' if isinstance(instance, Post) else 'post:%s:comments' % instance.post_id,
+               event_data(instance, name)) for instance in instances]
+
+    def send():
+        for channel, data in events:
+            broker.publish(channel, name, data)
+    transaction.on_commit(send)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+def saved_published(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        publish([instance], 'created' if created else 'updated')
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+def deleted_published(sender, instance, **kwargs):
+    publish([instance], 'deleted')
+
+
+@receiver(post_bulk_create, sender=Post)
+@receiver(post_bulk_create, sender=Comment)
+def bulk_published(sender, instances, **kwargs):
+    publish(instances, 'created')
+
+
+@receiver(post_bulk_delete, sender=Post)
+@receiver(post_bulk_delete, sender=Comment)
+def bulk_deleted_published(sender, instances, **kwargs):
+    publish(instances, 'deleted')
+
+
+def queue_created(model, pks):
+    # One outbox row per write, however many handlers there are.
+    if created_handlers.get(model):
+        enqueue(fan_out, model=model._meta.label, pks=pks)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+def saved_queued(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        queue_created(sender, [instance.pk])
+
+
+@receiver(post_bulk_create, sender=Post)
+@receiver(post_bulk_create, sender=Comment)
+def bulk_queued(sender, instances, **kwargs):
+    queue_created(sender, [instance.pk for instance in instances])
+
+
+@receiver(post_bulk_delete, sender=Post)
+@receiver(post_bulk_delete, sender=Comment)
+def bulk_deleted_unfed(sender, instances, **kwargs):
+    # Hidden rows leave the feeds too; deleted ones skipped the cascade. The
+    # entries of a post include those of its comments.
+    field = 'post__in' if sender is Post else 'comment__in'
+    FeedEntry.objects.filter(**{field: [instance.pk for instance in instances]}).delete()
+
+
+def add_counts(model, field, counts, sign=1):
+    """
+    Apply `{pk: delta}` to a counter column, one atomic UPDATE per delta.
+    """
+    by_delta = {}
+    for pk, delta in counts.items():
+        by_delta.setdefault(delta * sign, []).append(pk)
+    for delta, pks in by_delta.items():
+        model.objects.filter(pk__in=pks).update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=Post)
+def post_counted(sender, instance, created, **kwargs):
+    if created:
+        add_counts(Profile, 'post_count', {instance.author_id: 1})
+
+
+@receiver(post_delete, sender=Post)
+def post_uncounted(sender, instance, **kwargs):
+    add_counts(Profile, 'post_count', {instance.author_id: 1}, sign=-1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_counted(sender, instance, created, **kwargs):
+    if created:
+        add_counts(Post, 'comment_count', {instance.post_id: 1})
+        add_counts(Profile, 'comment_count', {instance.author_id: 1})
+
+
+@receiver(post_delete, sender=Comment)
+def comment_uncounted(sender, instance, **kwargs):
+    add_counts(Post, 'comment_count', {instance.post_id: 1}, sign=-1)
+    add_counts(Profile, 'comment_count', {instance.author_id: 1}, sign=-1)
+
+
+@receiver(post_bulk_create, sender=Post)
+def posts_bulk_counted(sender, instances, **kwargs):
+    add_counts(Profile, 'post_count', Counter(post.author_id for post in instances))
+
+
+@receiver(post_bulk_create, sender=Comment)
+def comments_bulk_counted(sender, instances, **kwargs):
+    add_counts(Post, 'comment_count', Counter(comment.post_id for comment in instances))
+    add_counts(Profile, 'comment_count', Counter(comment.author_id for comment in instances))
+
+
+@receiver(post_bulk_delete, sender=Post)
+@receiver(post_bulk_delete, sender=ArchivedPost)
+def posts_bulk_uncounted(sender, instances, **kwargs):
+    add_counts(Profile, 'post_count', Counter(post.author_id for post in instances), sign=-1)
+
+
+@receiver(post_bulk_delete, sender=Comment)
+@receiver(post_bulk_delete, sender=ArchivedComment)
+def comments_bulk_uncounted(sender, instances, **kwargs):
+    add_counts(post_model(sender), 'comment_count', Counter(comment.post_id for comment in instances), sign=-1)
+    add_counts(Profile, 'comment_count', Counter(comment.author_id for comment in instances), sign=-1)
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Profile.objects.create(user=instance)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    # Logins save last_login only, which no cached response renders.
+    if not created and (update_fields is None or 'username' in update_fields):
+        response_cache.bump('usernames', 'user:%s' % instance.pk)
+    if not created and (update_fields is None or set(update_fields) != {'last_login'}):
+        token_cache.revoke_user(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    token_cache.revoke(instance.key)
@@ -0,0 +1,191 @@
+import json
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from .db import retry_on_busy
+from .models import Task
+from .profiling import Histogram
+
+logger = logging.getLogger('rest_api.tasks')
+
+# Task functions by name, and the tasks run for each created post or comment.
+registry = {}
+created_handlers = {}
+
+task_duration = Histogram(
+    'task_duration_seconds', 'Background task run time by task and outcome.', ('task', 'outcome'),
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def task(func):
+    """
+    Register `func` as a task for `enqueue()`. Tasks may run more than once,
+    so they must be idempotent.
+    """
+    func.task_name = '%s.%s' % (func.__module__, func.__name__)
+    registry[func.task_name] = func
+    return func
+
+
+def on_created(model):
+    """
+    Register the decorated function as a task run with `pks` of every batch
+    of `model` instances created, off the request that created them.
+    """
+    def decorator(func):
+        task(func)
+        created_handlers.setdefault(model, []).append(func.task_name)
+        return func
+    return decorator
+
+
+def enqueue(func, **kwargs):
+    """
+    Queue the task `func` with JSON `kwargs`. The outbox row is part of the
+    current transaction, so the task runs if and only if that commits.
+    """
+    row = Task.objects.create(name=func.task_name, kwargs=json.dumps(kwargs), run_after=timezone.now())
+    transaction.on_commit(lambda: submit(row.pk))
+    return row
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(getattr(settings, 'TASK_WORKERS', 4))
+        return _executor
+
+
+def shutdown():
+    """
+    Wait for running tasks and stop the worker threads. The next task starts
+    a new pool.
+    """
+    global _executor
+    with _executor_lock:
+        pool, _executor = _executor, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def submit(pk):
+    # Without in-process workers the run_tasks command does it all.
+    if getattr(settings, 'TASK_WORKERS', 4) > 0:
+        executor().submit(run, pk)
+
+
+def claim(pk):
+    """
+    Lease the task `pk` if it is due and nobody else has. Returns it, or
+    `None`.
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=getattr(settings, 'TASK_LEASE', 300))
+    claimed = Task.objects.filter(pk=pk, failed=False, run_after__lte=now).update(
+        run_after=lease, attempts=F('attempts') + 1)
+    return Task.objects.get(pk=pk) if claimed else None
+
+
+def fail(task, error):
+    # Backoff doubles with each attempt; the last one marks the task failed.
+    failed = task.attempts >= getattr(settings, 'TASK_MAX_ATTEMPTS', 5)
+    delay = getattr(settings, 'TASK_RETRY_BACKOFF', 1.0) * 2 ** (task.attempts - 1)
+    Task.objects.filter(pk=task.pk).update(
+        run_after=timezone.now() + timedelta(seconds=delay), failed=failed, last_error=error)
+    return None if failed else delay
+
+
+def execute(task):
+    """
+    Run a claimed task, then delete it, or schedule its retry.
+    """
+    start = time.perf_counter()
+    try:
+        registry[task.name](**json.loads(task.kwargs))
+    except Exception:
+        logger.exception('Task %s (%s) failed, attempt %d', task.name, task.pk, task.attempts)
+        outcome = 'error'
+        delay = retry_on_busy(fail, task, traceback.format_exc())
+        if delay is not None and getattr(settings, 'TASK_WORKERS', 4) > 0:
+            timer = threading.Timer(delay, submit, [task.pk])
+            timer.daemon = True
+            timer.start()
+    else:
+        outcome = 'ok'
+        retry_on_busy(Task.objects.filter(pk=task.pk).delete)
+    task_duration.observe((task.name, outcome), time.perf_counter() - start)
+
+
+def run(pk):
+    """
+    Claim and run the task `pk` on a worker thread.
+    """
+    try:
+        task = retry_on_busy(claim, pk)
+        if task is not None:
+            execute(task)
+    finally:
+        # Nothing else closes the connections of pool threads, which may sit
+        # idle for long between tasks.
+        connections.close_all()
+
+
+def run_due(limit=100):
+    """
+    Run up to `limit` due tasks, oldest first, in this thread: retries and
+    tasks left over by a process that died. Returns how many ran.
+    """
+    pks = Task.objects.filter(failed=False, run_after__lte=timezone.now()).order_by(
+        'run_after').values_list('pk', flat=True)[:limit]
+    ran = 0
+    for pk in list(pks):
+        task = retry_on_busy(claim, pk)
+        if task is not None:
+            execute(task)
+            ran += 1
+    return ran
+
+
+@task
+def fan_out(model, pks):
+    """
+    Queue each `on_created()` handler of `model` for `pks`, so the request
+    writes one outbox row however many handlers there are, and each handler
+    is retried on its own.
+    """
+    handlers = created_handlers.get(apps.get_model(model), [])
+
+    def queue():
+        for name in handlers:
+            enqueue(registry[name], pks=pks)
+    retry_on_busy(queue)
+
+
+def render_metrics():
+    rows = dict((failed, (count, oldest)) for failed, count, oldest in Task.objects.order_by().values_list(
+        'failed').annotate(Count('id'), Min('created')))
+    pending, oldest = rows.get(False, (0, None))
+    lines = [
+        '# HELP task_queue_depth Outbox tasks by state.',
+        '# TYPE task_queue_depth gauge',
+        'task_queue_depth{state="pending"} %d' % pending,
+        'task_queue_depth{state="failed"} %d' % rows.get(True, (0, None))[0],
+        '# HELP task_queue_oldest_seconds Age of the oldest pending task.',
+        '# TYPE task_queue_oldest_seconds gauge',
+        'task_queue_oldest_seconds %r' % ((timezone.now() - oldest).total_seconds() if oldest else 0.0),
+    ]
+    return '\n'.join(lines) + '\n' + task_duration.render()
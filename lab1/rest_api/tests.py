@@ -1,12 +1,58 @@
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+import zlib
+
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
-from django.core.urlresolvers import reverse
-from rest_framework.test import APITestCase
+from django.conf import settings
+from django.core.cache import caches
+from django.core.urlresolvers import get_resolver, resolve, reverse
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+from django.utils.six.moves.urllib.parse import urlencode
+from django.utils import timezone
+from rest_framework.pagination import Cursor
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
 from rest_framework import status
 from .models import *
 from .serializers import *
+from .pagination import KeysetPagination
+from .cache import response_cache
+from .authentication import token_cache
+from .compiled import compile_serializer, compiled_cache
+from .profiling import request_latency, request_queries
+from .db import retry_on_busy
+from .deletion import cascade_delete, purge_deleted
+from .archive import archive
+from . import feed
+from . import tasks
+from .events import Subscription, broker
+from . import renderers
+from .routers import ReplicaRouter, choose_replica, _state as router_state
 
 # Create your tests here.
 
+# Feed fan-out would write from worker threads alongside the test.
+@override_settings(TASK_WORKERS=0)
+class QueuedTasksTestCase(TransactionTestCase):
+    """
+    A TransactionTestCase whose tasks stay queued until the test runs them.
+    """
+
+
 # Test users
 class CreateUserTestCase(APITestCase):
     def setUp(self):
@@ -27,8 +73,8 @@ class ReadUserTestCase(APITestCase):
     def test_read_user_list(self):
         response = self.client.get(reverse('user-list'), format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['username'], self.user.username)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['username'], self.user.username)
 
     def test_read_user_details(self):
         response = self.client.get(reverse('user-detail', args=[self.user.id]))
@@ -110,7 +156,7 @@ class ReadPostTestCase(APITestCase):
         response = self.client.get(reverse('post-list'))
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_read_post_details(self):
         response = self.client.get(reverse('post-detail', args=[self.post.id]))
@@ -207,19 +253,19 @@ class ReadCommentTestCase(APITestCase):
         response = self.client.get(reverse('comment-by-post-list', args=[self.post.id]))
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
     
     def test_read_comment_list(self):
         response = self.client.get(reverse('comment-list'))
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_read_user_comment_list(self):
         response = self.client.get(reverse('comment-by-user-list', args=[self.user.id]))
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_read_comment_details(self):
         response = self.client.get(reverse('comment-detail', args=[self.comment.id]))
@@ -296,3 +342,1920 @@ class DeleteCommentTestCase(APITestCase):
         response = self.client.delete(reverse('comment-detail', args=[self.comment.id]))
 
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+# Test pagination
+class KeysetPaginationTestCase(APITestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        Post.objects.bulk_create([Post(author=self.user, title='title', text='text') for _ in range(25)])
+        # Force timestamp ties so the id tiebreaker has to do the work.
+        Post.objects.filter(id__lte=Post.objects.order_by('id')[10].id).update(created=timezone.now())
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(post['id'] for post in response.data['results'])
+            url = response.data['next']
+        return ids, response
+
+    def test_walk_all_pages(self):
+        ids, _ = self.walk(reverse('post-list') + '?page_size=4')
+        expected = list(Post.objects.order_by('created', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_walk_back(self):
+        ids, response = self.walk(reverse('post-list') + '?page_size=4')
+        url, back = response.data['previous'], []
+        while url:
+            response = self.client.get(url)
+            back[:0] = [post['id'] for post in response.data['results']]
+            url = response.data['previous']
+        self.assertEqual(back, ids[:len(back)])
+        self.assertEqual(len(back) + 1, len(ids))
+
+    def test_empty_page(self):
+        response = self.client.get(reverse('post-list') + '?page_size=4')
+        Post.objects.exclude(pk__in=[post['id'] for post in response.data['results']]).delete()
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['results'], response.data['next'], response.data['previous']),
+                         ([], None, None))
+
+        # Past the last user.
+        response = self.client.get(reverse('user-list') + '?cursor=' + urlsafe_b64encode(b'p=1000').decode())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('post-list') + '?cursor=garbage')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_late_page_same_plan(self):
+        paginator = KeysetPagination()
+        posts = list(Post.objects.order_by('created', 'id'))
+
+        def plan(instance):
+            cursor = instance and Cursor(offset=0, reverse=False, position=[instance.created, instance.id])
+            queryset = paginator.get_page_queryset(Post.objects.all(), cursor)[:5]
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as c:
+                c.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                # SQLite before 3.36 says "SCAN TABLE".
+                return [row[-1].replace(' TABLE ', ' ') for row in c.fetchall()]
+
+        first, early, late = plan(None), plan(posts[1]), plan(posts[-2])
+        self.assertEqual(early, late)
+        self.assertEqual(late, ['SEARCH rest_api_post USING INDEX post_created_id_idx (created>?)'])
+        # Page one walks the same index from its start instead of the cursor.
+        self.assertEqual(first, ['SCAN rest_api_post USING INDEX post_created_id_idx'])
+
+
+# Test query budgets
+class QueryBudgetTestCase(APITestCase):
+    seed = 20
+
+    def setUp(self):
+        response_cache.cache.clear()
+        self.users = [User.objects.create(username='user%d' % i) for i in range(self.seed)]
+        Post.objects.bulk_create([Post(author=user, title='title', text='text') for user in self.users])
+        self.post = Post.objects.first()
+        Comment.objects.bulk_create([Comment(author=user, post=self.post, text='text') for user in self.users])
+        Comment.objects.bulk_create([Comment(author=self.users[0], post=post, text='text') for post in Post.objects.all()])
+
+    def assertBudget(self, budget, url):
+        with self.assertNumQueries(budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_post_list(self):
+        self.assertBudget(1, reverse('post-list'))
+
+    def test_post_by_user_list(self):
+        self.assertBudget(1, reverse('post-by-user-list', args=[self.users[0].id]))
+
+    def test_post_detail(self):
+        self.assertBudget(2, reverse('post-detail', args=[self.post.id]))
+
+    def test_comment_list(self):
+        self.assertBudget(1, reverse('comment-list'))
+
+    def test_comment_by_post_list(self):
+        self.assertBudget(2, reverse('comment-by-post-list', args=[self.post.id]))
+
+    def test_comment_by_user_list(self):
+        self.assertBudget(1, reverse('comment-by-user-list', args=[self.users[0].id]))
+
+    def test_comment_detail(self):
+        self.assertBudget(2, reverse('comment-detail', args=[Comment.objects.first().id]))
+
+    def test_user_list(self):
+        self.assertBudget(1, reverse('user-list'))
+
+    def test_user_detail(self):
+        self.assertBudget(2, reverse('user-detail', args=[self.users[0].id]))
+
+    def test_sparse_fields_skip_join(self):
+        self.assertBudget(1, reverse('post-list') + '?fields=id,title')
+
+    def test_post_list_expanded(self):
+        self.assertBudget(2, reverse('post-list') + '?expand=comments')
+
+    def test_user_list_expanded(self):
+        self.assertBudget(3, reverse('user-list') + '?expand=posts,comments')
+
+
+# Test response cache
+class ResponseCacheTestCase(APITestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.post = Post.objects.create(author=self.user, title='title', text='text')
+        self.other = Post.objects.create(author=self.user, title='other', text='text')
+
+    def test_second_read_is_hit(self):
+        url = reverse('post-list')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json()['results'][0]['title'], self.post.title)
+
+    def test_counters(self):
+        before = response_cache.stats()
+        url = reverse('post-list')
+        self.client.get(url)
+        self.client.get(url)
+        after = response_cache.stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+    def test_query_string_is_part_of_key(self):
+        url = reverse('post-list')
+        self.client.get(url)
+        self.assertEqual(self.client.get(url + '?page_size=1')['X-Cache'], 'MISS')
+
+    def test_comment_invalidates_only_its_post(self):
+        detail = reverse('post-detail', args=[self.post.id])
+        other = reverse('post-detail', args=[self.other.id])
+        comments = reverse('comment-by-post-list', args=[self.post.id])
+        for url in (detail, other, comments):
+            self.client.get(url)
+
+        self.client.login(username='bozo', password='bozo')
+        self.client.post(comments, {'text': 'text'})
+        self.client.logout()
+
+        self.assertEqual(self.client.get(detail)['X-Cache'], 'MISS')
+        self.assertEqual(len(self.client.get(comments).json()['results']), 1)
+        self.assertEqual(self.client.get(other)['X-Cache'], 'HIT')
+
+    def test_delete_invalidates_list(self):
+        url = reverse('post-list')
+        self.client.get(url)
+        self.other.delete()
+        self.assertEqual(len(self.client.get(url).json()['results']), 1)
+
+    def test_rename_invalidates_author(self):
+        url = reverse('post-detail', args=[self.post.id])
+        self.client.get(url)
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(self.client.get(url).json()['author'], 'renamed')
+
+    def test_authenticated_user_varies_key(self):
+        url = reverse('post-detail', args=[self.post.id])
+        self.client.get(url)
+        self.client.login(username='bozo', password='bozo')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+
+# Test conditional requests
+class ConditionalRequestTestCase(APITestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.post = Post.objects.create(author=self.user, title='title', text='text')
+        self.comment = Comment.objects.create(author=self.user, post=self.post, text='text')
+
+    def test_etag_not_modified(self):
+        url = reverse('post-detail', args=[self.post.id])
+        etag = self.client.get(url)['ETag']
+        # From the cached response, with no validator query.
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        response_cache.cache.clear()
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_if_modified_since_ignored(self):
+        # A rename changes the comment but not its updated date.
+        url = reverse('comment-detail', args=[self.comment.id])
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.user.username = 'renamed'
+        self.user.save()
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['author'], 'renamed')
+
+    def test_new_comment_changes_etags(self):
+        detail = reverse('post-detail', args=[self.post.id])
+        comments = reverse('comment-by-post-list', args=[self.post.id])
+        etags = [self.client.get(url)['ETag'] for url in (detail, comments)]
+        Comment.objects.create(author=self.user, post=self.post, text='text')
+        for url, etag in zip((detail, comments), etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deleted_comment_changes_list_etag(self):
+        url = reverse('comment-by-post-list', args=[self.post.id])
+        etag = self.client.get(url)['ETag']
+        self.comment.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_user_etag(self):
+        url = reverse('user-detail', args=[self.user.id])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        Post.objects.create(author=self.user, title='title', text='text')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_if_match_update(self):
+        url = reverse('comment-detail', args=[self.comment.id])
+        etag = self.client.get(url)['ETag']
+        self.client.login(username='bozo', password='bozo')
+        response = self.client.put(url, {'text': 'first'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        response = self.client.put(url, {'text': 'second'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Comment.objects.get(pk=self.comment.id).text, 'first')
+
+    def test_if_match_delete(self):
+        url = reverse('post-detail', args=[self.post.id])
+        self.client.login(username='bozo', password='bozo')
+        response = self.client.delete(url, HTTP_IF_MATCH='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        etag = self.client.get(url)['ETag']
+        response = self.client.delete(url, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+# Test token authentication
+class TokenAuthenticationTestCase(APITestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.data = {'title': 'Title', 'text': 'Text'}
+
+    def obtain(self):
+        response = self.client.post(reverse('token'), {'username': 'bozo', 'password': 'bozo'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['token']
+
+    def test_obtain_token_bad_credentials(self):
+        response = self.client.post(reverse('token'), {'username': 'bozo', 'password': 'wrong'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_token_is_stored_hashed(self):
+        key = self.obtain()
+        self.assertFalse(Token.objects.filter(key=key).exists())
+        self.assertTrue(Token.objects.filter(key=Token.hash_key(key)).exists())
+
+    def test_create_post_with_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.obtain())
+        response = self.client.post(reverse('post-list'), self.data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['author'], 'bozo')
+
+    def test_cached_token_skips_lookup(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.obtain())
+        url = reverse('user-detail', args=[self.user.id])
+        self.client.get(url)
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+    def test_invalid_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token nope')
+        response = self.client.post(reverse('post-list'), self.data)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoke_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.obtain())
+        self.client.post(reverse('post-list'), self.data)
+        response = self.client.delete(reverse('token'))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.post(reverse('post-list'), self.data)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.obtain())
+        self.client.post(reverse('post-list'), self.data)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post(reverse('post-list'), self.data)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cache_is_bounded(self):
+        with self.settings(TOKEN_CACHE_SIZE=2):
+            for key in 'abc':
+                token_cache.set(key, self.user)
+            self.assertIsNone(token_cache.get('a'))
+            self.assertIsNotNone(token_cache.get('c'))
+
+    def test_cache_ttl(self):
+        with self.settings(TOKEN_CACHE_TTL=-1):
+            token_cache.set('a', self.user)
+        self.assertIsNone(token_cache.get('a'))
+
+
+# Test batch create
+class BatchCreateTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.post = Post.objects.create(author=self.user, title='title', text='text')
+        self.client.force_authenticate(self.user)
+
+    def batch(self, size):
+        return [{'title': 'title %d' % i, 'text': 'text'} for i in range(size)]
+
+    def test_create_posts(self):
+        response = self.client.post(reverse('post-list'), self.batch(3))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([post['title'] for post in response.data], ['title 0', 'title 1', 'title 2'])
+        for post in response.data:
+            self.assertEqual(Post.objects.get(pk=post['id']).title, post['title'])
+            self.assertEqual(post['author'], 'bozo')
+
+    def test_create_comments(self):
+        url = reverse('comment-by-post-list', args=[self.post.id])
+        response = self.client.post(url, [{'text': 'a'}, {'text': 'b'}])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Comment.objects.filter(post=self.post, author=self.user).count(), 2)
+
+    def test_comments_on_missing_post(self):
+        response = self.client.post(reverse('comment-by-post-list', args=[219]), [{'text': 'a'}])
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_item_rejects_batch(self):
+        batch = self.batch(3)
+        del batch[1]['text']
+        response = self.client.post(reverse('post-list'), batch)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('text', response.data[1])
+        self.assertEqual(Post.objects.count(), 1)
+
+    def test_batch_size_limit(self):
+        with self.settings(BATCH_CREATE_MAX_SIZE=2):
+            response = self.client.post(reverse('post-list'), self.batch(3))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_constant_queries(self):
+        url = reverse('comment-by-post-list', args=[self.post.id])
+        # Two of these are the savepoint of the busy retry, one the outbox row.
+        with self.assertNumQueries(10):
+            self.client.post(url, [{'text': 'text'}] * 10)
+        with self.assertNumQueries(10):
+            self.client.post(url, [{'text': 'text'}] * 150)
+
+    def test_invalidates_cache(self):
+        url = reverse('post-list')
+        self.client.get(url)
+        self.client.post(url, self.batch(2))
+        self.assertEqual(len(self.client.get(url).data['results']), 3)
+
+
+# Test counters
+class CounterTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.other = User.objects.create_user(username='ja', password='ja')
+        self.post = Post.objects.create(author=self.user, title='title', text='text')
+
+    def counts(self):
+        self.post.refresh_from_db()
+        return (self.post.comment_count,
+                Profile.objects.get(user=self.user).post_count,
+                Profile.objects.get(user=self.other).comment_count)
+
+    def test_create_and_delete(self):
+        comment = Comment.objects.create(author=self.other, post=self.post, text='text')
+        self.assertEqual(self.counts(), (1, 1, 1))
+        comment.delete()
+        self.assertEqual(self.counts(), (0, 1, 0))
+
+    def test_batch_create(self):
+        self.client.force_authenticate(self.other)
+        self.client.post(reverse('comment-by-post-list', args=[self.post.id]), [{'text': 'text'}] * 3)
+        self.assertEqual(self.counts(), (3, 1, 3))
+
+    def test_post_save_keeps_count(self):
+        stale = Post.objects.get(pk=self.post.id)
+        Comment.objects.create(author=self.other, post=self.post, text='text')
+        stale.title = 'edited'
+        stale.save()
+        self.assertEqual(self.counts(), (1, 1, 1))
+
+    def test_rebuild_command(self):
+        Comment.objects.create(author=self.other, post=self.post, text='text')
+        Post.objects.update(comment_count=7)
+        Profile.objects.filter(user=self.other).delete()
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(self.counts(), (1, 1, 1))
+
+    def test_counts_rendered(self):
+        Comment.objects.create(author=self.other, post=self.post, text='text')
+        post = self.client.get(reverse('post-detail', args=[self.post.id])).data
+        self.assertEqual(post['comment_count'], 1)
+        self.assertNotIn('comments', post)
+        user = self.client.get(reverse('user-detail', args=[self.user.id])).data
+        self.assertEqual((user['post_count'], user['comment_count']), (1, 0))
+        self.assertNotIn('posts', user)
+
+    def test_expand(self):
+        comment = Comment.objects.create(author=self.other, post=self.post, text='text')
+        post = self.client.get(reverse('post-detail', args=[self.post.id]) + '?expand=comments').data
+        self.assertEqual(post['comments'], ['http://testserver' + reverse('comment-detail', args=[comment.id])])
+
+
+# Test sparse fieldsets
+class SparseFieldsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.post = Post.objects.create(author=self.user, title='title', text='text')
+        Comment.objects.create(author=self.user, post=self.post, text='text')
+
+    def capture(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, ' '.join(query['sql'] for query in queries.captured_queries)
+
+    def test_fields(self):
+        response, sql = self.capture(reverse('post-list') + '?fields=id,title,created')
+        self.assertEqual(list(response.data['results'][0]), ['id', 'title', 'created'])
+        self.assertNotIn('"text"', sql)
+        self.assertNotIn('auth_user', sql)
+
+    def test_omit(self):
+        response, sql = self.capture(reverse('comment-list') + '?omit=text,author')
+        self.assertEqual(list(response.data['results'][0]), ['id', 'post', 'created'])
+        self.assertNotIn('"text"', sql)
+
+    def test_fields_with_relation(self):
+        response, sql = self.capture(reverse('post-detail', args=[self.post.id]) + '?fields=author,comments')
+        self.assertEqual(list(response.data), ['author', 'comments'])
+        self.assertEqual(len(response.data['comments']), 1)
+        self.assertNotIn('"rest_api_post"."text"', sql)
+
+    def test_user_fields(self):
+        response, sql = self.capture(reverse('user-list') + '?fields=id,post_count')
+        self.assertEqual(response.data['results'][0], {'id': self.user.id, 'post_count': 1})
+        self.assertNotIn('password', sql)
+
+    def test_fields_change_etag(self):
+        url = reverse('post-detail', args=[self.post.id])
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url + '?fields=id', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_writes_ignore_fields(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse('post-list') + '?fields=id', {'title': 'title', 'text': 'text'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+# Test search
+class SearchTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.other = User.objects.create_user(username='ja', password='ja')
+        self.post = Post.objects.create(author=self.user, title='Django tips', text='Use select_related.')
+        self.body = Post.objects.create(author=self.other, title='Misc', text='Something about django.')
+        self.comment = Comment.objects.create(author=self.other, post=self.post, text='Great django advice')
+
+    def search(self, query):
+        response = self.client.get(reverse('search') + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(hit['type'], hit['object']['id']) for hit in response.data['results']]
+
+    def test_ranked_matches(self):
+        hits = self.search('?q=django')
+        self.assertEqual(hits[0], ('post', self.post.id))
+        self.assertEqual(set(hits), {('post', self.post.id), ('post', self.body.id), ('comment', self.comment.id)})
+
+    def test_author_filter(self):
+        self.assertEqual(set(self.search('?q=django&author=%d' % self.other.id)),
+                         {('post', self.body.id), ('comment', self.comment.id)})
+
+    def test_index_follows_writes(self):
+        self.post.title = 'Flask tips'
+        self.post.text = 'nothing'
+        self.post.save()
+        self.comment.delete()
+        Comment.objects.bulk_create([Comment(author=self.user, post=self.body, text='flask here')])
+        self.assertEqual(self.search('?q=django'), [('post', self.body.id)])
+        self.assertEqual(len(self.search('?q=flask')), 2)
+
+    def test_pagination(self):
+        response = self.client.get(reverse('search') + '?q=django&limit=2')
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_hidden_rows_are_not_counted(self):
+        Post.all_objects.filter(pk=self.body.pk).update(deleted=timezone.now())
+        Comment.objects.create(author=self.user, post=self.body, text='django on a hidden post')
+        hidden = Comment.objects.create(author=self.user, post=self.post, text='hidden django')
+        Comment.all_objects.filter(pk=hidden.pk).update(deleted=timezone.now())
+
+        response = self.client.get(reverse('search') + '?q=django&limit=2')
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(set((hit['type'], hit['object']['id']) for hit in response.data['results']),
+                         {('post', self.post.id), ('comment', self.comment.id)})
+
+    def test_query_syntax_is_escaped(self):
+        self.assertEqual(self.search('?q=%22django%20OR%20(NEAR'), [])
+
+    def test_missing_query(self):
+        response = self.client.get(reverse('search'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO rest_api_post_fts(rest_api_post_fts) VALUES ('delete-all')")
+        self.assertEqual(self.search('?q=tips'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('?q=tips'), [('post', self.post.id)])
+
+
+# Test export
+class ExportTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        Post.objects.bulk_create([Post(author=self.user, title='title %d' % i, text='text') for i in range(7)])
+        Post.objects.update(created=timezone.now())
+
+    def export(self, query=''):
+        response = self.client.get(reverse('export', args=['posts']) + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_export_all(self):
+        with self.settings(EXPORT_CHUNK_SIZE=3):
+            rows = self.export()
+        self.assertEqual([row['id'] for row in rows],
+                         list(Post.objects.order_by('created', 'id').values_list('id', flat=True)))
+        self.assertEqual(rows[0]['author'], 'bozo')
+
+    def test_resume(self):
+        rows = self.export()
+        query = '?' + urlencode({'after_created': rows[2]['created'], 'after_id': rows[2]['id']})
+        self.assertEqual(self.export(query), rows[3:])
+
+    def test_bad_watermark(self):
+        response = self.client.get(reverse('export', args=['posts']) + '?after_created=yesterday&after_id=1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batches_are_bounded(self):
+        with self.settings(EXPORT_CHUNK_SIZE=3):
+            with CaptureQueriesContext(connection) as queries:
+                self.export()
+        self.assertEqual(len(queries), 3)
+        self.assertTrue(all('LIMIT 3' in query['sql'] for query in queries.captured_queries))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_ndjson', 'comments', stdout=out, stderr=StringIO())
+        self.assertEqual(out.getvalue(), '')
+        Comment.objects.create(author=self.user, post=Post.objects.first(), text='text')
+        call_command('export_ndjson', 'comments', stdout=out, stderr=StringIO())
+        self.assertEqual(json.loads(out.getvalue())['text'], 'text')
+
+
+# Test import
+class ImportTestCase(APITestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, rows):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.writelines(json.dumps(row) + '\n' for row in rows)
+        return path
+
+    def load(self, kind, rows, *args):
+        call_command('import_ndjson', kind, self.write(kind, rows), *args, stdout=StringIO(), stderr=StringIO())
+
+    def test_import(self):
+        self.load('users', [{'username': 'bozo', 'password': 'bozo'}, {'username': 'clown'}])
+        self.load('posts', [
+            {'id': 10, 'author': 'bozo', 'title': 'title', 'text': 'text', 'created': '2017-01-01T10:00:00+00:00'},
+            {'author': 'clown', 'title': 'title', 'text': 'text'},
+        ])
+        self.load('comments', [{'author': 'clown', 'post_id': 10, 'text': 'text'}] * 3, '--batch-size', '2')
+
+        bozo = User.objects.get(username='bozo')
+        self.assertTrue(bozo.check_password('bozo'))
+        self.assertFalse(User.objects.get(username='clown').has_usable_password())
+        self.assertEqual(Post.objects.get(pk=10).created.year, 2017)
+        self.assertEqual(Post.objects.get(pk=10).comment_count, 3)
+        self.assertEqual(Post.objects.latest('pk').pk, 11)
+        self.assertEqual(Profile.objects.get(user__username='clown').comment_count, 3)
+        self.assertEqual(Profile.objects.get(user=bozo).post_count, 1)
+        # auto_now fields work again once the import is done.
+        self.assertGreater(Post.objects.create(author=bozo, title='title', text='text').created.year, 2017)
+
+    def test_prehashed_passwords(self):
+        self.load('users', [{'username': 'bozo', 'password': make_password('bozo')}], '--passwords', 'prehashed')
+        self.assertTrue(User.objects.get(username='bozo').check_password('bozo'))
+
+    def test_unknown_author(self):
+        self.load('users', [{'username': 'bozo'}])
+        rows = [{'author': author, 'title': 'title', 'text': 'text'} for author in ('bozo', 'nobody')]
+        with self.assertRaisesRegex(CommandError, 'Line 2: unknown author'):
+            self.load('posts', rows, '--batch-size', '1')
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertEqual(ImportCheckpoint.objects.get(name=os.path.join(self.directory, 'posts')).line, 1)
+
+    def test_failed_batch_keeps_checkpoint(self):
+        self.load('users', [{'username': 'bozo'}])
+        rows = [{'id': 10, 'author': 'bozo', 'title': 'title', 'text': 'text'}] * 2
+        with self.assertRaises(IntegrityError):
+            self.load('posts', rows, '--batch-size', '1')
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertEqual(ImportCheckpoint.objects.get(name=os.path.join(self.directory, 'posts')).line, 1)
+
+    def test_resume(self):
+        self.load('users', [{'username': 'bozo'}])
+        rows = [{'author': 'bozo', 'title': 'title %d' % i, 'text': 'text'} for i in range(5)]
+        path = self.write('posts', rows)
+        ImportCheckpoint.objects.create(name=path, offset=sum(len(json.dumps(row)) + 1 for row in rows[:3]), line=3)
+
+        call_command('import_ndjson', 'posts', path, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(list(Post.objects.values_list('title', flat=True)), ['title 3', 'title 4'])
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    def test_export_round_trip(self):
+        user = User.objects.create_user(username='bozo', password='bozo')
+        post = Post.objects.create(author=user, title='title', text='text')
+        Comment.objects.create(author=user, post=post, text='text')
+        for kind in ('posts', 'comments'):
+            out = StringIO()
+            call_command('export_ndjson', kind, stdout=out, stderr=StringIO())
+            with open(os.path.join(self.directory, kind), 'w') as f:
+                f.write(out.getvalue())
+        exported = list(Comment.objects.values('id', 'post_id', 'created', 'updated'))
+        Post.objects.all().delete()
+
+        for kind in ('posts', 'comments'):
+            call_command('import_ndjson', kind, os.path.join(self.directory, kind),
+                         stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(list(Comment.objects.values('id', 'post_id', 'created', 'updated')), exported)
+        self.assertEqual(Post.objects.get().comment_count, 1)
+
+
+# Test compiled serializers
+class CompiledSerializerTestCase(APITestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.other = User.objects.create_user(username='ja', password='ja')
+        posts = [Post.objects.create(author=user, title='title', text='text') for user in (self.user, self.other) * 3]
+        for post in posts[:4]:
+            Comment.objects.create(author=self.other, post=post, text='text')
+            Comment.objects.create(author=self.user, post=post, text='text')
+
+    def get(self, url, compiled):
+        response_cache.cache.clear()
+        with self.settings(COMPILED_SERIALIZERS=compiled):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.content
+
+    def test_parity(self):
+        urls = [
+            reverse('post-list'),
+            reverse('post-list') + '?expand=comments&page_size=4',
+            reverse('post-list') + '?fields=id,comments,created',
+            reverse('post-list') + '?omit=text,author',
+            reverse('post-by-user-list', args=[self.user.id]) + '?expand=comments',
+            reverse('comment-list') + '?page_size=3',
+            reverse('comment-by-post-list', args=[Post.objects.first().id]),
+            reverse('comment-by-user-list', args=[self.other.id]) + '?fields=post',
+            reverse('user-list'),
+            reverse('user-list') + '?expand=posts,comments',
+            reverse('post-list', kwargs={'format': 'json'}) + '?expand=comments',
+        ]
+        for url in urls:
+            compiled = self.get(url, True)
+            self.assertEqual(compiled, self.get(url, False), url)
+            # Follow the cursor from the compiled page too.
+            following = json.loads(compiled.decode())['next']
+            if following:
+                self.assertEqual(self.get(following, True), self.get(following, False), following)
+
+    def test_compiles_every_serializer(self):
+        request = self.client.get(reverse('post-list') + '?expand=comments,posts').wsgi_request
+        context = {'request': Request(request)}
+        for serializer_class in (PostSerializer, CommentSerializer, UserSerializer):
+            self.assertIsNotNone(compile_serializer(serializer_class(context=context)), serializer_class)
+
+    def test_falls_back_on_unsupported_fields(self):
+        class TitleSerializer(serializers.ModelSerializer):
+            shout = serializers.SerializerMethodField()
+
+            class Meta:
+                model = Post
+                fields = ('id', 'shout')
+
+        self.assertIsNone(compile_serializer(TitleSerializer()))
+
+    def test_compiles_once_per_selection(self):
+        compiled_cache.clear()
+        with mock.patch('rest_api.compiled.compile_serializer', wraps=compile_serializer) as compile:
+            for _ in range(3):
+                self.get(reverse('post-list'), True)
+                self.get(reverse('post-list') + '?fields=id,comments', True)
+            self.assertEqual(compile.call_count, 2)
+            # Hyperlinks are absolute, so another scheme compiles its own.
+            response_cache.cache.clear()
+            response = self.client.get(reverse('post-list') + '?fields=id,comments', secure=True)
+            self.assertIn(b'https://testserver/', response.content)
+            self.assertEqual(compile.call_count, 3)
+
+
+# Test benchmarks
+class BenchTestCase(APITestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def bench(self, *args):
+        call_command('bench', '--users', '3', '--posts', '2', '--comments', '2', '--requests', '2',
+                     '--host', 'testserver', *args, stdout=StringIO(), stderr=StringIO())
+
+    def test_covers_every_route(self):
+        from .management.commands.bench import ENDPOINTS
+        ids = {'user': 1, 'reader': 1, 'post': 1, 'comment': 1, 'word': 'word'}
+        covered = set(resolve(url(ids).split('?')[0]).url_name for _, _, url, _ in ENDPOINTS)
+        named = set(name for name in get_resolver().reverse_dict if isinstance(name, str))
+        self.assertEqual(named - covered, set())
+
+    def test_report_and_baseline(self):
+        report = os.path.join(self.directory, 'report.json')
+        caches['default'].set('kept', 1)
+        self.bench('--output', report)
+        with open(report) as f:
+            results = json.load(f)
+        self.assertEqual(results['dataset'], {'users': 3, 'posts': 2, 'comments': 2, 'seed': 0})
+        self.assertEqual(results['endpoints']['post-list']['queries'], 1)
+        self.assertFalse(Post.objects.exists())
+        self.assertEqual(caches['default'].get('kept'), 1)
+        self.assertEqual(broker.subscribers('posts'), 0)
+
+        # Generous thresholds pass against the report itself...
+        self.bench('--baseline', report, '--threshold', '100', '--slack-ms', '1000')
+
+        # ...but one more query than the baseline fails.
+        results['endpoints']['post-list']['queries'] = 0
+        with open(report, 'w') as f:
+            json.dump(results, f)
+        with self.assertRaisesRegex(CommandError, '1 regressions'):
+            self.bench('--baseline', report, '--threshold', '100', '--slack-ms', '1000')
+
+
+# Test profiling
+class ProfilingTestCase(APITestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        for metric in (request_latency, request_queries):
+            metric.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        Post.objects.create(author=self.user, title='title', text='text')
+
+    def server_timing(self, response):
+        timings = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, duration = entry.split(';')[:2]
+            timings[name] = float(duration[len('dur='):])
+        return timings
+
+    def test_server_timing(self):
+        self.client.login(username='bozo', password='bozo')
+        response = self.client.get(reverse('post-list'))
+        timings = self.server_timing(response)
+        self.assertEqual(set(timings), {'sql', 'auth', 'view', 'render', 'total'})
+        self.assertIn('sql;dur=', response['Server-Timing'])
+        self.assertIn('desc="3 queries"', response['Server-Timing'])
+        self.assertLessEqual(timings['sql'] + timings['view'] + timings['render'], timings['total'] + 0.01)
+
+        # Cached and streamed responses are not rendered by the template machinery.
+        response = self.client.get(reverse('post-list'))
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertNotIn('render', self.server_timing(response))
+        self.assertIn('Server-Timing', self.client.get(reverse('export', args=['posts'])))
+
+    def test_metrics(self):
+        self.client.get(reverse('post-list'))
+        self.client.get(reverse('post-list'))
+        self.client.get('/api/missing')
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_count{route="post-list",method="GET"} 2', body)
+        self.assertIn('http_request_duration_seconds_bucket{route="post-list",method="GET",le="+Inf"} 2', body)
+        self.assertIn('http_request_queries_bucket{route="post-list",method="GET",le="0.0"} 1', body)
+        self.assertIn('http_request_queries_bucket{route="post-list",method="GET",le="1.0"} 2', body)
+        self.assertIn('http_request_queries_count{route="unmatched",method="GET"} 1', body)
+
+    def test_streamed_queries_counted(self):
+        response = self.client.get(reverse('export', args=['posts']))
+        self.assertIn('desc="0 queries"', response['Server-Timing'])
+        self.assertNotIn('route="export"', request_queries.render())
+        b''.join(response.streaming_content)
+        response.close()
+        self.assertIn('http_request_queries_bucket{route="export",method="GET",le="0.0"} 0',
+                      request_queries.render())
+        self.assertIn('http_request_queries_count{route="export",method="GET"} 1', request_queries.render())
+
+    def test_auth_timed_for_every_view(self):
+        from rest_framework.settings import api_settings
+        from .profiling import TimedAuthentication
+        self.assertEqual(api_settings.DEFAULT_AUTHENTICATION_CLASSES, [TimedAuthentication])
+        response = self.client.get(reverse('search'), {'q': 'title'}, HTTP_AUTHORIZATION='Basic Ym96bzpib3pv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('auth', self.server_timing(response))
+        response = self.client.get(reverse('search'), {'q': 'title'}, HTTP_AUTHORIZATION='Basic Ym96bzp4')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+    def test_slow_query_log(self):
+        with self.settings(PROFILING_SLOW_QUERY_MS=0, PROFILING_SLOW_QUERY_SAMPLE=1.0):
+            with self.assertLogs('rest_api.profiling', 'WARNING') as logs:
+                self.client.get(reverse('post-list'))
+        self.assertIn('Slow query on post-list', logs.output[0])
+        self.assertIn('FROM "rest_api_post"', logs.output[0])
+
+
+# Test SQLite production settings
+class SQLiteTestCase(QueuedTasksTestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA %s' % name)
+            return cursor.fetchone()[0]
+
+    def test_pragmas(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('cache_size'), -64 * 1024)
+
+    def test_retry_on_busy(self):
+        calls = []
+
+        def write(failures, message='database is locked'):
+            calls.append(connection.in_atomic_block)
+            if len(calls) <= failures:
+                raise OperationalError(message)
+            return 'done'
+
+        with self.settings(SQLITE_BUSY_BACKOFF=0, SQLITE_BUSY_RETRIES=2):
+            self.assertEqual(retry_on_busy(write, 2), 'done')
+            self.assertEqual(calls, [True] * 3)
+
+            calls.clear()
+            with self.assertRaisesRegex(OperationalError, 'locked'):
+                retry_on_busy(write, 3)
+            self.assertEqual(len(calls), 3)
+
+            calls.clear()
+            with self.assertRaisesRegex(OperationalError, 'no such table'):
+                retry_on_busy(write, 1, 'no such table')
+            self.assertEqual(len(calls), 1)
+
+    def test_concurrent_reads_and_writes(self):
+        from .management.commands.bench_concurrency import run_workload
+        results = run_workload(threads=4, operations=25, write_ratio=0.3)
+        self.assertEqual(results['errors'], [])
+        self.assertEqual(results['reads'] + results['writes'], 100)
+        post = Post.objects.get(pk=results['post'])
+        self.assertEqual(post.comments.count(), results['writes'])
+        self.assertEqual(post.comment_count, results['writes'])
+        self.assertEqual(Profile.objects.get(user=post.author).comment_count, results['writes'])
+
+
+# Test read replicas
+class ReplicaTestCase(QueuedTasksTestCase):
+    def setUp(self):
+        from .management.commands.sync_replicas import copy_database
+        response_cache.cache.clear()
+        token_cache.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.token, self.key = Token.issue(self.user)
+        self.old = Post.objects.create(author=self.user, title='old', text='text')
+
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'replica.sqlite3')
+        copy_database('default', path)
+        connections.databases['replica'] = dict(connection.settings_dict, NAME=path, CONN_MAX_AGE=0)
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(connections.databases.pop, 'replica')
+        self.addCleanup(self.close_replica)
+
+    def close_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+
+    def test_safe_requests_read_replica(self):
+        Post.objects.create(author=self.user, title='new', text='text')
+        with self.settings(DATABASE_REPLICAS={'replica': 1}):
+            response = self.client.get(reverse('post-list'), HTTP_AUTHORIZATION='Token ' + self.key)
+            self.assertEqual([post['title'] for post in response.data['results']], ['old'])
+
+            response = self.client.post(reverse('comment-by-post-list', args=[self.old.pk]), {'text': 'text'},
+                                        HTTP_AUTHORIZATION='Token ' + self.key)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(self.old.comments.count(), 1)
+
+    def test_credentials_read_from_primary(self):
+        user = User.objects.create_user(username='new', password='new')
+        token, key = Token.issue(user)
+        with self.settings(DATABASE_REPLICAS={'replica': 1}):
+            # The token, and the user joined to it, come from the primary...
+            response = self.client.get(reverse('user-list'), HTTP_AUTHORIZATION='Token ' + key)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # ...while users themselves are read from the replica.
+            self.assertEqual([item['username'] for item in response.data['results']], ['bozo'])
+            token.delete()
+            response = self.client.get(reverse('user-list'), HTTP_AUTHORIZATION='Token ' + key)
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_sync_retires_cached_responses(self):
+        url = reverse('post-list')
+        with self.settings(DATABASE_REPLICAS={'replica': 1}):
+            self.client.get(url)
+            Post.objects.create(author=self.user, title='new', text='text')
+            # Read from the replica, and cached, after the write.
+            self.assertEqual([post['title'] for post in self.client.get(url).data['results']], ['old'])
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+            call_command('sync_replicas', stdout=StringIO())
+            response = self.client.get(url)
+        self.assertEqual([post['title'] for post in response.data['results']], ['old', 'new'])
+
+    def test_search_reads_replica(self):
+        Post.objects.create(author=self.user, title='new', text='text')
+        with self.settings(DATABASE_REPLICAS={'replica': 1}):
+            response = self.client.get(reverse('search'), {'q': 'text'})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual([hit['object']['title'] for hit in response.data['results']], ['old'])
+
+    def test_reads_after_write_use_primary(self):
+        router = ReplicaRouter()
+        with self.settings(DATABASE_REPLICAS={'replica': 1}):
+            self.assertEqual(router.db_for_read(Post), 'default')
+            router_state.use_replicas = True
+            try:
+                self.assertEqual(router.db_for_read(Post), 'replica')
+                self.assertEqual(router.db_for_read(Token), 'default')
+                with transaction.atomic():
+                    self.assertEqual(router.db_for_read(Post), 'default')
+                self.assertEqual(router.db_for_write(Post), 'default')
+                self.assertEqual(router.db_for_read(Post), 'default')
+            finally:
+                router_state.use_replicas = False
+
+    def test_replica_selection(self):
+        with self.settings(DATABASE_REPLICAS={'a': 1, 'b': 1}):
+            chosen = [choose_replica() for _ in range(4)]
+            self.assertEqual(sorted(chosen), ['a', 'a', 'b', 'b'])
+            self.assertNotEqual(chosen[0], chosen[1])
+        with self.settings(DATABASE_REPLICAS={'a': 1, 'b': 0}, DATABASE_REPLICA_SELECTION='weighted'):
+            self.assertEqual({choose_replica() for _ in range(10)}, {'a'})
+        with self.settings(DATABASE_REPLICAS={}):
+            self.assertIsNone(choose_replica())
+
+    def test_sync_replicas(self):
+        Post.objects.create(author=self.user, title='new', text='text')
+        with self.settings(DATABASE_REPLICAS={'replica': 1}):
+            out = StringIO()
+            call_command('sync_replicas', stdout=out)
+            self.assertIn('Copied default to replica.', out.getvalue())
+            self.assertEqual(Post.objects.using('replica').count(), 2)
+
+        with self.settings(DATABASE_REPLICAS={}):
+            with self.assertRaisesRegex(CommandError, 'No replicas'):
+                call_command('sync_replicas')
+
+
+# Test event streams
+class EventStreamTestCase(QueuedTasksTestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.client.force_login(self.user)
+        self.post = Post.objects.create(author=self.user, title='title', text='text')
+        self.last_id = broker.history[-1].id
+
+    def stream(self, url, **extra):
+        response = self.client.get(url, HTTP_ACCEPT='text/event-stream', **extra)
+        self.addCleanup(response.close)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(next(response.streaming_content), b'retry: 3000\n\n')
+        return response
+
+    def next_event(self, response):
+        return self.parse(next(response.streaming_content))
+
+    def parse(self, message):
+        fields = dict(line.split(': ', 1) for line in message.decode('utf-8').strip().split('\n'))
+        return fields.get('id'), fields['event'], json.loads(fields['data'])
+
+    def test_live_events(self):
+        stream = self.stream(reverse('post-stream'))
+        self.assertEqual(broker.subscribers('posts'), 1)
+
+        response = self.client.post(reverse('post-list'), {'title': 'new', 'text': 'text'})
+        id, name, data = self.next_event(stream)
+        self.assertEqual(int(id), broker.history[-1].id)
+        self.assertEqual(name, 'created')
+        self.assertEqual(data['id'], response.data['id'])
+        self.assertEqual(data['title'], 'new')
+        self.assertEqual(data['author'], 'bozo')
+
+        self.client.patch(reverse('post-detail', args=[data['id']]), json.dumps({'title': 'changed'}),
+                          content_type='application/json')
+        self.assertEqual(self.next_event(stream)[1:], ('updated', dict(data, title='changed')))
+        self.client.delete(reverse('post-detail', args=[data['id']]))
+        self.assertEqual(self.next_event(stream)[1:], ('deleted', {'id': data['id']}))
+
+        stream.close()
+        self.assertEqual(broker.subscribers('posts'), 0)
+
+    def test_comment_stream_of_one_post(self):
+        other = Post.objects.create(author=self.user, title='other', text='text')
+        stream = self.stream(reverse('comment-by-post-stream', args=[self.post.pk]))
+        Comment.objects.create(author=self.user, post=other, text='elsewhere')
+        Comment.objects.bulk_create([Comment(author=self.user, post=self.post, text='bulk')])
+        self.client.post(reverse('comment-by-post-list', args=[self.post.pk]), {'text': 'here'})
+        id, name, data = self.next_event(stream)
+        self.assertEqual((name, data['text']), ('created', 'here'))
+        self.assertEqual(data['post'], reverse('post-detail', args=[self.post.pk]))
+
+        response = self.client.get(reverse('comment-by-post-stream', args=[0]), HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_resume(self):
+        from .bulk import bulk_create
+        from .signals import post_bulk_create
+        Post.objects.bulk_create([Post(author=self.user, title='unannounced', text='text')])
+        with transaction.atomic():
+            posts = bulk_create(Post, [Post(author=self.user, title='bulk', text='text')])
+            post_bulk_create.send(sender=Post, instances=posts)
+        Comment.objects.create(author=self.user, post=self.post, text='comment')
+
+        stream = self.stream(reverse('post-stream'), HTTP_LAST_EVENT_ID=str(self.last_id))
+        self.assertEqual(self.next_event(stream)[2]['title'], 'bulk')
+        stream.close()
+
+        stream = self.stream(reverse('post-stream') + '?last_event_id=%d' % (broker.history[0].id - 2))
+        self.assertEqual(self.next_event(stream)[1], 'reset')
+
+        response = self.client.get(reverse('post-stream'), HTTP_ACCEPT='text/event-stream', HTTP_LAST_EVENT_ID='x')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(response.content.startswith(b'event: error\n'))
+
+    def test_payload_rendered_at_commit(self):
+        with transaction.atomic():
+            post = Post.objects.create(author=self.user, title='first', text='text')
+            post.title = 'second'
+        Post.objects.filter(pk=post.pk).update(title='third')
+        self.assertIn(b'"title":"first"', broker.history[-1].encode())
+
+        pk = post.pk
+        post.delete()
+        self.assertIn(b'data: {"id":%d}' % pk, broker.history[-1].encode())
+
+    def test_rolled_back_writes_are_not_published(self):
+        with transaction.atomic():
+            Post.objects.create(author=self.user, title='gone', text='text')
+            transaction.set_rollback(True)
+        self.assertEqual(broker.history[-1].id, self.last_id)
+
+    def test_slow_subscriber_is_dropped(self):
+        subscription = Subscription('posts', 2)
+        for event in 'abc':
+            subscription.put(event)
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual(subscription.get(0), ['a', 'b'])
+        self.assertEqual(subscription.get(0), [])
+
+        with self.settings(SSE_QUEUE_SIZE=1):
+            stream = self.stream(reverse('post-stream'))
+            Post.objects.create(author=self.user, title='first', text='text')
+            Post.objects.create(author=self.user, title='second', text='text')
+            self.assertEqual(self.next_event(stream)[2]['title'], 'first')
+            self.assertEqual(list(stream.streaming_content), [])
+        self.assertEqual(broker.subscribers('posts'), 0)
+
+    def test_keepalive(self):
+        with self.settings(SSE_HEARTBEAT=0):
+            stream = self.stream(reverse('post-stream'))
+            self.assertEqual(next(stream.streaming_content), b': keepalive\n\n')
+
+
+# Test throttling
+class ThrottleTestCase(APITestCase):
+    def setUp(self):
+        caches['throttle'].clear()
+        response_cache.cache.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.other = User.objects.create_user(username='other', password='other')
+
+    def rates(self, **rates):
+        return self.settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES=rates))
+
+    def clock(self, now):
+        from .throttling import WindowThrottle
+        timer = mock.patch.object(WindowThrottle, 'timer', return_value=now)
+        self.addCleanup(timer.stop)
+        return timer.start()
+
+    def test_window(self):
+        self.clock(1020.0)
+        with self.rates(anon='3/min'):
+            for remaining in (2, 1, 0):
+                response = self.client.get(reverse('comment-list'))
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response['RateLimit-Limit'], '3')
+                self.assertEqual(response['RateLimit-Remaining'], str(remaining))
+            self.assertEqual(response['RateLimit-Reset'], '60')
+
+            for _ in range(2):
+                response = self.client.get(reverse('user-list'))
+                self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+                self.assertEqual(response['Retry-After'], '60')
+                self.assertEqual(response['RateLimit-Remaining'], '0')
+
+            # Users have their own counts.
+            self.client.force_authenticate(self.user)
+            response = self.client.get(reverse('user-list'))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('RateLimit-Limit', response)
+
+    def test_next_window(self):
+        from .throttling import WindowThrottle
+        from .views import PostList
+        view = PostList()
+        view.headers = {}
+        request = Request(APIRequestFactory().get('/'))
+        request.user = self.user
+        throttle = WindowThrottle()
+        timer = self.clock(1000.0)
+
+        with self.rates(user='20/s'):
+            self.assertEqual(sum(throttle.allow_request(request, view) for _ in range(25)), 20)
+            self.assertAlmostEqual(throttle.wait(), 1.0)
+            self.assertEqual(view.headers['RateLimit-Reset'], '1')
+
+            timer.return_value = 1000.75
+            self.assertFalse(throttle.allow_request(request, view))
+            self.assertAlmostEqual(throttle.wait(), 0.25)
+
+            timer.return_value = 1001.0
+            self.assertEqual(sum(throttle.allow_request(request, view) for _ in range(25)), 20)
+
+            request.user = self.other
+            self.assertTrue(throttle.allow_request(request, view))
+            self.assertEqual(view.headers['RateLimit-Remaining'], '19')
+
+    def test_keys_per_window(self):
+        timer = self.clock(120.0)
+        with self.rates(anon='1/min'):
+            self.assertEqual(self.client.get(reverse('comment-list')).status_code, 200)
+            self.assertEqual(self.client.get(reverse('comment-list')).status_code, 429)
+            self.assertEqual(caches['throttle'].get('throttle:anon:127.0.0.1:2'), 2)
+
+            timer.return_value = 180.0
+            self.assertEqual(self.client.get(reverse('comment-list')).status_code, 200)
+            self.assertEqual(caches['throttle'].get('throttle:anon:127.0.0.1:3'), 1)
+
+    def test_per_view_and_method(self):
+        with self.rates(**{'user': '5/min', 'user.POST': '1/min', 'search.user': '1/min'}):
+            self.client.force_authenticate(self.user)
+            self.assertEqual(self.client.post(reverse('post-list'), {'title': 'a', 'text': 'b'}).status_code, 201)
+            self.assertEqual(self.client.post(reverse('post-list'), {'title': 'a', 'text': 'b'}).status_code, 429)
+
+            self.assertEqual(self.client.get(reverse('search') + '?q=a').status_code, 200)
+            self.assertEqual(self.client.get(reverse('search') + '?q=a').status_code, 429)
+
+            response = self.client.get(reverse('post-list'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['RateLimit-Limit'], '5')
+            self.assertEqual(response['RateLimit-Remaining'], '4')
+
+    def test_default_rates(self):
+        response = self.client.get(reverse('post-list'))
+        self.assertEqual(response['RateLimit-Limit'], '600')
+        response = self.client.get(reverse('export', args=['posts']))
+        self.assertEqual(response['RateLimit-Limit'], '10')
+
+
+# Test compound documents
+class IncludeTestCase(APITestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo', email='bozo@example.com')
+        self.post = Post.objects.create(author=self.user, title='title', text='text')
+        self.users = [User.objects.create_user(username='user%d' % i, password='!') for i in range(3)]
+
+    def add_comments(self, count):
+        Comment.objects.bulk_create([Comment(author=self.users[i % 3], post=self.post, text='comment %d' % i)
+                                     for i in range(count)])
+
+    def test_post_with_comments_and_authors(self):
+        self.add_comments(5)
+        url = reverse('post-detail', args=[self.post.pk]) + '?include=author,comments.author'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['author']['username'], 'bozo')
+        self.assertEqual(response.data['author']['post_count'], 1)
+        self.assertNotIn('posts', response.data['author'])
+        self.assertEqual([comment['text'] for comment in response.data['comments']],
+                         ['comment %d' % i for i in range(5)])
+        self.assertEqual(response.data['comments'][1]['author']['username'], 'user1')
+        self.assertEqual(response.data['comments'][1]['post'], 'http://testserver' + reverse('post-detail', args=[self.post.pk]))
+        self.assertNotIn('ETag', response)
+
+        # Post, its author and profile, comments, their authors and profiles.
+        self.add_comments(500)
+        response_cache.cache.clear()
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['comments']), 505)
+
+    def test_lists(self):
+        self.add_comments(3)
+        response = self.client.get(reverse('comment-list') + '?include=post')
+        self.assertEqual([comment['post']['title'] for comment in response.data['results']], ['title'] * 3)
+        self.assertNotIn('comments', response.data['results'][0]['post'])
+
+        response = self.client.get(reverse('post-list') + '?include=comments&fields=id,comments')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'comments'})
+        self.assertEqual(len(response.data['results'][0]['comments']), 3)
+
+        response = self.client.get(reverse('user-detail', args=[self.user.pk]) + '?include=posts')
+        self.assertEqual([post['title'] for post in response.data['posts']], ['title'])
+        self.assertNotIn('comments', response.data)
+
+    def test_cached_responses_follow_embedded_objects(self):
+        url = reverse('post-detail', args=[self.post.pk]) + '?include=author'
+        self.assertEqual(self.client.get(url).data['author']['post_count'], 1)
+        Post.objects.create(author=self.user, title='other', text='text')
+        self.assertEqual(self.client.get(url).data['author']['post_count'], 2)
+
+    def test_invalid(self):
+        response = self.client.get(reverse('post-list') + '?include=title')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('include', response.data)
+
+        response = self.client.get(reverse('post-list') + '?include=comments.post.author')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with self.settings(INCLUDE_MAX_DEPTH=3):
+            response = self.client.get(reverse('post-list') + '?include=comments.post.author')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+# Test multi-id lookups and batches
+class BatchTestCase(APITestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.token, self.key = Token.issue(self.user)
+        self.posts = [Post.objects.create(author=self.user, title='title %d' % i, text='text') for i in range(5)]
+
+    def test_ids(self):
+        ids = [self.posts[3].pk, self.posts[1].pk, 0]
+        url = reverse('post-list') + '?ids=' + ','.join(map(str, ids))
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual([post['id'] for post in response.data['results']], sorted(ids[:2]))
+
+        comment = Comment.objects.create(author=self.user, post=self.posts[0], text='text')
+        response = self.client.get(reverse('comment-list') + '?ids=%d' % comment.pk)
+        self.assertEqual([c['id'] for c in response.data['results']], [comment.pk])
+        response = self.client.get(reverse('user-list') + '?ids=%d,' % self.user.pk)
+        self.assertEqual([u['username'] for u in response.data['results']], ['bozo'])
+
+        self.assertEqual(self.client.get(reverse('post-list') + '?ids=1,x').status_code, status.HTTP_400_BAD_REQUEST)
+        with self.settings(IDS_FILTER_MAX_SIZE=2):
+            response = self.client.get(reverse('post-list') + '?ids=1,2,3')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.key)
+        post = self.posts[0]
+        requests = [
+            {'method': 'GET', 'url': 'http://testserver' + reverse('post-detail', args=[post.pk]) + '?fields=title'},
+            {'method': 'POST', 'url': reverse('comment-by-post-list', args=[post.pk]), 'body': {'text': 'hello'}},
+            {'method': 'PATCH', 'url': reverse('post-detail', args=[post.pk]), 'body': {'title': 'changed'}},
+            {'method': 'GET', 'url': reverse('post-detail', args=[post.pk]), 'headers': {'If-None-Match': '"x"'}},
+            {'method': 'DELETE', 'url': reverse('token')},
+            {'method': 'GET', 'url': '/nowhere'},
+            {'method': 'GET', 'url': reverse('post-stream'), 'headers': {'Accept': 'text/event-stream'}},
+            {'method': 'POST', 'url': reverse('batch'), 'body': []},
+        ]
+        response = self.client.post(reverse('batch'), requests)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data
+        self.assertEqual([result['status'] for result in results], [200, 201, 200, 200, 204, 404, 400, 400])
+        self.assertEqual(results[0]['body'], {'title': 'title 0'})
+        self.assertEqual(results[1]['body']['author'], 'bozo')
+        self.assertEqual(results[1]['headers']['Content-Type'], 'application/json')
+        self.assertEqual(results[3]['body']['title'], 'changed')
+        self.assertEqual(results[3]['body']['comment_count'], 1)
+        self.assertIn('ETag', results[3]['headers'])
+        self.assertEqual(results[4]['body'], '')
+        self.assertFalse(Token.objects.exists())
+
+        # The token went with the batch's fourth request.
+        response = self.client.post(reverse('batch'), requests[:1])
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @unittest.skipIf(renderers.msgpack is None, 'msgpack is not installed')
+    def test_binary_body(self):
+        import base64
+        url = reverse('post-detail', args=[self.posts[0].pk])
+        response = self.client.post(reverse('batch'), [{'method': 'GET', 'url': url + '?format=msgpack'}])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        result = response.data[0]
+        self.assertEqual(result['encoding'], 'base64')
+        self.assertEqual(renderers.msgpack.unpackb(base64.b64decode(result['body']), raw=False)['title'], 'title 0')
+
+    def test_anonymous_batch(self):
+        response = self.client.post(reverse('batch'), [
+            {'method': 'GET', 'url': reverse('post-detail', args=[self.posts[0].pk])},
+            {'method': 'POST', 'url': reverse('post-list'), 'body': {'title': 'title', 'text': 'text'}},
+        ])
+        self.assertEqual([result['status'] for result in response.data], [200, 403])
+
+    def test_invalid_batch(self):
+        response = self.client.post(reverse('batch'), [{'method': 'TRACE', 'url': '/'}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with self.settings(BATCH_MAX_REQUESTS=1):
+            response = self.client.post(reverse('batch'), [{'method': 'GET', 'url': '/'}] * 2)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# Test renderers and compression
+class CompressionTestCase(APITestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        Post.objects.bulk_create([Post(author=self.user, title='title %d' % i, text='text ' * 20) for i in range(20)])
+
+    def test_gzip(self):
+        plain = self.client.get(reverse('post-list'))
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertEqual(plain['Vary'], 'Accept, Cookie, Accept-Encoding')
+
+        response = self.client.get(reverse('post-list'), HTTP_ACCEPT_ENCODING='deflate, gzip;q=0.5')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertLess(len(response.content), len(plain.content) / 4)
+        self.assertEqual(zlib.decompress(response.content, 16 + zlib.MAX_WBITS), plain.content)
+
+        response = self.client.get(reverse('post-list'), HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_etag(self):
+        post = Post.objects.create(author=self.user, title='long', text='text ' * 200)
+        url = reverse('post-detail', args=[post.pk])
+        plain = self.client.get(url)['ETag']
+        etag = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        self.assertEqual(etag, plain[:-1] + '-gzip"')
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=plain)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], plain)
+
+        self.client.force_authenticate(self.user)
+        response = self.client.patch(url, {'title': 'longer'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_skipped_responses(self):
+        post = Post.objects.first()
+        response = self.client.get(reverse('post-detail', args=[post.pk]), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+        response = self.client.get(reverse('post-list'), HTTP_ACCEPT='text/html', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_streaming(self):
+        response = self.client.get(reverse('export', args=['posts']), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = zlib.decompress(b''.join(response.streaming_content), 16 + zlib.MAX_WBITS).splitlines()
+        self.assertEqual(len(lines), 20)
+
+        # Each event can be decoded as soon as it arrives.
+        response = self.client.get(reverse('post-stream'), HTTP_ACCEPT='text/event-stream',
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.addCleanup(response.close)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(decompressor.decompress(next(response.streaming_content)), b'retry: 3000\n\n')
+
+    @unittest.skipIf(renderers.msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse('post-list'), renderers.msgpack.packb({'title': 'packed', 'text': 'text'}),
+                                    content_type='application/msgpack', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(renderers.msgpack.unpackb(response.content, raw=False)['title'], 'packed')
+
+    def test_fast_json(self):
+        response = self.client.get(reverse('post-list'))
+        self.assertEqual(renderers.FastJSONRenderer().render(response.data), JSONRenderer().render(response.data))
+        indented = renderers.FastJSONRenderer().render({'a': 1}, 'application/json; indent=2')
+        self.assertEqual(indented, b'{\n  "a": 1\n}')
+
+    def test_bench(self):
+        out = StringIO()
+        call_command('bench_renderers', '--posts', '10', '--repeat', '1', '--host', 'testserver', stdout=out)
+        self.assertIn('json     gzip', out.getvalue())
+        self.assertFalse(Post.objects.filter(author__username__startswith='bench-').exists())
+
+
+# Test cascading and soft deletes
+class DeletionTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.other = User.objects.create_user(username='ja', password='ja')
+        self.post = Post.objects.create(author=self.user, title='title', text='text')
+        self.other_post = Post.objects.create(author=self.other, title='title', text='text')
+        for _ in range(5):
+            Comment.objects.create(author=self.other, post=self.post, text='text')
+            Comment.objects.create(author=self.user, post=self.other_post, text='text')
+
+    def counts(self, user):
+        profile = Profile.objects.get(user=user)
+        return profile.post_count, profile.comment_count
+
+    def test_delete_post_in_batches(self):
+        self.client.force_authenticate(self.user)
+        with self.settings(DELETE_BATCH_SIZE=2), CaptureQueriesContext(connection) as queries:
+            response = self.client.delete(reverse('post-detail', args=[self.post.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Comment.all_objects.filter(post=self.post.id).exists())
+        self.assertFalse(Post.all_objects.filter(pk=self.post.id).exists())
+        self.assertEqual(self.counts(self.other), (1, 0))
+        # Three batches of comments, not a DELETE and signals per comment.
+        deletes = [query for query in queries if query['sql'].startswith('DELETE FROM "rest_api_comment"')]
+        self.assertEqual(len(deletes), 3)
+
+    def test_delete_user(self):
+        self.client.force_authenticate(self.user)
+        with self.settings(DELETE_BATCH_SIZE=2):
+            response = self.client.delete(reverse('user-detail', args=[self.user.id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(User.objects.filter(pk=self.user.id).exists())
+        self.assertEqual(Comment.all_objects.count(), 0)
+        self.assertEqual(Post.all_objects.count(), 1)
+        self.other_post.refresh_from_db()
+        self.assertEqual(self.other_post.comment_count, 0)
+        self.assertEqual(self.counts(self.other), (1, 0))
+
+    def test_cached_responses_invalidated(self):
+        url = reverse('comment-by-post-list', args=[self.post.id])
+        self.assertEqual(len(self.client.get(url).data['results']), 5)
+        cascade_delete(self.post)
+        self.assertEqual(len(self.client.get(url).data['results']), 0)
+
+    def test_if_match_checked_once(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('post-detail', args=[self.post.id])
+        etag = self.client.get(url)['ETag']
+        response = self.client.delete(url, HTTP_IF_MATCH='"stale"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(Comment.objects.filter(post=self.post).count(), 5)
+        response = self.client.delete(url, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_soft_delete_post(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('post-detail', args=[self.post.id])
+        with self.settings(SOFT_DELETE=True):
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('comment-list')).data['results'][0]['post'],
+                         'http://testserver' + reverse('post-detail', args=[self.other_post.id]))
+        self.assertEqual(Comment.all_objects.filter(post=self.post).count(), 5)
+        self.assertEqual(self.counts(self.user), (0, 5))
+        self.assertEqual(self.counts(self.other), (1, 0))
+
+        # Kept until they are old enough.
+        self.assertEqual(purge_deleted(), (0, 0, 0))
+        self.assertEqual(purge_deleted(timedelta(0)), (5, 1, 0))
+        self.assertFalse(Post.all_objects.filter(pk=self.post.id).exists())
+        self.assertEqual(self.counts(self.other), (1, 0))
+
+    def test_soft_delete_user(self):
+        token, key = Token.issue(self.user)
+        cascade_delete(self.user, soft=True)
+        self.assertEqual(self.client.get(reverse('user-detail', args=[self.user.id])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(self.client.get(reverse('user-list')).data['results']), 1)
+        self.assertEqual(self.client.get(reverse('post-list')).data['results'][0]['id'], self.other_post.id)
+        self.assertEqual(self.client.get(reverse('comment-list')).data['results'], [])
+        response = self.client.get(reverse('user-list'), HTTP_AUTHORIZATION='Token ' + key)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        out = StringIO()
+        call_command('purge_deleted', '--older-than', '0', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Purged 10 comments, 1 posts and 1 users.')
+        self.assertFalse(User.objects.filter(pk=self.user.id).exists())
+        self.assertFalse(Token.objects.exists())
+        self.assertEqual(self.counts(self.other), (1, 0))
+
+    def test_purge_takes_late_comments(self):
+        cascade_delete(self.post, soft=True)
+        Comment.objects.create(author=self.other, post=self.post, text='late')
+        self.assertEqual(purge_deleted(timedelta(0)), (5, 1, 0))
+        self.assertFalse(Comment.all_objects.filter(post=self.post.id).exists())
+        self.assertEqual(self.counts(self.other), (1, 0))
+
+
+# Test background tasks
+class TaskQueueTestCase(TransactionTestCase):
+    def setUp(self):
+        self.addCleanup(tasks.shutdown)
+        # Only the handlers registered by the test run.
+        handlers = dict(tasks.created_handlers)
+        tasks.created_handlers.clear()
+        self.addCleanup(tasks.created_handlers.update, handlers)
+        response_cache.cache.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.client.force_login(self.user)
+
+    def register(self, func, model=None):
+        if model is None:
+            tasks.task(func)
+        else:
+            tasks.on_created(model)(func)
+            self.addCleanup(tasks.created_handlers[model].remove, func.task_name)
+        self.addCleanup(tasks.registry.pop, func.task_name)
+        return func
+
+    def register_handlers(self, count, seconds):
+        ran = []
+        for i in range(count):
+            def handler(pks, i=i):
+                time.sleep(seconds)
+                ran.append((i, pks))
+            handler.__name__ = 'handler_%d' % i
+            self.register(handler, Post)
+        return ran
+
+    def wait_for_queue(self, timeout=10):
+        deadline = time.time() + timeout
+        while Task.objects.exists():
+            self.assertLess(time.time(), deadline, 'Tasks still queued.')
+            time.sleep(0.01)
+
+    def timed_post(self):
+        start = time.perf_counter()
+        response = self.client.post(reverse('post-list'), json.dumps({'title': 'title', 'text': 'text'}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return time.perf_counter() - start
+
+    def test_write_latency_flat(self):
+        baseline = min(self.timed_post() for _ in range(3))
+        self.wait_for_queue()
+        # A second of handler work for each post.
+        ran = self.register_handlers(50, 0.02)
+        loaded = min(self.timed_post() for _ in range(3))
+        self.assertLess(loaded, baseline + 0.2)
+        self.wait_for_queue()
+        self.assertEqual(len(ran), 150)
+
+    def test_one_row_per_write(self):
+        self.register_handlers(20, 0)
+        with self.settings(TASK_WORKERS=0):
+            self.client.post(reverse('post-list'), json.dumps([{'title': 'title', 'text': 'text'}] * 3),
+                             content_type='application/json')
+        self.assertEqual(Task.objects.get().name, 'rest_api.tasks.fan_out')
+        self.assertEqual(len(json.loads(Task.objects.get().kwargs)['pks']), 3)
+        with self.settings(TASK_WORKERS=0):
+            tasks.run_due()
+        self.assertEqual(Task.objects.count(), 20)
+
+    def test_synchronous_side_effects(self):
+        def noop(pks):
+            pass
+        self.register(noop, Comment)
+        post = Post.objects.create(author=self.user, title='title', text='text')
+        url = reverse('comment-by-post-list', args=[post.pk])
+        self.client.get(url)
+        with self.settings(TASK_WORKERS=0):
+            self.client.post(url, json.dumps({'text': 'unqueued'}), content_type='application/json')
+        # Still queued, yet counted, indexed and out of the cache.
+        self.assertTrue(Task.objects.exists())
+        self.assertEqual(Post.objects.get(pk=post.pk).comment_count, 1)
+        self.assertEqual(Profile.objects.get(user=self.user).comment_count, 1)
+        self.assertEqual(self.client.get(reverse('search'), {'q': 'unqueued'}).data['count'], 1)
+        self.assertEqual(len(self.client.get(url).data['results']), 1)
+
+    def test_retry_with_backoff(self):
+        calls = []
+
+        def flaky(n):
+            calls.append(n)
+            if len(calls) == 1:
+                raise ValueError('boom')
+        self.register(flaky)
+
+        with self.settings(TASK_WORKERS=0, TASK_RETRY_BACKOFF=60):
+            row = tasks.enqueue(flaky, n=1)
+            with self.assertLogs('rest_api.tasks', 'ERROR'):
+                self.assertEqual(tasks.run_due(), 1)
+            row.refresh_from_db()
+            self.assertEqual(row.attempts, 1)
+            self.assertIn('ValueError: boom', row.last_error)
+            self.assertGreater(row.run_after, timezone.now() + timedelta(seconds=50))
+            self.assertEqual(tasks.run_due(), 0)
+
+            Task.objects.update(run_after=timezone.now())
+            self.assertEqual(tasks.run_due(), 1)
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(calls, [1, 1])
+
+    def test_gives_up(self):
+        def broken():
+            raise ValueError('boom')
+        self.register(broken)
+
+        with self.settings(TASK_WORKERS=0, TASK_MAX_ATTEMPTS=2, TASK_RETRY_BACKOFF=0):
+            tasks.enqueue(broken)
+            with self.assertLogs('rest_api.tasks', 'ERROR') as logs:
+                self.assertEqual(tasks.run_due(), 1)
+                self.assertEqual(tasks.run_due(), 1)
+                self.assertEqual(tasks.run_due(), 0)
+            self.assertEqual(len(logs.records), 2)
+        self.assertTrue(Task.objects.get().failed)
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('task_queue_depth{state="failed"} 1', metrics)
+        self.assertIn('task_queue_depth{state="pending"} 0', metrics)
+        self.assertIn('task_duration_seconds_count{task="%s",outcome="error"}' % broken.task_name, metrics)
+
+    def test_rerun_after_lost_worker(self):
+        with self.settings(TASK_WORKERS=0):
+            row = tasks.enqueue(tasks.fan_out, model='rest_api.Post', pks=[])
+            # A worker claims it and dies.
+            self.assertIsNotNone(tasks.claim(row.pk))
+            self.assertEqual(tasks.run_due(), 0)
+            Task.objects.update(run_after=timezone.now())
+            out = StringIO()
+            call_command('run_tasks', '--once', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Ran 1 tasks.')
+        self.assertFalse(Task.objects.exists())
+
+    def test_rolled_back_write(self):
+        self.register_handlers(1, 0)
+        with transaction.atomic():
+            Post.objects.create(author=self.user, title='title', text='text')
+            transaction.set_rollback(True)
+        self.assertFalse(Task.objects.exists())
+
+
+# Test archival
+class ArchiveTestCase(APITestCase):
+    def setUp(self):
+        response_cache.cache.clear()
+        self.user = User.objects.create_user(username='bozo', password='bozo')
+        self.other = User.objects.create_user(username='ja', password='ja')
+        old = timezone.now() - timedelta(days=200)
+        self.quiet = Post.objects.create(author=self.user, title='quiet', text='text')
+        self.active = Post.objects.create(author=self.user, title='active', text='text')
+        self.comments = [Comment.objects.create(author=self.other, post=self.quiet, text='text') for _ in range(3)]
+        Comment.objects.create(author=self.other, post=self.active, text='recent')
+        Post.objects.update(created=old)
+        Comment.objects.filter(post=self.quiet).update(created=old)
+
+    def test_moves_quiet_threads(self):
+        out = StringIO()
+        call_command('archive', '--older-than', '30', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Archived 1 posts.')
+        self.assertEqual(list(Post.objects.values_list('pk', flat=True)), [self.active.pk])
+        self.assertEqual(ArchivedPost.objects.get().pk, self.quiet.pk)
+        self.assertEqual(ArchivedPost.objects.get().comment_count, 3)
+        self.assertEqual(sorted(ArchivedComment.objects.values_list('pk', flat=True)),
+                         [comment.pk for comment in self.comments])
+        self.assertFalse(Comment.objects.filter(post=self.quiet.pk).exists())
+        self.assertEqual(archive(timedelta(days=30)), 0)
+
+    def test_batches(self):
+        Comment.objects.update(created=timezone.now() - timedelta(days=200))
+        with self.settings(ARCHIVE_BATCH_SIZE=1), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(archive(timedelta(days=30)), 2)
+        self.assertEqual(ArchivedComment.objects.count(), 4)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "rest_api_archivedpost"')]
+        self.assertEqual(len(inserts), 2)
+
+    def test_detail_fallback(self):
+        post_url = reverse('post-detail', args=[self.quiet.pk])
+        comment_url = reverse('comment-detail', args=[self.comments[0].pk])
+        before = [self.client.get(url + '?expand=comments').content for url in (post_url, comment_url)]
+        archive(timedelta(days=30))
+        response_cache.cache.clear()
+        after = [self.client.get(url + '?expand=comments').content for url in (post_url, comment_url)]
+        self.assertEqual(after, before)
+
+        self.client.force_authenticate(self.user)
+        response = self.client.put(post_url, {'title': 'edited', 'text': 'text'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_lists_ask_for_archive(self):
+        url = reverse('post-list')
+        before = self.client.get(url + '?expand=comments').data['results']
+        archive(timedelta(days=30))
+        self.assertEqual([post['id'] for post in self.client.get(url).data['results']], [self.active.pk])
+        archived = self.client.get(url + '?archive=true&expand=comments').data['results']
+        self.assertEqual(archived, [post for post in before if post['id'] == self.quiet.pk])
+
+        url = reverse('comment-by-post-list', args=[self.quiet.pk])
+        self.assertEqual(self.client.get(url).data['results'], [])
+        self.assertEqual(len(self.client.get(url + '?archive=true').data['results']), 3)
+        url = reverse('comment-by-user-list', args=[self.other.pk])
+        self.assertEqual(len(self.client.get(url + '?archive=1').data['results']), 3)
+
+    def test_counters_kept(self):
+        archive(timedelta(days=30))
+        call_command('rebuild_counters', stdout=StringIO())
+        profile = Profile.objects.get(user=self.other)
+        self.assertEqual(profile.comment_count, 4)
+        self.assertEqual(Profile.objects.get(user=self.user).post_count, 2)
+
+    def test_deleted_with_user(self):
+        archive(timedelta(days=30))
+        cascade_delete(self.user, soft=True)
+        url = reverse('post-detail', args=[self.quiet.pk])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(ArchivedPost.objects.count(), 1)
+
+        cascade_delete(self.user, soft=False)
+        self.assertFalse(ArchivedPost.objects.exists())
+        self.assertFalse(ArchivedComment.objects.exists())
+        self.assertEqual(Profile.objects.get(user=self.other).comment_count, 0)
+
+
+
+# Test home feeds
+class FeedTestCase(APITestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=name, password=name) for name in ('bozo', 'ja', 'ti')]
+        self.post = Post.objects.create(author=self.users[1], title='title', text='text')
+        self.comments = [Comment.objects.create(author=self.users[i], post=self.post, text='text %d' % i)
+                         for i in (2, 0, 1)]
+        self.run_tasks()
+
+    def run_tasks(self):
+        with self.settings(TASK_WORKERS=0):
+            while tasks.run_due():
+                pass
+
+    def feed(self, user, **params):
+        self.client.force_authenticate(user)
+        response = self.client.get(reverse('user-feed', args=[user.pk]), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def entries(self, user):
+        return [(entry['type'], entry['object']['id']) for entry in self.feed(user)['results']]
+
+    def test_fan_out(self):
+        post, comments = self.post.pk, [comment.pk for comment in self.comments]
+        self.assertEqual(self.entries(self.users[0]), [('comment', comments[2]), ('post', post)])
+        self.assertEqual(self.entries(self.users[1]), [('comment', comments[1]), ('comment', comments[0])])
+        self.assertEqual(self.entries(self.users[2]),
+                         [('comment', comments[2]), ('comment', comments[1]), ('post', post)])
+        self.assertEqual(self.feed(self.users[0])['results'][1]['object']['author'], 'ja')
+
+    def test_owner_only(self):
+        url = reverse('user-feed', args=[self.users[0].pk])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.force_authenticate(self.users[1])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_runs_twice(self):
+        feed.fan_out_comments([comment.pk for comment in self.comments])
+        self.assertEqual(FeedEntry.objects.count(), 5)
+
+    def test_trimmed(self):
+        with self.settings(FEED_MAX_ENTRIES=3, FEED_TRIM_SLACK=2):
+            for i in range(5):
+                Comment.objects.create(author=self.users[2], post=self.post, text='more %d' % i)
+                self.run_tasks()
+                self.assertEqual(FeedEntry.objects.filter(user=self.users[0]).count(), [2, 3, 4, 5, 3][i])
+            newest = Comment.objects.order_by('-id').values_list('pk', flat=True)[:3]
+            self.assertEqual(self.entries(self.users[0]),
+                             [('comment', pk) for pk in newest] + [('post', self.post.pk)])
+            self.assertEqual(Profile.objects.get(user=self.users[0]).feed_size, 3)
+
+    def test_posts_capped(self):
+        posts = [Post.objects.create(author=self.users[1], title='title %d' % i, text='text') for i in range(3)]
+        Post.objects.create(author=self.users[0], title='own', text='text')
+        with self.settings(FEED_MAX_ENTRIES=2):
+            entries = self.entries(self.users[0])
+        self.assertEqual([pk for kind, pk in entries if kind == 'post'], [posts[2].pk, posts[1].pk])
+        self.assertIn(('comment', self.comments[2].pk), entries)
+
+    def test_pages(self):
+        for i in range(4):
+            Post.objects.create(author=self.users[1], title='title %d' % i, text='text')
+        Post.objects.create(author=self.users[0], title='own', text='text')
+        self.run_tasks()
+        # Posts and comments created at once come posts first.
+        now = timezone.now()
+        Post.objects.update(created=now)
+        FeedEntry.objects.update(created=now)
+        expected = self.entries(self.users[0])
+        posts = Post.objects.exclude(author=self.users[0]).order_by('-id').values_list('pk', flat=True)
+        self.assertEqual(expected, [('post', pk) for pk in posts] + [('comment', self.comments[2].pk)])
+
+        page = self.feed(self.users[0], page_size=2)
+        seen = []
+        while True:
+            seen += [(entry['type'], entry['object']['id']) for entry in page['results']]
+            if page['next'] is None:
+                break
+            page = self.client.get(page['next']).data
+        self.assertEqual(seen, expected)
+        previous = self.client.get(page['previous']).data['results']
+        self.assertEqual([entry['object']['id'] for entry in previous], [pk for _, pk in expected[2:4]])
+
+        with self.assertNumQueries(2):
+            self.feed(self.users[0], page_size=2)
+
+    def test_deleted(self):
+        self.client.force_authenticate(self.users[0])
+        self.client.delete(reverse('comment-detail', args=[self.comments[1].pk]))
+        self.assertEqual(len(self.entries(self.users[2])), 2)
+
+        cascade_delete(self.post, soft=True)
+        self.assertFalse(FeedEntry.objects.exists())
+        self.assertEqual(self.entries(self.users[0]), [])
+
+        post = Post.objects.create(author=self.users[1], title='old', text='text')
+        Comment.objects.create(author=self.users[0], post=post, text='text')
+        self.run_tasks()
+        self.assertTrue(FeedEntry.objects.filter(post=post).exists())
+        Post.objects.update(created=timezone.now() - timedelta(days=200))
+        Comment.objects.update(created=timezone.now() - timedelta(days=200))
+        archive(timedelta(days=30))
+        self.assertFalse(FeedEntry.objects.filter(post=post).exists())
+
+    def test_rebuild(self):
+        # Neither path feeds the comments of hidden authors.
+        Comment.objects.create(author=self.users[2], post=Post.objects.create(
+            author=self.users[0], title='title', text='text'), text='text')
+        self.run_tasks()
+        cascade_delete(self.users[2], soft=True)
+        fields = ('user', 'post', 'comment', 'created')
+        entries = FeedEntry.objects.filter(user__in=feed.readers()).order_by('user', 'created')
+        before = list(entries.values_list(*fields))
+        FeedEntry.objects.all().delete()
+
+        out = StringIO()
+        call_command('rebuild_feeds', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Rebuilt 2 feeds with 2 entries.')
+        self.assertEqual(list(entries.values_list(*fields)), before)
@@ -0,0 +1,119 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework import settings as api
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    `'100/min'` as `(100, 60)`: 100 requests per window of a minute.
+    """
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+class NoLock(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class WindowThrottle(BaseThrottle):
+    """
+    Request count per user, or per client IP for anonymous requests, over
+    fixed windows.
+
+    The rate comes from the first of these `DEFAULT_THROTTLE_RATES` names
+    that is set, and each name is counted separately:
+
+        <throttle_scope>.<user|anon>.<METHOD>
+        <throttle_scope>.<user|anon>
+        <user|anon>.<METHOD>
+        <user|anon>
+
+    where `throttle_scope` is an optional view attribute. Requests no name
+    matches are not throttled.
+
+    Each window has its own key, so a check is a single atomic `incr`, plus
+    an `add` for the first request of a window. Nothing is ever overwritten,
+    so concurrent requests are all counted. Denied requests count too, which
+    only matters to clients that keep retrying before the window ends.
+    """
+    lock = threading.Lock()
+    timer = time.time
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+
+    def get_rate_name(self, request, view):
+        kind = 'user' if request.user and request.user.is_authenticated else 'anon'
+        names = ['%s.%s' % (kind, request.method), kind]
+        scope = getattr(view, 'throttle_scope', None)
+        if scope:
+            names = ['%s.%s' % (scope, name) for name in names] + names
+        rates = self.get_rates()
+        for name in names:
+            if rates.get(name):
+                return name
+        return None
+
+    def get_rates(self):
+        # Looked up on the module, which replaces it when settings change.
+        return api.api_settings.DEFAULT_THROTTLE_RATES
+
+    def get_cache_key(self, request, name):
+        if request.user and request.user.is_authenticated:
+            return 'throttle:%s:%s' % (name, request.user.pk)
+        return 'throttle:%s:%s' % (name, self.get_ident(request))
+
+    def get_lock(self, cache):
+        # LocMemCache.incr() is a get and a set. Its entries never leave the
+        # process, so a process lock makes it atomic.
+        return self.lock if isinstance(cache, LocMemCache) else NoLock()
+
+    def hit(self, cache, key, period):
+        """
+        Count a request against `key` and return the count so far.
+        """
+        with self.get_lock(cache):
+            try:
+                return cache.incr(key)
+            except ValueError:
+                pass
+            # The window's first request. Keys outlive their window, so
+            # they expire on their own after a period.
+            if cache.add(key, 1, period):
+                return 1
+            return cache.incr(key)
+
+    def allow_request(self, request, view):
+        name = self.get_rate_name(request, view)
+        if name is None:
+            return True
+        count, period = parse_rate(self.get_rates()[name])
+        now = self.timer()
+        window = int(now // period)
+        key = '%s:%d' % (self.get_cache_key(request, name), window)
+
+        used = self.hit(self.cache, key, period)
+        allowed = used <= count
+        reset = (window + 1) * period - now
+
+        self.retry_after = 0 if allowed else reset
+        view.headers['RateLimit-Limit'] = str(count)
+        view.headers['RateLimit-Remaining'] = str(max(count - used, 0))
+        view.headers['RateLimit-Reset'] = str(int(math.ceil(reset)))
+        return allowed
+
+    def wait(self):
+        return self.retry_after
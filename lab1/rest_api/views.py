@@ -5,39 +5,102 @@ from .serializers import *
 from django.contrib.auth.models import User
 from rest_framework import permissions
 from .permissions import *
+from .pagination import FeedPagination, UserKeysetPagination
+from .cache import CachedResponseMixin
+from .conditional import ConditionalMixin
+from .bulk import BulkCreateMixin
+from .querysets import SerializerQuerysetMixin
+from .compiled import CompiledListMixin
+from .profiling import render_metrics
+from .db import BusyRetryMixin, retry_on_busy
+from django.http import HttpResponse
+from .search import SearchPagination, SearchQuery
+from .export import export_rows, ndjson_lines, parse_watermark
+from .events import EventStreamMixin
+from .filters import IdsFilter
+from .batch import dispatch
+from .deletion import CascadeDeleteMixin
+from .archive import ArchiveMixin
+from . import feed, tasks
+from collections import OrderedDict
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from django.conf import settings
+from django.db.models import Count, DateTimeField, IntegerField, Max, OuterRef, Prefetch, Subquery
 
 # Create your views here.
 
-class PostList(generics.ListCreateAPIView):
+post_queryset = Post.objects.select_related('author')
+
+comment_queryset = Comment.objects.select_related('author')
+
+# Archived threads stay hidden along with their soft-deleted author.
+archived_post_queryset = ArchivedPost.objects.select_related('author').filter(author__profile__deleted__isnull=True)
+
+archived_comment_queryset = ArchivedComment.objects.select_related('author').filter(
+    author__profile__deleted__isnull=True)
+
+user_queryset = User.objects.select_related('profile').filter(profile__deleted__isnull=True)
+
+# Reverse relations are only rendered as hyperlinks, so prefetch ids alone.
+post_prefetches = {
+    'comments': Prefetch('comments', queryset=Comment.objects.only('id', 'post')),
+}
+
+archived_post_prefetches = {
+    'comments': Prefetch('comments', queryset=ArchivedComment.objects.only('id', 'post')),
+}
+
+user_prefetches = {
+    'posts': Prefetch('posts', queryset=Post.objects.only('id', 'author')),
+    'comments': Prefetch('comments', queryset=Comment.objects.only('id', 'author')),
+}
+
+class PostList(BusyRetryMixin, BulkCreateMixin, CachedResponseMixin, ArchiveMixin, CompiledListMixin, SerializerQuerysetMixin, generics.ListCreateAPIView):
     """
     get:
-    Return a list of all the posts.
+    Return a list of all the posts, or of those in `ids`. Archived posts are
+    listed with `archive=true`.
 
     post:
-    Create a new post
+    Create a new post, or a batch of posts from a list.
     """
-    queryset = Post.objects.all()
+    queryset = post_queryset
+    related_prefetches = post_prefetches
+    archive_queryset = archived_post_queryset
+    archive_prefetches = archived_post_prefetches
+    filter_backends = (IdsFilter,)
+    cache_scopes = ('posts', 'usernames')
     serializer_class = PostSerializer
 
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
-    def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+    def get_create_kwargs(self):
+        return {'author': self.request.user}
 
 
-class PostByUserList(generics.ListAPIView):
+class PostByUserList(CachedResponseMixin, ArchiveMixin, CompiledListMixin, SerializerQuerysetMixin, generics.ListAPIView):
     """
-    Return a list of all posts of an user.
+    Return a list of all posts of an user, or of the archived ones with
+    `archive=true`.
     """
+    queryset = post_queryset
+    related_prefetches = post_prefetches
+    archive_queryset = archived_post_queryset
+    archive_prefetches = archived_post_prefetches
+    cache_scopes = ('user:{author}', 'usernames')
     serializer_class = PostSerializer
     
     def get_queryset(self):
-        return Post.objects.filter(author=self.kwargs['author'])
+        return super(PostByUserList, self).get_queryset().filter(author=self.kwargs['author'])
 
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
-class PostDetail(generics.RetrieveUpdateDestroyAPIView):
+class PostDetail(CascadeDeleteMixin, BusyRetryMixin, CachedResponseMixin, ConditionalMixin, ArchiveMixin, SerializerQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     get: 
     Return a post with the id.
@@ -48,49 +111,98 @@ class PostDetail(generics.RetrieveUpdateDestroyAPIView):
     delete:
     Delete a post with the id.
     """
-    queryset = Post.objects.all()
+    queryset = post_queryset
+    related_prefetches = post_prefetches
+    archive_queryset = archived_post_queryset
+    archive_prefetches = archived_post_prefetches
+    cache_scopes = ('post:{pk}', 'usernames')
     serializer_class = PostSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly,)
 
-class CommentList(generics.ListAPIView):
+    def get_validators(self):
+        rows = Post.objects.filter(pk=self.kwargs['pk']).order_by().values_list(
+            'updated', 'author__username', 'comment_count',
+        ).annotate(last_comment=Max('comments__updated'))
+        if not rows:
+            return None
+        return rows[0]
+
+class CommentList(CachedResponseMixin, ArchiveMixin, CompiledListMixin, SerializerQuerysetMixin, generics.ListAPIView):
     """
-    Return a list of all comments.
+    Return a list of all comments, or of those in `ids`. Archived comments
+    are listed with `archive=true`.
     """
-    queryset = Comment.objects.all()
+    queryset = comment_queryset
+    archive_queryset = archived_comment_queryset
+    cache_scopes = ('comments', 'usernames')
+    filter_backends = (IdsFilter,)
     serializer_class = CommentSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
-class CommentByPostList(generics.ListCreateAPIView):
+class CommentByPostList(BusyRetryMixin, BulkCreateMixin, CachedResponseMixin, ConditionalMixin, ArchiveMixin, CompiledListMixin, SerializerQuerysetMixin, generics.ListCreateAPIView):
     """
     get:
-    Return a list of all the comments of a post.
+    Return a list of all the comments of a post, or of an archived post with
+    `archive=true`.
 
     post:
-    Create a new comment to a post.
+    Create a new comment to a post, or a batch of comments from a list.
 
     """
+    queryset = comment_queryset
+    archive_queryset = archived_comment_queryset
+    cache_scopes = ('post:{post}:comments', 'usernames')
     serializer_class = CommentSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
     def get_queryset(self):
-        return Comment.objects.filter(post=self.kwargs['post'])
+        return super(CommentByPostList, self).get_queryset().filter(post=self.kwargs['post'])
 
-    def perform_create(self, serializer):
+    def get_validators(self):
+        # Comment or ArchivedComment, after ?archive=true.
+        version = self.queryset.model.objects.filter(post=self.kwargs['post']).aggregate(Max('updated'), Count('id'))
+        return version['updated__max'], version['id__count']
+
+    def get_create_kwargs(self):
         post = get_object_or_404(Post, pk=self.kwargs['post'])
-        serializer.save(author=self.request.user, post=post)
+        return {'author': self.request.user, 'post': post}
 
-class CommentByUserList(generics.ListAPIView):
+class CommentByUserList(CachedResponseMixin, ArchiveMixin, CompiledListMixin, SerializerQuerysetMixin, generics.ListAPIView):
     """
-    Return a list of all comments of an user.
+    Return a list of all comments of an user, or of the archived ones with
+    `archive=true`.
     """
+    queryset = comment_queryset
+    archive_queryset = archived_comment_queryset
+    cache_scopes = ('user:{author}', 'usernames')
     serializer_class = CommentSerializer
     
     def get_queryset(self):
-        return Comment.objects.filter(author=self.kwargs['author'])
+        return super(CommentByUserList, self).get_queryset().filter(author=self.kwargs['author'])
 
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
-class CommentDetail(generics.RetrieveUpdateDestroyAPIView):
+class FeedView(generics.ListAPIView):
+    """
+    Return the home feed of an user, newest first: the newest posts of
+    everybody else, and comments on the posts the user wrote or commented on.
+    """
+    serializer_class = FeedEntrySerializer
+    pagination_class = FeedPagination
+    permission_classes = (permissions.IsAuthenticated, IsFeedOwner)
+
+    def get_queryset(self):
+        # Merged by FeedPagination. Only the comments are materialized per
+        # user; everybody's posts are one index scan of the posts table,
+        # which stops at the newest FEED_MAX_ENTRIES of them like the
+        # comments do.
+        user = self.kwargs['pk']
+        posts = post_queryset.exclude(author=user)
+        newest = posts.order_by('-created', '-id').values('pk')[:feed.max_entries()]
+        return [posts.filter(pk__in=newest),
+                FeedEntry.objects.filter(user=user).select_related('comment__author')]
+
+class CommentDetail(BusyRetryMixin, CachedResponseMixin, ConditionalMixin, ArchiveMixin, SerializerQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     """
     get: 
     Return a comment with the id.
@@ -101,15 +213,23 @@ class CommentDetail(generics.RetrieveUpdateDestroyAPIView):
     delete:
     Delete a comment with the id.
     """
-    queryset = Comment.objects.all()
+    queryset = comment_queryset
+    archive_queryset = archived_comment_queryset
+    cache_scopes = ('comment:{pk}', 'usernames')
     serializer_class = CommentSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly,)
 
+    def get_validators(self):
+        rows = Comment.objects.filter(pk=self.kwargs['pk']).values_list('updated', 'author__username')
+        if not rows:
+            return None
+        return rows[0]
+
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(CascadeDeleteMixin, BusyRetryMixin, ConditionalMixin, CompiledListMixin, SerializerQuerysetMixin, viewsets.ModelViewSet):
     """
     list:
-    Return a list of all users.
+    Return a list of all users, or of those in `ids`.
 
     retrieve:
     Return an user with the id.
@@ -123,7 +243,179 @@ class UserViewSet(viewsets.ModelViewSet):
     delete:
     Deletes an user.
     """
-    queryset = User.objects.all()
+    queryset = user_queryset
+    related_prefetches = user_prefetches
     serializer_class = UserSerializer
+    pagination_class = UserKeysetPagination
+    filter_backends = (IdsFilter,)
     permission_classes = (UserIsOwnerOrReadAndCreateOnly,)
 
+    def get_validators(self):
+        if 'pk' not in self.kwargs:
+            return None
+
+        def authored(model, aggregate, output_field):
+            related = model.objects.filter(author=OuterRef('pk')).order_by().values('author')
+            return Subquery(related.annotate(value=aggregate).values('value'), output_field=output_field)
+
+        rows = User.objects.filter(pk=self.kwargs['pk']).annotate(
+            last_post=authored(Post, Max('updated'), DateTimeField()),
+            post_count=authored(Post, Count('id'), IntegerField()),
+            last_comment=authored(Comment, Max('updated'), DateTimeField()),
+            comment_count=authored(Comment, Count('id'), IntegerField()),
+        ).values_list('last_post', 'last_comment', 'username', 'email', 'post_count', 'comment_count')
+        if not rows:
+            return None
+        return rows[0]
+
+
+class TokenView(generics.GenericAPIView):
+    """
+    post:
+    Issue a new API token for the given credentials.
+
+    delete:
+    Revoke the token used for this request, or all tokens of the user.
+    """
+    serializer_class = AuthTokenSerializer
+    permission_classes = (IsAuthenticatedOrCreateOnly,)
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token, key = retry_on_busy(Token.issue, serializer.validated_data['user'])
+        return Response({'token': key}, status=status.HTTP_201_CREATED)
+
+    def delete(self, request, *args, **kwargs):
+        tokens = Token.objects.filter(user=request.user)
+        if isinstance(request.auth, str):
+            tokens = tokens.filter(key=request.auth)
+        for token in tokens:
+            retry_on_busy(token.delete)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class SearchView(generics.GenericAPIView):
+    """
+    get:
+    Full-text search over post titles, post texts and comment texts, best
+    matches first. Filter by author id with `author`.
+    """
+    pagination_class = SearchPagination
+    throttle_scope = 'search'
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+
+    def get(self, request, *args, **kwargs):
+        text = request.query_params.get('q', '')
+        if not text.strip():
+            raise ValidationError({'q': 'This query parameter is required.'})
+
+        author = request.query_params.get('author')
+        if author is not None and not author.isdigit():
+            raise ValidationError({'author': 'A valid user id is required.'})
+
+        hits = self.paginate_queryset(SearchQuery(text, author=author))
+        found = {
+            'post': post_queryset.in_bulk([hit.id for hit in hits if hit.kind == 'post']),
+            'comment': comment_queryset.in_bulk([hit.id for hit in hits if hit.kind == 'comment']),
+        }
+        serializer_classes = {'post': PostSerializer, 'comment': CommentSerializer}
+        context = self.get_serializer_context()
+
+        results = []
+        for hit in hits:
+            obj = found[hit.kind].get(hit.id)
+            if obj is None:
+                continue
+            results.append(OrderedDict([
+                ('type', hit.kind),
+                ('rank', hit.rank),
+                ('object', serializer_classes[hit.kind](obj, context=context).data),
+            ]))
+        return self.get_paginated_response(results)
+
+
+class ExportView(generics.GenericAPIView):
+    """
+    get:
+    Stream every post or comment as newline delimited JSON, oldest first.
+    Resume an interrupted export by passing the `created` and `id` of the
+    last received row as `after_created` and `after_id`.
+    """
+    throttle_scope = 'export'
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+
+    def get(self, request, kind, *args, **kwargs):
+        after = None
+        if 'after_created' in request.query_params or 'after_id' in request.query_params:
+            try:
+                after = parse_watermark(request.query_params.get('after_created'),
+                                        request.query_params.get('after_id'))
+            except DjangoValidationError:
+                raise ValidationError('after_created and after_id must come from an exported row.')
+            if None in after:
+                raise ValidationError('after_created and after_id must be given together.')
+
+        chunk_size = getattr(settings, 'EXPORT_CHUNK_SIZE', 1000)
+        return StreamingHttpResponse(
+            ndjson_lines(export_rows(kind, after=after, chunk_size=chunk_size)),
+            content_type='application/x-ndjson')
+
+
+class PostStream(EventStreamMixin, generics.GenericAPIView):
+    """
+    get:
+    Server-sent events for created, updated and deleted posts. Reconnect with
+    `Last-Event-ID` to receive the events missed in between; a `reset` event
+    means they are gone and the post list should be fetched again.
+    """
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+
+    def get_channel(self):
+        return 'posts'
+
+
+class CommentByPostStream(EventStreamMixin, generics.GenericAPIView):
+    """
+    get:
+    Server-sent events for created, updated and deleted comments on the post,
+    resumable like the post stream.
+    """
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+
+    def get_channel(self):
+        post = get_object_or_404(Post.objects.only('id'), pk=self.kwargs['post'])
+        return 'post:%s:comments' % post.pk
+
+
+class BatchView(generics.GenericAPIView):
+    """
+    post:
+    Run a list of requests, each `{"method", "url", "body", "headers"}`, in
+    order and return their `{"status", "headers", "body"}`. They are made as
+    the user of this request, and each succeeds or fails on its own. Binary
+    bodies, such as MessagePack ones, come base64 encoded with
+    `"encoding": "base64"`.
+    """
+    serializer_class = BatchRequestSerializer
+    permission_classes = (permissions.AllowAny,)
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        max_size = getattr(settings, 'BATCH_MAX_REQUESTS', 50)
+        if len(serializer.validated_data) > max_size:
+            raise ValidationError('At most %d requests can be batched.' % max_size)
+        return Response([dispatch(request, **sub) for sub in serializer.validated_data])
+
+
+class MetricsView(generics.GenericAPIView):
+    """
+    get:
+    Request latency and query count histograms of this process, and the
+    background task queue depth, in the Prometheus text format.
+    """
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render_metrics() + tasks.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')